@@ -2,6 +2,7 @@ from .documents import router as documents_router
 from .query import router as query_router
 from .health import router as health_router
 from .memory import router as memory_router
+from .migration import router as migration_router
 
-__all__ = ["documents_router", "query_router", "health_router", "memory_router"]
+__all__ = ["documents_router", "query_router", "health_router", "memory_router", "migration_router"]
 
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+import os
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query, Request
 from typing import List, Optional
 from app.models.document import DocumentUploadRequest, DocumentListResponse
 from app.services.document_service import DocumentService
+from app.services.ingest_queue import IngestQueueFullError
+from app.config import settings
 
 router = APIRouter(prefix="/api/documents", tags=["documents"])
 
@@ -9,8 +12,19 @@ document_service = DocumentService()
 
 @router.post("/upload", response_model=dict)
 async def upload_document(request: DocumentUploadRequest):
-    """上传文档"""
+    """上传文档（默认异步入库，返回任务ID，可通过 /jobs/{job_id} 查询进度）"""
     try:
+        if settings.ingest_async_enabled:
+            job = document_service.submit_document(request)
+            return {
+                "document_id": job["document_id"],
+                "title": job["title"],
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "message": "文档已加入入库队列",
+                "processing_time": 0.0
+            }
+        
         document = await document_service.upload_document(request)
         return {
             "document_id": document.id,
@@ -18,6 +32,10 @@ async def upload_document(request: DocumentUploadRequest):
             "message": "文档上传成功",
             "processing_time": 0.0
         }
+    except IngestQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -25,17 +43,36 @@ async def upload_document(request: DocumentUploadRequest):
 async def upload_text_document(
     title: str = Form(...),
     content: str = Form(...),
-    metadata: Optional[str] = Form(None)
+    metadata: Optional[str] = Form(None),
+    collection: Optional[str] = Form(None)
 ):
     """上传文本文档"""
     try:
         import json
         metadata_dict = json.loads(metadata) if metadata else {}
         
+        if settings.ingest_async_enabled:
+            job = document_service.submit_document(DocumentUploadRequest(
+                title=title,
+                content=content,
+                file_type="text",
+                metadata=metadata_dict,
+                collection=collection
+            ))
+            return {
+                "document_id": job["document_id"],
+                "title": job["title"],
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "message": "文本文档已加入入库队列",
+                "processing_time": 0.0
+            }
+        
         document = await document_service.upload_text_document(
             title=title,
             content=content,
-            metadata=metadata_dict
+            metadata=metadata_dict,
+            collection=collection
         )
         
         return {
@@ -44,20 +81,92 @@ async def upload_text_document(
             "message": "文本文档上传成功",
             "processing_time": 0.0
         }
+    except IngestQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/upload-file", response_model=dict)
+async def upload_file(
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+    collection: Optional[str] = Form(None)
+):
+    """流式上传文本文件（multipart），按块读取并边分块边向量化，适合大文件"""
+    try:
+        file_type = os.path.splitext(file.filename or "")[1].lstrip(".").lower() or "text"
+        result = await document_service.upload_file(
+            file.file,
+            title=title or file.filename or "untitled",
+            file_type=file_type,
+            collection=collection
+        )
+        result["message"] = "文件上传成功"
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+
+@router.post("/bulk", response_model=dict)
+async def bulk_upload_documents(
+    request: Request,
+    collection: Optional[str] = Query(None, description="默认写入的集合，行内 collection 字段优先")
+):
+    """批量导入文档：请求体为NDJSON（每行一个文档），按批向量化和写入，返回每个文档的结果"""
+    try:
+        return await document_service.bulk_ingest(request.stream(), collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/list", response_model=DocumentListResponse)
 async def list_documents(
     page: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1, le=100)
+    page_size: int = Query(10, ge=1, le=100),
+    collection: Optional[str] = Query(None, description="集合名称，默认集合")
 ):
     """获取文档列表"""
     try:
-        return await document_service.list_documents(page, page_size)
+        return await document_service.list_documents(page, page_size, collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/collections")
+async def list_collections():
+    """获取集合列表及各集合统计"""
+    try:
+        collections = document_service.list_collections()
+        return {
+            "collections": collections,
+            "total_count": len(collections)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs")
+async def list_ingest_jobs(limit: int = Query(50, ge=1, le=500)):
+    """获取最近的入库任务及队列状态"""
+    try:
+        return document_service.list_ingest_jobs(limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """查询入库任务状态"""
+    job = document_service.get_ingest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
 @router.get("/{document_id}")
 async def get_document(document_id: str):
     """获取单个文档"""
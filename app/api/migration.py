@@ -0,0 +1,51 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from pydantic import BaseModel
+from app.services.model_migration import get_model_migration
+
+router = APIRouter(prefix="/api/migration", tags=["migration"])
+
+
+class MigrationStartRequest(BaseModel):
+    """开始模型迁移请求"""
+    target_model: Optional[str] = None  # 目标向量模型，默认为配置中的 embedding_model
+
+
+@router.post("/start")
+async def start_migration(request: MigrationStartRequest):
+    """开始向量模型迁移：后台构建影子索引，查询继续使用当前索引"""
+    try:
+        return get_model_migration().start(request.target_model)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/status")
+async def migration_status():
+    """获取迁移进度和影子索引召回率"""
+    return get_model_migration().get_status()
+
+
+@router.post("/switch")
+async def switch_migration(force: bool = Query(False, description="忽略召回率阈值强制切换")):
+    """切换到新模型的索引"""
+    try:
+        return await asyncio.to_thread(get_model_migration().switch, force)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/cancel")
+async def cancel_migration():
+    """取消迁移并删除影子索引"""
+    try:
+        return await asyncio.to_thread(get_model_migration().cancel)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, HTTPException, Query
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from app.models.document import QueryRequest, QueryResponse
 from app.services.query_service import QueryService
 
@@ -25,7 +25,8 @@ async def ask_question(request: QueryRequest):
 async def search_documents(
     q: str = Query(..., description="搜索查询"),
     top_k: int = Query(10, ge=1, le=50, description="返回结果数量"),
-    threshold: float = Query(0.5, ge=0.0, le=1.0, description="相似度阈值")
+    threshold: float = Query(0.5, ge=0.0, le=1.0, description="相似度阈值"),
+    collection: Optional[List[str]] = Query(None, description="搜索的集合，可重复指定多个")
 ):
     """搜索文档"""
     try:
@@ -35,7 +36,8 @@ async def search_documents(
         results = await query_service.search_documents(
             query=q,
             top_k=top_k,
-            threshold=threshold
+            threshold=threshold,
+            collections=collection
         )
         
         return {
@@ -63,6 +65,22 @@ async def get_suggestions(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """获取查询缓存统计信息"""
+    try:
+        return query_service.get_cache_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/metrics/latency")
+async def get_latency_stats():
+    """获取查询各阶段延迟统计"""
+    try:
+        return query_service.get_latency_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/health")
 async def query_health_check():
     """查询服务健康检查"""
@@ -26,6 +26,7 @@ class Settings(BaseSettings):
     # 向量数据库配置
     vector_backend: str = "faiss"  # 支持: local, chromadb, faiss
     vector_dimension: int = 768
+    default_collection: str = "default"  # 默认集合，对应原有的 langchain_vectorstore 目录
     
     # 文档存储配置
     document_backend: str = "faiss"  # 支持: local, mysql, mongodb, elasticsearch, faiss
@@ -33,6 +34,17 @@ class Settings(BaseSettings):
     # 向量化配置
     embedding_model: str = "shibing624/text2vec-base-chinese"  # 中文模型，适合中文检索
     embedding_device: str = "cpu"  # cpu, cuda
+    embedding_backend: str = "torch"  # torch, onnx（ONNX Runtime + 动态int8量化，仅CPU，需安装 onnx、onnxruntime；不可用时回退torch）
+    onnx_quantize: bool = True  # onnx后端是否使用int8量化模型
+    onnx_parity_min_cosine: float = 0.99  # onnx向量与torch向量的最低余弦一致度，低于此值回退torch
+    onnx_threads: int = 0  # ONNX Runtime 算子内并行线程数（0 表示默认）
+    migration_max_chunks_per_second: float = 50.0  # 模型迁移：影子索引构建限速（块/秒），0表示不限速
+    migration_batch_documents: int = 20  # 模型迁移：每批写入影子索引的文档数
+    migration_sync_interval: float = 30.0  # 模型迁移：影子索引就绪后与线上集合对账的间隔（秒）
+    migration_sample_rate: float = 0.1  # 模型迁移：抽样对比召回率的查询比例
+    migration_recall_k: int = 10  # 模型迁移：召回率按前k个块计算
+    migration_min_samples: int = 20  # 模型迁移：切换前至少需要的抽样数
+    migration_min_recall: float = 0.6  # 模型迁移：切换前要求的平均召回率
     
     # LLM 配置
     llm_provider: str = "mock"  # 支持: mock, openai, anthropic, local
@@ -44,11 +56,87 @@ class Settings(BaseSettings):
     chunk_size: int = 1000
     chunk_overlap: int = 200
     max_tokens: int = 4000
+    ingest_async_enabled: bool = True  # 上传接口只入队，由后台工作协程完成分块、向量化和写入
+    ingest_workers: int = 2  # 入库工作协程数
+    ingest_queue_max_size: int = 100  # 入库队列上限，满时上传接口返回503
+    ingest_job_history: int = 1000  # 保留的已结束任务数（用于状态查询）
+    ingest_embed_batch_chunks: int = 256  # 批量导入/流式上传：每攒够多少个块向量化并写入一次
+    ingest_clean_text: bool = False  # 分块前是否用 TextProcessor.clean_text 清洗文本
+    preprocess_workers: int = 0  # 批量导入的预处理（清洗、分块）进程数，0表示CPU核数，1表示不用进程池
+    preprocess_max_pending: int = 64  # 预处理进程池中同时在途的文档数上限
+    bulk_ingest_batch_documents: int = 200  # 批量导入：每批最多文档数，一批只向量化一次、保存一次索引
+    bulk_ingest_batch_chars: int = 2000000  # 批量导入：每批累计字符数上限
+    bulk_ingest_max_line_bytes: int = 10485760  # 批量导入：单行（单个文档）最大字节数
+    stream_read_block_bytes: int = 1048576  # 文件流式上传：每次读取的字节数
+    stream_split_window_chars: int = 200000  # 文件流式上传：增量分块的窗口字符数
+    context_token_budget: int = 3000  # prompt总token预算（模板+问题+历史+检索块）
+    history_token_budget: int = 800  # 其中会话历史最多占用的token数
+    context_compression_enabled: bool = False  # 是否在生成前做抽取式上下文压缩
+    context_compression_max_chars: int = 1500  # 压缩后保留的最大字符数
+    context_compression_min_sentence_chars: int = 4  # 过短的句子直接丢弃
     
     # 搜索配置
     similarity_threshold: float = 0.3  # 降低相似度阈值，提高召回率
     top_k: int = 10  # 返回前10个最相关结果
     max_results: int = 20  # 最大返回结果数
+    hybrid_search_enabled: bool = True  # 向量检索 + BM25关键词检索，RRF融合
+    hybrid_candidate_multiplier: int = 4  # 每路召回 top_k * 倍数 个候选参与融合
+    rrf_k: int = 60  # RRF平滑常数
+    
+    # 重排序配置（ANN宽召回 -> 交叉编码器重排前N个 -> 少量块送入LLM）
+    rerank_enabled: bool = True
+    rerank_model: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # 多语言小模型，适合CPU
+    rerank_candidates: int = 100  # 第一阶段召回的候选数
+    rerank_top_n: int = 20  # 交给交叉编码器打分的候选数
+    rerank_final_k: int = 5  # 重排后最多送入LLM的块数
+    rerank_budget_ms: int = 200  # 每个请求的重排序时间预算（毫秒）
+    rerank_batch_size: int = 8  # 交叉编码器每批打分的候选数
+    
+    # MMR多样化配置（剔除高度重叠的相邻块）
+    mmr_enabled: bool = False
+    mmr_lambda: float = 0.5  # 相关性与多样性的权衡，1为只看相关性
+    mmr_fetch_multiplier: int = 3  # 未启用重排序时，召回 top_k * 倍数 个候选供MMR选择
+    mmr_duplicate_threshold: float = 0.95  # 与已选块余弦相似度达到该值视为重复，直接剔除
+    
+    # 相邻块合并与扩展配置
+    chunk_merge_enabled: bool = True  # 同一文档中相邻/重叠的检索块合并为一段
+    neighbor_expansion_enabled: bool = False  # 预算有余量时为靠前的块补充相邻块
+    neighbor_expansion_top_n: int = 1  # 只为排名前N的块补充相邻块
+    
+    # 语义答案缓存配置
+    answer_cache_enabled: bool = True
+    answer_cache_similarity_threshold: float = 0.95  # 查询向量余弦相似度阈值
+    answer_cache_max_entries: int = 1000  # 最大缓存条目数（LRU淘汰）
+    answer_cache_ttl_seconds: int = 3600  # 缓存有效期（秒），0表示不过期
+    
+    # 精确匹配响应缓存配置
+    response_cache_enabled: bool = True
+    response_cache_max_bytes: int = 64 * 1024 * 1024  # 缓存占用内存上限（字节）
+    
+    # 检索结果缓存配置（查询向量 -> 块ID和分数）
+    retrieval_cache_enabled: bool = True
+    retrieval_cache_max_bytes: int = 16 * 1024 * 1024
+    
+    # 查询向量缓存配置（进程内LRU + 磁盘持久层）
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_entries: int = 10000  # 进程内LRU容量
+    embedding_cache_persist: bool = True  # 是否持久化到 data/embedding_cache
+    chunk_embedding_cache_enabled: bool = True  # 入库时按内容哈希复用块向量
+    
+    # 查询向量微批处理：并发查询在短时间窗口内合并为一次批量前向计算
+    embedding_micro_batch_enabled: bool = True
+    embedding_micro_batch_max_size: int = 32  # 每批最多条数，凑满立即计算
+    embedding_micro_batch_max_wait_ms: float = 5.0  # 凑批最长等待（毫秒）
+    
+    # 批量向量化按token长度分桶：长度相近的文本同批计算，减少填充
+    embedding_batch_max_tokens: int = 8192  # 每批填充后的token预算（批大小×批内最长token数），0 表示不分桶
+    embedding_batch_max_size: int = 128  # 每批最多条数
+    
+    # 模型推理线程池：向量化等torch推理在专用线程中执行，不阻塞事件循环
+    inference_workers: int = 1  # 同时执行推理的线程数（CPU上并行推理会争抢核心，一般保持1）
+    inference_torch_threads: int = 0  # torch 算子内并行线程数（0 表示使用torch默认值）
+    inference_torch_interop_threads: int = 0  # torch 算子间并行线程数（0 表示使用torch默认值）
+    inference_batch_slice_tokens: int = 2048  # 批量向量化（入库）每次提交到推理线程的填充后token上限，查询最多排队一片；0 表示整批一次提交
     
     # 数据目录
     data_dir: str = "data"
@@ -1,8 +1,20 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from app.config import settings
-from app.api import documents_router, query_router, health_router, memory_router
+from app.api import documents_router, query_router, health_router, memory_router, migration_router
+from app.services.reranker import get_reranker
+from app.utils.inference_executor import run_inference_async
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时加载重排序模型（向量化模型在导入路由时已加载），首个请求不再承担模型下载和加载"""
+    if settings.rerank_enabled:
+        await run_inference_async(get_reranker().warmup)
+    yield
+
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -10,7 +22,8 @@ app = FastAPI(
     version=settings.app_version,
     description="基于向量数据库的文档检索和问答系统",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -27,6 +40,7 @@ app.include_router(documents_router)
 app.include_router(query_router)
 app.include_router(health_router)
 app.include_router(memory_router)
+app.include_router(migration_router)
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -1,14 +1,31 @@
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Annotated
+from pydantic import BaseModel, Field, BeforeValidator, PlainSerializer
+import numpy as np
 import uuid
 
+
+def _to_float32_vector(value):
+    """向量统一为连续的float32一维数组"""
+    if value is None:
+        return None
+    return np.ascontiguousarray(value, dtype=np.float32).reshape(-1)
+
+
+# 内部保存为float32数组，只在序列化为JSON（API响应）时转换为列表
+Float32Vector = Annotated[
+    Optional[Any],
+    BeforeValidator(_to_float32_vector),
+    PlainSerializer(lambda vector: None if vector is None else vector.tolist(), return_type=Optional[List[float]],
+                    when_used="json")
+]
+
 class DocumentChunk(BaseModel):
     """文档块模型"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     content: str
     metadata: Dict[str, Any] = Field(default_factory=dict)
-    embedding: Optional[List[float]] = None
+    embedding: Float32Vector = None
     chunk_index: int = 0
     
 class Document(BaseModel):
@@ -40,6 +57,7 @@ class DocumentUploadRequest(BaseModel):
     content: str
     file_type: Optional[str] = "text"
     metadata: Optional[Dict[str, Any]] = Field(default_factory=dict)
+    collection: Optional[str] = Field(default=None, description="目标集合，默认写入默认集合")
 
 class QueryRequest(BaseModel):
     """查询请求模型"""
@@ -48,6 +66,13 @@ class QueryRequest(BaseModel):
     top_k: int = Field(default=5, ge=1, le=20)
     threshold: float = Field(default=0.7, ge=0.0, le=1.0)
     include_metadata: bool = True
+    compress_context: Optional[bool] = Field(default=None, description="是否压缩检索上下文，默认使用配置")
+    hybrid_search: Optional[bool] = Field(default=None, description="是否使用向量+BM25混合检索，默认使用配置")
+    rerank: Optional[bool] = Field(default=None, description="是否使用交叉编码器重排序，默认使用配置")
+    use_mmr: Optional[bool] = Field(default=None, description="是否使用MMR多样化去除重叠块，默认使用配置")
+    mmr_lambda: Optional[float] = Field(default=None, ge=0.0, le=1.0, description="MMR相关性权重，默认使用配置")
+    expand_neighbors: Optional[bool] = Field(default=None, description="是否为靠前的块补充相邻块，默认使用配置")
+    collections: Optional[List[str]] = Field(default=None, description="查询的集合列表，多个集合合并取top_k，默认只查询默认集合")
     """查询请求模型"""
     query: str
     top_k: int = Field(default=5, ge=1, le=20)
@@ -62,6 +87,8 @@ class QueryResponse(BaseModel):
     confidence: float = 0.0
     processing_time: float = 0.0
     total_chunks_retrieved: int = 0
+    cache_hit: bool = False
+    prompt_tokens: int = 0
 
 class DocumentUploadResponse(BaseModel):
     """文档上传响应模型"""
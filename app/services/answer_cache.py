@@ -0,0 +1,196 @@
+"""
+语义答案缓存
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Iterable
+import numpy as np
+from app.config import settings
+from app.utils.similarity import normalize_rows, cosine_similarity_matrix
+
+
+class SemanticAnswerCache:
+    """基于查询向量相似度的答案缓存（LRU + TTL）
+
+    命中条件：查询向量余弦相似度不低于阈值，且检索到的块ID集合、会话历史摘要与缓存时一致、
+    向量存储版本未变化。命中时直接复用答案，跳过LLM调用。
+    历史对话会写入prompt，因此答案只在历史相同时复用，不同会话之间不会串用。
+    """
+
+    def __init__(self, similarity_threshold: float = None, max_entries: int = None, ttl_seconds: int = None):
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None else settings.answer_cache_similarity_threshold
+        self.max_entries = max_entries if max_entries is not None else settings.answer_cache_max_entries
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.answer_cache_ttl_seconds
+
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        # 预分配的查询向量矩阵：每个条目占一行，写入时原地写行，删除时空出该行供复用
+        self._matrix: Optional[np.ndarray] = None
+        self._row_entries = np.empty(0, dtype=np.int64)  # 行 -> 条目ID，空行为-1
+        self._row_versions = np.empty(0, dtype=np.int64)  # 行 -> 写入时的向量存储版本
+        self._rows_used = 0  # 用到过的最大行数，只计算前这么多行
+        self._free_rows: List[int] = []
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.chunk_mismatches = 0
+        self.history_mismatches = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        """归一化向量"""
+        return normalize_rows(np.asarray(vector, dtype=np.float32).reshape(-1))
+
+    def _remove(self, entry_id: int):
+        """删除条目并空出它在矩阵中的行"""
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._row_entries[entry["row"]] = -1
+            self._free_rows.append(entry["row"])
+
+    def _expire(self, now: float):
+        """清理过期条目"""
+        if self.ttl_seconds <= 0:
+            return
+        expired = [entry_id for entry_id, entry in self._entries.items()
+                   if now - entry["created_at"] > self.ttl_seconds]
+        for entry_id in expired:
+            self._remove(entry_id)
+        self.expirations += len(expired)
+
+    def _reset(self):
+        """清空条目和矩阵"""
+        self._entries.clear()
+        self._matrix = None
+        self._row_entries = np.empty(0, dtype=np.int64)
+        self._row_versions = np.empty(0, dtype=np.int64)
+        self._rows_used = 0
+        self._free_rows = []
+
+    def _allocate_row(self, dim: int) -> int:
+        """取一个空行；向量维度变化（切换了向量模型）时清空旧条目，容量不足时至少翻倍扩容"""
+        if self._matrix is not None and self._matrix.shape[1] != dim:
+            self.invalidations += len(self._entries)
+            self._reset()
+        if self._free_rows:
+            return self._free_rows.pop()
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        if self._rows_used == capacity:
+            capacity = min(max(2 * capacity, 64), max(self.max_entries, 1))
+            matrix = np.zeros((capacity, dim), dtype=np.float32)
+            row_entries = np.full(capacity, -1, dtype=np.int64)
+            row_versions = np.zeros(capacity, dtype=np.int64)
+            if self._matrix is not None:
+                matrix[:self._rows_used] = self._matrix[:self._rows_used]
+                row_entries[:self._rows_used] = self._row_entries[:self._rows_used]
+                row_versions[:self._rows_used] = self._row_versions[:self._rows_used]
+            self._matrix, self._row_entries, self._row_versions = matrix, row_entries, row_versions
+        self._rows_used += 1
+        return self._rows_used - 1
+
+    def lookup(self, query_vector, chunk_ids: Iterable[str], index_version: int,
+               history_digest: str = "") -> Optional[Dict[str, Any]]:
+        """查找可复用的答案，未命中返回None
+
+        history_digest 为生成答案时会话历史的摘要（无历史为空字符串）。
+        """
+        with self._lock:
+            self._expire(time.time())
+            query = self._normalize(query_vector)
+            if not self._entries or query.shape[0] != self._matrix.shape[1]:
+                # 维度不同的条目来自切换前的向量模型，不可能命中
+                self.misses += 1
+                return None
+
+            # 先按版本过滤：版本号单调递增，旧版本条目永远不会再命中，直接删除
+            rows = self._row_entries[:self._rows_used]
+            stale = rows[(rows >= 0) & (self._row_versions[:self._rows_used] != index_version)]
+            for entry_id in stale.tolist():
+                self._remove(entry_id)
+            self.invalidations += len(stale)
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            similarities = cosine_similarity_matrix(query, self._matrix[:self._rows_used], normalized=True)
+            similarities[rows < 0] = -np.inf
+            chunk_set = frozenset(chunk_ids)
+
+            # 只对超过阈值的少数条目排序
+            above = np.flatnonzero(similarities >= self.similarity_threshold)
+            hit = None
+            for pos in above[np.argsort(-similarities[above], kind="stable")]:
+                similarity = float(similarities[pos])
+                entry_id = int(rows[pos])
+                entry = self._entries[entry_id]
+                if entry["chunk_ids"] != chunk_set:
+                    self.chunk_mismatches += 1
+                    continue
+                if entry["history_digest"] != history_digest:
+                    self.history_mismatches += 1
+                    continue
+                hit = (entry_id, entry, similarity)
+                break
+
+            if hit is None:
+                self.misses += 1
+                return None
+
+            entry_id, entry, similarity = hit
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return {**entry["result"], "cache_similarity": similarity}
+
+    def store(self, query_vector, chunk_ids: Iterable[str], index_version: int, result: Dict[str, Any],
+              history_digest: str = ""):
+        """缓存答案"""
+        if self.max_entries <= 0:
+            return
+        vector = self._normalize(query_vector)
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            row = self._allocate_row(vector.shape[0])
+            entry_id = self._next_id
+            self._next_id += 1
+            self._matrix[row] = vector
+            self._row_entries[row] = entry_id
+            self._row_versions[row] = index_version
+            self._entries[entry_id] = {
+                "row": row,
+                "chunk_ids": frozenset(chunk_ids),
+                "index_version": index_version,
+                "history_digest": history_digest,
+                "result": dict(result),
+                "created_at": time.time()
+            }
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._reset()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "similarity_threshold": self.similarity_threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "chunk_mismatches": self.chunk_mismatches,
+            "history_mismatches": self.history_mismatches
+        }
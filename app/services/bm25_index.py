@@ -0,0 +1,183 @@
+"""
+BM25倒排索引
+"""
+
+import os
+import re
+import math
+import zlib
+import pickle
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+import numpy as np
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """倒数排名融合（RRF）：score(d) = Σ 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+class BM25Index:
+    """进程内BM25倒排索引
+
+    中文按字符二元组切分，英文和数字按词切分（保留精确标识符）。
+    支持随入库增量更新；删除时先打墓碑标记，墓碑超过 compact_ratio 比例或持久化时压缩。
+    文档频率和平均文档长度只统计未删除的文档，压缩前后分数一致。
+    """
+
+    _CJK_PATTERN = re.compile(r'[一-鿿]+|[a-z0-9_]+')
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, compact_ratio: float = 0.2):
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self._doc_ids: List[Optional[str]] = []  # 序号 -> 块ID，已删除为None
+        self._ordinals: Dict[str, int] = {}
+        self._doc_lens: List[int] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """分词：中文字符二元组 + 英文/数字词"""
+        tokens = []
+        for run in cls._CJK_PATTERN.findall(text.lower()):
+            if '一' <= run[0] <= '鿿':
+                if len(run) == 1:
+                    tokens.append(run)
+                else:
+                    tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            else:
+                tokens.append(run)
+        return tokens
+
+    def __len__(self) -> int:
+        return len(self._ordinals)
+
+    def add(self, chunk_id: str, text: str):
+        """添加（或替换）一个文档块"""
+        with self._lock:
+            if chunk_id in self._ordinals:
+                self.remove([chunk_id])
+            tokens = self.tokenize(text)
+            ordinal = len(self._doc_ids)
+            self._doc_ids.append(chunk_id)
+            self._ordinals[chunk_id] = ordinal
+            self._doc_lens.append(len(tokens))
+            self._total_len += len(tokens)
+            for term, tf in Counter(tokens).items():
+                self._postings.setdefault(term, {})[ordinal] = tf
+
+    def add_many(self, items: Iterable[Tuple[str, str]]):
+        """批量添加 (块ID, 文本)"""
+        with self._lock:
+            for chunk_id, text in items:
+                self.add(chunk_id, text)
+
+    def remove(self, chunk_ids: Iterable[str]):
+        """删除文档块（墓碑标记，墓碑比例超过 compact_ratio 时压缩）"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                ordinal = self._ordinals.pop(chunk_id, None)
+                if ordinal is None:
+                    continue
+                self._doc_ids[ordinal] = None
+                self._total_len -= self._doc_lens[ordinal]
+            if len(self._doc_ids) - len(self._ordinals) > self.compact_ratio * len(self._doc_ids):
+                self._compact()
+
+    def _compact(self):
+        """去掉墓碑：序号重新编号，倒排表只保留未删除的文档"""
+        live = [ordinal for ordinal, chunk_id in enumerate(self._doc_ids) if chunk_id is not None]
+        if len(live) == len(self._doc_ids):
+            return
+        remap = {old: new for new, old in enumerate(live)}
+        postings = {}
+        for term, entries in self._postings.items():
+            kept = {remap[o]: tf for o, tf in entries.items() if o in remap}
+            if kept:
+                postings[term] = kept
+        self._postings = postings
+        self._doc_ids = [self._doc_ids[o] for o in live]
+        self._doc_lens = [self._doc_lens[o] for o in live]
+        self._ordinals = {chunk_id: ordinal for ordinal, chunk_id in enumerate(self._doc_ids)}
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """BM25检索，返回 (块ID, 分数)"""
+        with self._lock:
+            n_docs = len(self._ordinals)
+            if n_docs == 0:
+                return []
+            avg_len = self._total_len / n_docs or 1.0
+
+            scores: Dict[int, float] = {}
+            for term in set(self.tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                # 文档频率不计墓碑
+                live = [(ordinal, tf) for ordinal, tf in postings.items() if self._doc_ids[ordinal] is not None]
+                if not live:
+                    continue
+                df = len(live)
+                idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+                for ordinal, tf in live:
+                    norm = tf + self.k1 * (1.0 - self.b + self.b * self._doc_lens[ordinal] / avg_len)
+                    scores[ordinal] = scores.get(ordinal, 0.0) + idf * tf * (self.k1 + 1.0) / norm
+
+            ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+            return [(self._doc_ids[ordinal], score) for ordinal, score in ranked]
+
+    def save(self, path: str):
+        """压缩存储：先去掉墓碑，倒排表存为int32/uint16数组后整体zlib压缩"""
+        with self._lock:
+            self._compact()
+            postings = {}
+            for term, entries in self._postings.items():
+                postings[term] = (
+                    np.fromiter(entries.keys(), dtype=np.int32, count=len(entries)).tobytes(),
+                    np.minimum(np.fromiter(entries.values(), dtype=np.int64, count=len(entries)), 65535)
+                    .astype(np.uint16).tobytes()
+                )
+            data = {
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": list(self._doc_ids),
+                "doc_lens": np.asarray(self._doc_lens, dtype=np.int32).tobytes(),
+                "postings": postings
+            }
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """从文件加载"""
+        with open(path, 'rb') as f:
+            data = pickle.loads(zlib.decompress(f.read()))
+        index = cls(k1=data["k1"], b=data["b"])
+        index._doc_ids = list(data["doc_ids"])
+        index._ordinals = {chunk_id: ordinal for ordinal, chunk_id in enumerate(index._doc_ids)}
+        index._doc_lens = np.frombuffer(data["doc_lens"], dtype=np.int32).tolist()
+        index._total_len = sum(index._doc_lens)
+        for term, (ordinals, tfs) in data["postings"].items():
+            index._postings[term] = dict(zip(
+                np.frombuffer(ordinals, dtype=np.int32).tolist(),
+                np.frombuffer(tfs, dtype=np.uint16).tolist()
+            ))
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取索引统计"""
+        return {
+            "documents": len(self._ordinals),
+            "terms": len(self._postings),
+            "tombstones": len(self._doc_ids) - len(self._ordinals)
+        }
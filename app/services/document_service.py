@@ -1,14 +1,39 @@
 import uuid
 import time
-from typing import List, Dict, Any, Optional
+import json
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, BinaryIO
 from app.models.document import Document, DocumentChunk, DocumentUploadRequest, DocumentListResponse
 from app.models.storage import StorageBackend
 from app.utils.text_processor import TextProcessor
 from app.utils.embedding_service import EmbeddingService
+from app.utils.stream_splitter import iter_text_blocks
 from app.services.storage_factory import StorageFactory
 from app.services.langchain_service import LangChainRAGService
+from app.services.ingest_queue import get_ingest_queue
 from app.config import settings
 
+
+def utf8_length(text: str) -> int:
+    """文本的UTF-8字节数；纯ASCII文本直接取长度，避免整篇再编码一次"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-8'))
+
+
+class _CountingReader:
+    """包装二进制流，统计已读取的字节数（即文件大小）"""
+    
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.size = 0
+    
+    def read(self, n: int) -> bytes:
+        data = self.raw.read(n)
+        self.size += len(data)
+        return data
+
+
 class DocumentService:
     """文档服务 - 集成LangChain"""
     
@@ -17,24 +42,189 @@ class DocumentService:
         self.text_processor = TextProcessor()
         self.embedding_service = EmbeddingService()
         self.langchain_service = LangChainRAGService()
+        self.ingest_queue = get_ingest_queue()
+    
+    def _build_document(self, request: DocumentUploadRequest) -> Document:
+        """根据上传请求创建文档对象"""
+        return Document(
+            id=str(uuid.uuid4()),
+            title=request.title,
+            content=request.content,
+            file_type=request.file_type,
+            file_size=utf8_length(request.content),
+            created_at=time.time(),
+            updated_at=time.time(),
+            metadata=request.metadata or {}
+        )
+    
+    def _langchain_payload(self, document: Document) -> Dict[str, Any]:
+        """转换为LangChain存储的入库格式"""
+        return {
+            "id": document.id,
+            "title": document.title,
+            "content": document.content,
+            "created_at": document.created_at,
+            "file_type": document.file_type
+        }
+    
+    def submit_document(self, request: DocumentUploadRequest) -> Dict[str, Any]:
+        """提交异步入库任务，立即返回任务信息；队列满时抛出IngestQueueFullError"""
+        collection = self.langchain_service.check_collection_name(request.collection)
+        document = self._build_document(request)
+        payload = self._langchain_payload(document)
+        
+        def handler(job):
+            return self.langchain_service.ingest_documents([payload], collection, progress=job.report)
+        
+        job = self.ingest_queue.submit(handler, document_id=document.id, title=document.title, collection=collection)
+        return job.to_dict()
+    
+    def get_ingest_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取入库任务状态"""
+        return self.ingest_queue.get_job(job_id)
+    
+    def list_ingest_jobs(self, limit: int = 50) -> Dict[str, Any]:
+        """获取最近的入库任务和队列统计"""
+        return {
+            "jobs": self.ingest_queue.list_jobs(limit),
+            "queue": self.ingest_queue.get_stats()
+        }
+    
+    def _parse_bulk_line(self, raw: bytes, default_collection: str) -> Tuple[Document, str]:
+        """解析批量导入的一行NDJSON，返回 (文档, 集合)；格式错误时抛出ValueError"""
+        try:
+            record = json.loads(raw.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"无效的JSON: {e}")
+        if not isinstance(record, dict):
+            raise ValueError("每行必须是一个JSON对象")
+        record.setdefault("file_type", "text")
+        request = DocumentUploadRequest(**record)  # ValidationError 是 ValueError 的子类
+        if not request.content.strip():
+            raise ValueError("文档内容为空")
+        collection = self.langchain_service.check_collection_name(request.collection or default_collection)
+        return self._build_document(request), collection
+    
+    def _ingest_bulk_window(self, window: List[Tuple[int, Document, str]]) -> List[Dict[str, Any]]:
+        """写入一批文档（在工作线程中执行）：每个集合一次向量化、一次保存索引"""
+        groups: Dict[str, List[Tuple[int, Document]]] = {}
+        for line_no, document, collection in window:
+            groups.setdefault(collection, []).append((line_no, document))
+        
+        results = []
+        for collection, items in groups.items():
+            try:
+                counts = self.langchain_service.ingest_batch(
+                    [self._langchain_payload(document) for _, document in items], collection
+                )
+                error = None
+            except Exception as e:
+                print(f"❌ 批量写入失败 (集合: {collection}): {e}")
+                counts, error = {}, str(e)
+            for line_no, document in items:
+                results.append({
+                    "line": line_no,
+                    "document_id": document.id,
+                    "title": document.title,
+                    "collection": collection,
+                    "status": "failed" if error else "completed",
+                    "chunks_count": counts.get(document.id, 0),
+                    "error": error
+                })
+        return results
+    
+    async def bulk_ingest(self, stream: AsyncIterator[bytes], collection: Optional[str] = None) -> Dict[str, Any]:
+        """批量导入NDJSON文档流
+        
+        逐行解析（每行一个文档：title、content，可选 file_type、metadata、collection），
+        累积到批次上限后整批向量化并写入索引，每批只保存一次。
+        某一行格式错误只影响该行；某一批写入失败时该批文档全部标记为失败。
+        """
+        default_collection = self.langchain_service.check_collection_name(collection)
+        start_time = time.time()
+        max_line_bytes = settings.bulk_ingest_max_line_bytes
+        
+        results: List[Dict[str, Any]] = []
+        window: List[Tuple[int, Document, str]] = []
+        window_chars = 0
+        batches = 0
+        partial: List[bytes] = []  # 尚未遇到换行符的当前行片段
+        partial_len = 0
+        line_no = 0
+        oversized = False  # 当前行超长，丢弃到下一个换行符
+        
+        def handle_line(raw: bytes):
+            nonlocal window_chars
+            if not raw.strip():
+                return
+            try:
+                document, target = self._parse_bulk_line(raw, default_collection)
+            except ValueError as e:
+                results.append({"line": line_no, "status": "failed", "chunks_count": 0, "error": str(e)})
+                return
+            window.append((line_no, document, target))
+            window_chars += len(document.content)
+        
+        async def flush():
+            nonlocal window, window_chars, batches
+            if window:
+                batch, window, window_chars = window, [], 0
+                batches += 1
+                results.extend(await asyncio.to_thread(self._ingest_bulk_window, batch))
+        
+        async for block in stream:
+            # 按块内换行符切行，只把末尾不完整的一行留在 partial 中，整行只拼接一次
+            start = 0
+            while True:
+                newline = block.find(b"\n", start)
+                if newline < 0:
+                    break
+                line_no += 1
+                if oversized:
+                    oversized = False
+                else:
+                    piece = block[start:newline]
+                    handle_line(b"".join(partial) + piece if partial else piece)
+                partial, partial_len = [], 0
+                start = newline + 1
+                if len(window) >= settings.bulk_ingest_batch_documents or window_chars >= settings.bulk_ingest_batch_chars:
+                    await flush()
+            if oversized or start == len(block):
+                continue
+            partial.append(block[start:] if start else block)
+            partial_len += len(block) - start
+            if partial_len > max_line_bytes:
+                results.append({"line": line_no + 1, "status": "failed", "chunks_count": 0,
+                                "error": f"单行超过 {max_line_bytes} 字节"})
+                oversized = True
+                partial, partial_len = [], 0
+        
+        tail = b"".join(partial)
+        if tail.strip() and not oversized:
+            line_no += 1
+            handle_line(tail)
+        await flush()
+        
+        results.sort(key=lambda item: item["line"])
+        completed = sum(1 for item in results if item["status"] == "completed")
+        elapsed = time.time() - start_time
+        print(f"✅ 批量导入完成: {completed}/{len(results)} 个文档, {batches} 批, 耗时 {elapsed:.2f}秒")
+        return {
+            "total": len(results),
+            "completed": completed,
+            "failed": len(results) - completed,
+            "chunks_count": sum(item["chunks_count"] for item in results),
+            "batches": batches,
+            "processing_time": elapsed,
+            "documents_per_second": completed / elapsed if elapsed > 0 else 0.0,
+            "results": results
+        }
     
     async def upload_document(self, request: DocumentUploadRequest) -> Document:
         """上传文档 - 同时更新原有存储和LangChain存储"""
         try:
-            # 生成文档ID
-            document_id = str(uuid.uuid4())
-            
             # 创建文档对象
-            document = Document(
-                id=document_id,
-                title=request.title,
-                content=request.content,
-                file_type=request.file_type,
-                file_size=len(request.content.encode('utf-8')),
-                created_at=time.time(),
-                updated_at=time.time(),
-                metadata=request.metadata or {}
-            )
+            document = self._build_document(request)
             
             # 1. 更新原有存储系统
             # print("📝 更新原有存储系统...")
@@ -44,15 +234,9 @@ class DocumentService:
             
             # 2. 更新LangChain存储系统
             print("🤖 更新LangChain存储系统...")
-            langchain_docs = [{
-                "id": document.id,
-                "title": document.title,
-                "content": document.content,
-                "created_at": document.created_at,
-                "file_type": document.file_type
-            }]
-            
-            langchain_success = self.langchain_service.add_documents(langchain_docs)
+            langchain_docs = [self._langchain_payload(document)]
+            
+            langchain_success = self.langchain_service.add_documents(langchain_docs, collection=request.collection)
             if not langchain_success:
                 print("⚠️ 警告：LangChain存储更新失败，但原有存储已成功")
             
@@ -63,13 +247,43 @@ class DocumentService:
             print(f"❌ 文档上传失败: {e}")
             raise
     
-    async def upload_text_document(self, title: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> Document:
+    async def upload_file(self, stream: BinaryIO, title: str, file_type: str = "text",
+                          collection: Optional[str] = None) -> Dict[str, Any]:
+        """流式上传大文件：按块读取、增量解码、边分块边向量化，不把整个文件读入内存"""
+        collection = self.langchain_service.check_collection_name(collection)
+        start_time = time.time()
+        document_id = str(uuid.uuid4())
+        payload = {
+            "id": document_id,
+            "title": title,
+            "created_at": time.time(),
+            "file_type": file_type
+        }
+        
+        reader = _CountingReader(stream)
+        blocks = iter_text_blocks(reader, settings.stream_read_block_bytes)
+        chunks_count = await asyncio.to_thread(self.langchain_service.ingest_stream, blocks, payload, collection)
+        
+        elapsed = time.time() - start_time
+        print(f"✅ 文件上传完成: {title}, {reader.size} 字节, {chunks_count} 个块, 耗时 {elapsed:.2f}秒")
+        return {
+            "document_id": document_id,
+            "title": title,
+            "collection": collection,
+            "file_size": reader.size,
+            "chunks_count": chunks_count,
+            "processing_time": elapsed
+        }
+    
+    async def upload_text_document(self, title: str, content: str, metadata: Optional[Dict[str, Any]] = None,
+                                   collection: Optional[str] = None) -> Document:
         """上传文本文档"""
         request = DocumentUploadRequest(
             title=title,
             content=content,
             file_type="text",
-            metadata=metadata or {}
+            metadata=metadata or {},
+            collection=collection
         )
         return await self.upload_document(request)
     
@@ -80,13 +294,17 @@ class DocumentService:
         except Exception as e:
             print(f"获取文档失败: {e}")
             return None
-    async def list_documents(self, page: int = 1, page_size: int = 10) -> DocumentListResponse:
+    async def list_documents(self, page: int = 1, page_size: int = 10, collection: Optional[str] = None) -> DocumentListResponse:
         """从LangChain存储获取文档列表"""
         try:
-            print(f"📚 从LangChain存储获取文档列表: page={page}, page_size={page_size}")
+            print(f"📚 从LangChain存储获取文档列表: page={page}, page_size={page_size}, collection={collection}")
             
             # 从LangChain存储获取文档信息
-            vector_store = self.langchain_service.vector_store
+            target = self.langchain_service.get_collection(collection, create=False)
+            if target is None:
+                print(f"⚠️ 集合不存在: {collection}")
+                return DocumentListResponse(documents=[], total_count=0, page=page, page_size=page_size)
+            vector_store = target.vector_store
             if not vector_store:
                 print("❌ LangChain向量存储为空")
     
@@ -154,6 +372,10 @@ class DocumentService:
 
 
     
+    def list_collections(self) -> List[Dict[str, Any]]:
+        """列出所有集合及其统计"""
+        return [self.langchain_service.get_collection(name).get_stats() for name in self.langchain_service.list_collections()]
+    
     async def delete_document(self, document_id: str) -> bool:
         """删除文档"""
         try:
@@ -9,6 +9,8 @@ import logging
 from datetime import datetime
 import random
 from app.utils.embedding_service import EmbeddingService
+from app.utils.similarity import cosine_similarity_matrix, top_k_indices
+from app.services.response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
@@ -18,9 +20,12 @@ class FAISSStorage:
     def __init__(self):
         self.vectors_file = "./data/faiss_vectors.pkl"
         self.metadata_file = "./data/faiss_metadata.pkl"
-        self.vectors: np.ndarray = np.array([])
         self.metadata: List[Dict[str, Any]] = []
         self.document_ids: List[str] = []
+        # 存储版本号，每次增删改后递增，用于缓存失效
+        self.version = 0
+        # 检索结果缓存：(查询向量摘要, top_k, 阈值) -> [(向量下标, 相似度)]
+        self.retrieval_cache = ResponseCache(max_bytes=settings.retrieval_cache_max_bytes)
         
         # 初始化向量化服务
         self.embedding_service = EmbeddingService()
@@ -29,6 +34,9 @@ class FAISSStorage:
         self.vector_dim = self.embedding_service.model.get_sentence_embedding_dimension()
         print(f"[DEBUG] FAISS存储初始化，使用向量维度: {self.vector_dim}")
         
+        # 预分配的float32向量矩阵及行范数，前 _count 行有效；容量不足时按倍数扩容
+        self._set_vectors(np.zeros((0, self.vector_dim), dtype=np.float32))
+        
         # 确保数据目录存在
         os.makedirs("./data", exist_ok=True)
         
@@ -40,7 +48,7 @@ class FAISSStorage:
         try:
             if os.path.exists(self.vectors_file):
                 with open(self.vectors_file, 'rb') as f:
-                    self.vectors = pickle.load(f)
+                    self._set_vectors(pickle.load(f))
                 logger.info(f"加载了 {len(self.vectors)} 个向量")
             
             if os.path.exists(self.metadata_file):
@@ -51,7 +59,7 @@ class FAISSStorage:
                 logger.info(f"加载了 {len(self.metadata)} 个文档元数据")
         except Exception as e:
             logger.warning(f"加载数据失败: {e}")
-            self.vectors = np.array([])
+            self._set_vectors(np.zeros((0, self.vector_dim), dtype=np.float32))
             self.metadata = []
             self.document_ids = []
     
@@ -71,68 +79,115 @@ class FAISSStorage:
             logger.error(f"保存数据失败: {e}")
             raise
     
-    def _cosine_similarity(self, query_vector: np.ndarray, vectors: np.ndarray) -> np.ndarray:
-        """计算余弦相似度"""
-        # 归一化向量
-        query_norm = np.linalg.norm(query_vector)
-        if query_norm == 0:
-            return np.zeros(len(vectors))
+    @property
+    def vectors(self) -> np.ndarray:
+        """有效的向量（预分配矩阵的视图，不复制）"""
+        return self._matrix[:self._count]
+    
+    def _set_vectors(self, vectors):
+        """替换全部向量：转为float32复制进新矩阵，并计算行范数"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.size == 0:
+            vectors = np.zeros((0, self.vector_dim), dtype=np.float32)
+        self._count = len(vectors)
+        self._matrix = np.empty((self._count, vectors.shape[1]), dtype=np.float32)
+        self._matrix[:] = vectors
+        self._norms = np.linalg.norm(self._matrix, axis=1)
+    
+    def _reserve(self, extra: int):
+        """保证矩阵还能再容纳 extra 行；扩容时容量至少翻倍，追加的摊销成本为O(1)"""
+        needed = self._count + extra
+        if needed <= len(self._matrix):
+            return
+        capacity = max(needed, 2 * len(self._matrix), 64)
+        matrix = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+        matrix[:self._count] = self.vectors
+        norms = np.empty(capacity, dtype=np.float32)
+        norms[:self._count] = self._norms[:self._count]
+        self._matrix, self._norms = matrix, norms
+    
+    def _cosine_similarity(self, query_vector: np.ndarray) -> np.ndarray:
+        """计算查询与全部向量的余弦相似度（行范数在写入时已算好，不再复制整个矩阵做归一化）"""
+        return cosine_similarity_matrix(query_vector, self.vectors, candidate_norms=self._norms[:self._count])
+    
+    def _search_indices(self, query_vector, top_k: int, similarity_threshold: float) -> List[tuple]:
+        """返回满足阈值的 (向量下标, 相似度)，按存储版本缓存"""
+        cache_key = None
+        if settings.retrieval_cache_enabled:
+            cache_key = ResponseCache.make_key(
+                "search", ResponseCache.vector_digest(query_vector), top_k, similarity_threshold
+            )
+            cached = self.retrieval_cache.get(cache_key, self.version)
+            if cached is not None:
+                return list(cached)
         
-        query_normalized = query_vector / query_norm
+        # 确保查询向量是float32数组（已是float32数组时不复制）
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
         
-        # 计算每个向量的范数
-        vector_norms = np.linalg.norm(vectors, axis=1)
-        # 避免除零
-        vector_norms[vector_norms == 0] = 1
+        if len(self.vectors) == 0:
+            return []
+        if self.vectors.ndim != 2 or self.vectors.shape[1] != len(query_vector):
+            logger.error(f"查询向量维度 {len(query_vector)} 与存储的向量维度 {self.vectors.shape[-1]} 不一致，可能更换了向量模型")
+            return []
         
-        # 归一化所有向量
-        vectors_normalized = vectors / vector_norms[:, np.newaxis]
+        # 计算相似度
+        similarities = self._cosine_similarity(query_vector)
         
-        # 计算余弦相似度
-        similarities = np.dot(vectors_normalized, query_normalized)
-        return similarities
+        # 获取top_k个最相似的文档（部分排序）
+        top_indices = top_k_indices(similarities, top_k)
+        
+        hits = []
+        for idx in top_indices:
+            similarity = float(similarities[idx])
+            # 使用配置的相似度阈值过滤
+            if similarity >= similarity_threshold:
+                hits.append((int(idx), similarity))
+        
+        if cache_key is not None:
+            self.retrieval_cache.put(cache_key, self.version, hits)
+        return hits
     
     def add_documents(self, documents: List[Dict[str, Any]]) -> bool:
         """添加文档到存储"""
         try:
+            # 维度不一致说明向量来自其他模型，截断或补零会得到无意义的相似度，整批拒绝
+            for doc in documents:
+                vector = doc.get('vector')
+                if vector is not None and len(vector) != self.vector_dim:
+                    logger.error(f"向量维度不匹配: 期望 {self.vector_dim}, 实际 {len(vector)}，拒绝写入文档 {doc.get('id')}")
+                    return False
+            
+            new_docs = []
+            seen = set(self.document_ids)
             for doc in documents:
                 # 生成文档ID
                 doc_id = doc.get('id', str(uuid.uuid4()))
                 
                 # 检查是否已存在
-                if doc_id in self.document_ids:
+                if doc_id in seen:
                     logger.warning(f"文档ID {doc_id} 已存在，跳过")
                     continue
-                
-                # 获取向量
-                vector = doc.get('vector')
-                if vector is None:
-                    # 如果没有向量，使用向量化服务生成真正的语义向量
-                    logger.warning(f"文档 {doc_id} 缺少向量数据，使用向量化服务生成语义向量")
-                    vector = self.embedding_service.get_embedding(doc.get('content', ''))
-                
-                # 转换为numpy数组
-                if not isinstance(vector, np.ndarray):
-                    vector = np.array(vector, dtype=np.float32)
-                
-                # 确保向量维度正确
-                if len(vector) != self.vector_dim:
-                    logger.warning(f"向量维度不匹配: 期望 {self.vector_dim}, 实际 {len(vector)}")
-                    # 如果维度不匹配，尝试调整
-                    if len(vector) > self.vector_dim:
-                        vector = vector[:self.vector_dim]
-                    else:
-                        # 用零填充
-                        padded_vector = np.zeros(self.vector_dim, dtype=np.float32)
-                        padded_vector[:len(vector)] = vector
-                        vector = padded_vector
-                
-                # 添加到向量数组
-                if len(self.vectors) == 0:
-                    self.vectors = vector.reshape(1, -1)
-                else:
-                    self.vectors = np.vstack([self.vectors, vector.reshape(1, -1)])
-                
+                seen.add(doc_id)
+                new_docs.append((doc_id, doc))
+            
+            # 缺少向量的文档一次批量生成真正的语义向量
+            missing = [i for i, (_, doc) in enumerate(new_docs) if doc.get('vector') is None]
+            generated = None
+            if missing:
+                logger.warning(f"{len(missing)} 个文档缺少向量数据，使用向量化服务批量生成语义向量")
+                generated = self.embedding_service.encode_batch_texts([new_docs[i][1].get('content', '') for i in missing])
+            
+            # 直接写入预分配矩阵的空闲行，全部写完后再更新有效行数
+            self._reserve(len(new_docs))
+            start = self._count
+            generated_rows = dict(zip(missing, range(len(missing))))
+            for i, (_, doc) in enumerate(new_docs):
+                self._matrix[start + i] = generated[generated_rows[i]] if i in generated_rows else doc['vector']
+            end = start + len(new_docs)
+            self._norms[start:end] = np.linalg.norm(self._matrix[start:end], axis=1)
+            self._count = end
+            
+            for doc_id, doc in new_docs:
                 # 添加元数据
                 metadata = {
                     'id': doc_id,
@@ -148,6 +203,7 @@ class FAISSStorage:
             
             # 保存数据
             self._save_data()
+            self.version += 1
             return True
             
         except Exception as e:
@@ -167,30 +223,17 @@ class FAISSStorage:
             if similarity_threshold is None:
                 similarity_threshold = settings.similarity_threshold
             
-            # 确保查询向量是numpy数组
-            if not isinstance(query_vector, np.ndarray):
-                query_vector = np.array(query_vector, dtype=np.float32)
-            
-            # 计算相似度
-            similarities = self._cosine_similarity(query_vector, self.vectors)
-            
-            # 获取top_k个最相似的文档
-            top_indices = np.argsort(similarities)[::-1][:min(top_k, len(similarities))]
-            
             results = []
-            for idx in top_indices:
-                similarity = float(similarities[idx])
-                # 使用配置的相似度阈值过滤
-                if similarity >= similarity_threshold:
-                    result = {
-                        'id': self.metadata[idx]['id'],
-                        'content': self.metadata[idx]['content'],
-                        'metadata': self.metadata[idx]['metadata'],
-                        'similarity': similarity,
-                        'created_at': self.metadata[idx]['created_at'],
-                        'updated_at': self.metadata[idx]['updated_at']
-                    }
-                    results.append(result)
+            for idx, similarity in self._search_indices(query_vector, top_k, similarity_threshold):
+                result = {
+                    'id': self.metadata[idx]['id'],
+                    'content': self.metadata[idx]['content'],
+                    'metadata': self.metadata[idx]['metadata'],
+                    'similarity': similarity,
+                    'created_at': self.metadata[idx]['created_at'],
+                    'updated_at': self.metadata[idx]['updated_at']
+                }
+                results.append(result)
             
             logger.info(f"搜索完成，找到 {len(results)} 个相关文档 (阈值: {similarity_threshold})")
             return results
@@ -209,8 +252,10 @@ class FAISSStorage:
             # 找到文档索引
             idx = self.document_ids.index(document_id)
             
-            # 删除向量
-            self.vectors = np.delete(self.vectors, idx, axis=0)
+            # 删除向量：后面的行原地前移，不重新分配矩阵
+            self._matrix[idx:self._count - 1] = self._matrix[idx + 1:self._count]
+            self._norms[idx:self._count - 1] = self._norms[idx + 1:self._count]
+            self._count -= 1
             
             # 删除元数据
             del self.metadata[idx]
@@ -218,6 +263,7 @@ class FAISSStorage:
             
             # 保存数据
             self._save_data()
+            self.version += 1
             
             logger.info(f"删除文档 {document_id} 成功")
             return True
@@ -243,6 +289,7 @@ class FAISSStorage:
             
             # 保存数据
             self._save_data()
+            self.version += 1
             
             logger.info(f"更新文档 {document_id} 成功")
             return True
@@ -309,9 +356,10 @@ class FAISSStorage:
     def clear_all(self) -> bool:
         """清空所有数据"""
         try:
-            self.vectors = np.array([])
+            self._set_vectors(np.zeros((0, self.vector_dim), dtype=np.float32))
             self.metadata = []
             self.document_ids = []
+            self.version += 1
             
             # 删除文件
             if os.path.exists(self.vectors_file):
@@ -331,9 +379,12 @@ class FAISSStorage:
         try:
             return {
                 'total_documents': len(self.metadata),
+                'version': self.version,
                 'vector_dimension': self.vector_dim,
                 'vectors_shape': self.vectors.shape if len(self.vectors) > 0 else (0, 0),
+                'vector_capacity': len(self._matrix),
                 'storage_size_mb': self._get_storage_size(),
+                'retrieval_cache': self.retrieval_cache.get_stats(),
                 'document_ids': self.document_ids[:10]  # 只返回前10个ID
             }
         except Exception as e:
@@ -400,32 +451,19 @@ class FAISSStorage:
                 logger.warning("向量数据库为空")
                 return []
             
-            # 确保查询向量是numpy数组
-            if not isinstance(query_vector, np.ndarray):
-                query_vector = np.array(query_vector, dtype=np.float32)
-            
-            # 计算相似度
-            similarities = self._cosine_similarity(query_vector, self.vectors)
-            
-            # 获取top_k个最相似的文档
-            top_indices = np.argsort(similarities)[::-1][:min(top_k, len(similarities))]
-            
             chunks = []
-            for idx in top_indices:
-                similarity = float(similarities[idx])
-                # 使用配置的相似度阈值过滤
-                if similarity >= threshold:
-                    metadata = self.metadata[idx]
-                    chunk = DocumentChunk(
-                        id=metadata['id'],
-                        content=metadata['content'],
-                        metadata={
-                            **metadata['metadata'],
-                            'similarity': similarity,
-                            'document_id': metadata['id']
-                        }
-                    )
-                    chunks.append(chunk)
+            for idx, similarity in self._search_indices(query_vector, top_k, threshold):
+                metadata = self.metadata[idx]
+                chunk = DocumentChunk(
+                    id=metadata['id'],
+                    content=metadata['content'],
+                    metadata={
+                        **metadata['metadata'],
+                        'similarity': similarity,
+                        'document_id': metadata['id']
+                    }
+                )
+                chunks.append(chunk)
             
             logger.info(f"搜索完成，找到 {len(chunks)} 个相关文档块 (阈值: {threshold})")
             return chunks
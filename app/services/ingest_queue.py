@@ -0,0 +1,173 @@
+"""
+异步入库任务队列
+"""
+
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional
+from app.config import settings
+
+
+class IngestQueueFullError(Exception):
+    """入库队列已满"""
+
+
+class IngestJob:
+    """一个入库任务的状态"""
+
+    def __init__(self, handler: Callable, document_id: Optional[str] = None, title: str = "",
+                 collection: Optional[str] = None):
+        self.job_id = str(uuid.uuid4())
+        self.handler = handler
+        self.document_id = document_id
+        self.title = title
+        self.collection = collection
+        self.status = "queued"  # queued, running, completed, failed
+        self.stage = "queued"
+        self.chunks_count = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def report(self, stage: str, **info):
+        """处理过程中上报进度（在工作线程中调用）"""
+        self.stage = stage
+        if "chunks_count" in info:
+            self.chunks_count = info["chunks_count"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "document_id": self.document_id,
+            "title": self.title,
+            "collection": self.collection,
+            "chunks_count": self.chunks_count,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "processing_time": (self.finished_at - self.started_at) if self.finished_at and self.started_at else None
+        }
+
+
+class IngestQueue:
+    """有界入库队列 + 工作协程池
+
+    请求处理函数只负责入队并立即返回任务ID；队列满时拒绝（背压）。
+    工作协程把CPU密集的分块、向量化和索引写入放到线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, max_size: int = None, workers: int = None, history_size: int = None):
+        self.max_size = max_size if max_size is not None else settings.ingest_queue_max_size
+        self.workers = workers if workers is not None else settings.ingest_workers
+        self.history_size = history_size if history_size is not None else settings.ingest_job_history
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        """在当前事件循环中启动工作协程（首次提交任务时）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker_tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._worker_tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"✅ 入库队列已启动: {self.workers} 个工作协程, 队列上限 {self.max_size}")
+
+    def submit(self, handler: Callable, document_id: Optional[str] = None, title: str = "",
+               collection: Optional[str] = None) -> IngestJob:
+        """提交入库任务；handler(job) 在工作线程中执行，返回写入的块数"""
+        self._ensure_started()
+        job = IngestJob(handler, document_id=document_id, title=title, collection=collection)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise IngestQueueFullError(f"入库队列已满（{self.max_size}），请稍后重试")
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim_history()
+        print(f"📥 入库任务已入队: {job.job_id} ({title}), 队列长度 {self._queue.qsize()}")
+        return job
+
+    def _trim_history(self):
+        """只保留最近的已结束任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ("completed", "failed")]
+        for job_id in finished[:max(len(finished) - self.history_size, 0)]:
+            del self._jobs[job_id]
+
+    async def _worker(self, worker_id: int):
+        """工作协程：逐个取出任务并在线程中执行"""
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.stage = "running"
+            job.started_at = time.time()
+            try:
+                chunks_count = await asyncio.to_thread(job.handler, job)
+                if chunks_count is not None:
+                    job.chunks_count = chunks_count
+                job.status = "completed"
+                job.stage = "completed"
+                self.completed += 1
+                print(f"✅ 入库任务完成: {job.job_id}, {job.chunks_count} 个块, 耗时 {time.time() - job.started_at:.2f}秒")
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                self.failed += 1
+                print(f"❌ 入库任务失败: {job.job_id}: {e}")
+            finally:
+                job.finished_at = time.time()
+                job.handler = None
+                self._queue.task_done()
+                with self._lock:
+                    self._trim_history()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态"""
+        job = self._jobs.get(job_id)
+        return job.to_dict() if job is not None else None
+
+    def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """获取最近的任务（新的在前）"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in reversed(jobs[-limit:])]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计"""
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "max_size": self.max_size,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": statuses.count("running"),
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+_ingest_queue: Optional[IngestQueue] = None
+_ingest_queue_lock = threading.Lock()
+
+
+def get_ingest_queue() -> IngestQueue:
+    """获取共享的入库队列（进程内单例）"""
+    global _ingest_queue
+    with _ingest_queue_lock:
+        if _ingest_queue is None:
+            _ingest_queue = IngestQueue()
+        return _ingest_queue
@@ -3,19 +3,34 @@ LangChain RAG服务
 """
 
 import os
+import re
+import uuid
+import threading
 import asyncio
-from typing import List, Dict, Any, Optional
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
+import weakref
+from typing import List, Dict, Any, Optional, Callable, Iterable
+from langchain_core.embeddings import Embeddings
 from langchain.llms.base import LLM
 from langchain.callbacks.manager import CallbackManagerForLLMRun
 from langchain.schema import Document
 from pydantic import Field
 from app.config import settings
+from app.services.response_cache import ResponseCache
+from app.services.bm25_index import reciprocal_rank_fusion
+from app.services.vector_collection import VectorCollection, read_embedding_model, recover_index_link
+from app.utils.embedding_cache import get_embedding_cache, get_chunk_embedding_store
+from app.utils.embedding_service import EmbeddingService
+from app.utils.model_registry import list_models
+from app.utils.context_packer import ContextPacker
+from app.utils.context_compressor import ContextCompressor
+from app.utils.mmr import maximal_marginal_relevance
+from app.utils.similarity import cosine_similarity_matrix
+from app.utils.chunk_merger import coalesce_chunks
+from app.utils.stream_splitter import split_text_stream
+from app.utils.preprocessing import split_document, annotate_chunk, chunk_id_for, get_text_splitter, get_preprocess_pool
 import aiohttp
 import json
+import numpy as np
 
 
 class DeepSeekLLM(LLM):
@@ -75,6 +90,41 @@ class DeepSeekLLM(LLM):
                     raise Exception(f"API调用失败: {response.status} - {error_text}")
 
 
+class SharedModelEmbeddings(Embeddings):
+    """LangChain向量化适配器：通过EmbeddingService借用进程内共享的模型（见 model_registry），
+    查询向量与EmbeddingService共享缓存"""
+    
+    def __init__(self, model_name: str, device: Optional[str] = None):
+        self.embedding_service = EmbeddingService(model_name, device, allow_fallback=False)
+        self.model_name = self.embedding_service.model_name
+        self.cache_namespace = self.embedding_service.cache_namespace
+        self.client = self.embedding_service.model
+    
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        # 返回float32矩阵而非嵌套列表（LangChain FAISS 内部同样转为float32数组）
+        # 与SentenceTransformerEmbeddings一致：换行替换为空格，保证与已入库的向量一致
+        return self.embedding_service.encode_batch_texts([text.replace("\n", " ") for text in texts])
+    
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embedding_service.encode_single_text(text.replace("\n", " "))
+    
+    async def aembed_query(self, text: str) -> np.ndarray:
+        # 并发查询经微批处理合并计算，等待期间不阻塞事件循环
+        return await self.embedding_service.aencode_single_text(text.replace("\n", " "))
+    
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        return await self.embedding_service.aencode_batch_texts([text.replace("\n", " ") for text in texts])
+
+
+def create_embeddings(model_name: str) -> SharedModelEmbeddings:
+    """创建LangChain向量化模型（同一模型在进程内只加载一次）"""
+    return SharedModelEmbeddings(model_name, settings.embedding_device)
+
+
+class EmbeddingModelChangedError(Exception):
+    """查询过程中服务切换了向量模型，查询向量与索引不再匹配，需要重新计算"""
+
+
 class LangChainRAGService:
     """LangChain RAG服务 - 单例模式"""
     
@@ -90,10 +140,12 @@ class LangChainRAGService:
         # 确保只初始化一次
         if not self._initialized:
             print(f"[DEBUG] LangChain服务初始化，配置的模型: {settings.embedding_model}")
-            self.embeddings = SentenceTransformerEmbeddings(
-                model_name=settings.embedding_model,
-                model_kwargs={'device': settings.embedding_device}
-            )
+            # 查询必须使用生成已存向量的模型；配置的模型不同时继续用原模型，需通过模型迁移切换
+            serving_model = read_embedding_model(self._collection_path(settings.default_collection)) or settings.embedding_model
+            if serving_model != settings.embedding_model:
+                print(f"⚠️ 现有索引由模型 {serving_model} 生成，与配置的 {settings.embedding_model} 不一致，"
+                      f"继续使用 {serving_model}，请通过 /api/migration/start 迁移")
+            self.embeddings = create_embeddings(serving_model)
             
             # 打印实际加载的模型信息
             try:
@@ -106,11 +158,13 @@ class LangChainRAGService:
             except Exception as e:
                 print(f"[DEBUG] 获取LangChain embeddings信息失败: {e}")
             
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=settings.chunk_size,
-                chunk_overlap=settings.chunk_overlap,
-                length_function=len,
-            )
+            # 与预处理进程池使用相同的分块配置
+            self.text_splitter = get_text_splitter()
+            
+            # 按token预算打包上下文
+            self.context_packer = ContextPacker()
+            # 可选的抽取式上下文压缩
+            self.context_compressor = ContextCompressor(self.embeddings.embed_documents)
             
             self.llm = DeepSeekLLM(
                 api_key=settings.deepseek_api_key,
@@ -118,98 +172,333 @@ class LangChainRAGService:
                 model=settings.deepseek_model
             )
             
-            self.vector_store = None
+            # 命名集合：每个集合独立的FAISS索引、docstore和BM25索引，按需加载
+            self.collections: Dict[str, VectorCollection] = {}
+            self._collections_lock = threading.Lock()
             self.qa_chain = None
-            self._initialize_vector_store()
+            # 全局版本号，任意集合增删文档后递增，用于答案/响应缓存失效
+            self.index_version = 0
+            # 检索结果缓存：(查询向量摘要, top_k, 过滤条件, 集合) -> [(块ID, 分数)]
+            self.retrieval_cache = ResponseCache(max_bytes=settings.retrieval_cache_max_bytes)
+            # 依赖当前向量模型的外部缓存（查询服务的语义答案缓存、响应缓存），切换模型时一并清空
+            self._model_caches = weakref.WeakSet()
+            self.get_collection(settings.default_collection)
             
             self._initialized = True
     
-    def _initialize_vector_store(self):
-        """初始化向量存储"""
-        vector_store_path = f"{settings.data_dir}/faiss/langchain_vectorstore"
-        os.makedirs(vector_store_path, exist_ok=True)
+    _COLLECTION_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+    
+    def _collection_path(self, name: str) -> str:
+        """集合目录：默认集合沿用原有的 langchain_vectorstore 目录
+
+        重建或迁移后的集合目录是指向版本目录的符号链接（见 publish_index）。
+        """
+        if name == settings.default_collection:
+            path = f"{settings.data_dir}/faiss/langchain_vectorstore"
+        else:
+            path = f"{settings.data_dir}/faiss/collections/{name}"
+        recover_index_link(path)
+        return path
+    
+    def get_collection(self, name: Optional[str] = None, create: bool = True) -> Optional[VectorCollection]:
+        """获取命名集合（首次访问时从磁盘加载）；create=False 且集合不存在时返回None"""
+        name = self.check_collection_name(name)
+        with self._collections_lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                path = self._collection_path(name)
+                if not create and not os.path.exists(f"{path}/index.faiss"):
+                    return None
+                if os.path.exists(f"{path}/index.faiss"):
+                    recorded = read_embedding_model(path)
+                    if recorded and recorded != self.embeddings.model_name:
+                        raise ValueError(f"集合 {name} 的向量由模型 {recorded} 生成，与当前模型 {self.embeddings.model_name} 不一致")
+                collection = VectorCollection(name, path, self.embeddings)
+                self.collections[name] = collection
+            return collection
+    
+    @property
+    def embedding_model_name(self) -> str:
+        """当前用于查询和入库的向量模型"""
+        return self.embeddings.model_name
+    
+    def check_serving(self, embeddings) -> None:
+        """确认查询向量所用的模型仍是当前服务的模型，否则抛出EmbeddingModelChangedError"""
+        if embeddings is not None and embeddings is not self.embeddings:
+            raise EmbeddingModelChangedError(f"向量模型已切换为 {self.embeddings.model_name}")
+    
+    def register_model_cache(self, cache) -> None:
+        """登记一个依赖当前向量模型的缓存（需提供 clear()），切换模型时清空；只保留弱引用"""
+        with self._collections_lock:
+            self._model_caches.add(cache)
+    
+    def _bump_index_version(self, target: Optional[VectorCollection] = None) -> None:
+        """线上索引变化后递增版本号，使答案/检索缓存失效
         
-        # 尝试加载现有的向量存储
-        if os.path.exists(f"{vector_store_path}/index.faiss"):
-            try:
-                self.vector_store = FAISS.load_local(
-                    vector_store_path, 
-                    self.embeddings,
-                    allow_dangerous_deserialization=True  # 允许加载本地文件
-                )
-                print("✅ 成功加载现有向量存储")
-            except Exception as e:
-                print(f"⚠️ 加载向量存储失败: {e}")
-                self.vector_store = None
+        target 不是当前线上的集合对象（迁移中的影子索引、重建中的临时索引）时不递增，
+        写入这些集合不影响线上结果，不应清掉线上缓存。
+        """
+        with self._collections_lock:
+            if target is None or self.collections.get(target.name) is target:
+                self.index_version += 1
+    
+    def switch_serving(self, embeddings, collections: Dict[str, VectorCollection]):
+        """原子地切换向量模型和全部集合（模型迁移使用）
         
-        # 如果没有现有存储，创建新的空向量存储
-        if self.vector_store is None:
-            # 创建一个真正的空向量存储
-            # 使用一个临时文档创建存储，然后立即清空
-            temp_doc = Document(page_content="temp", metadata={})
-            self.vector_store = FAISS.from_documents([temp_doc], self.embeddings)
-            
-            # 清空存储，确保是真正的空存储
+        切换后旧集合对象标记为下线、拒绝写入；持有旧模型查询向量的请求在检索时会收到
+        EmbeddingModelChangedError 并重新计算查询向量，不会用一个模型的向量查另一个模型的索引。
+        """
+        with self._collections_lock:
+            for collection in self.collections.values():
+                collection.retired = True
+            self.embeddings = embeddings
+            self.collections = dict(collections)
+            self.context_compressor = ContextCompressor(embeddings.embed_documents)
+            self.index_version += 1
+            self.retrieval_cache.clear()
+            # 旧模型的查询向量和答案不能再用于新模型
+            for cache in list(self._model_caches):
+                cache.clear()
+        print(f"✅ 已切换到向量模型 {embeddings.model_name}，集合: {sorted(collections)}")
+    
+    def list_collections(self) -> List[str]:
+        """列出所有集合（包括尚未加载的）"""
+        names = set(self.collections)
+        names.add(settings.default_collection)
+        collections_dir = f"{settings.data_dir}/faiss/collections"
+        if os.path.isdir(collections_dir):
+            for name in os.listdir(collections_dir):
+                if self._COLLECTION_NAME.match(name) and os.path.exists(f"{collections_dir}/{name}/index.faiss"):
+                    names.add(name)
+        return sorted(names)
+    
+    def _resolve_collections(self, names: Optional[List[str]] = None) -> List[VectorCollection]:
+        """解析查询涉及的集合，未指定时使用默认集合；不存在的集合跳过"""
+        resolved = []
+        for name in dict.fromkeys(names or [settings.default_collection]):
             try:
-                # 获取所有文档ID并删除
-                doc_ids = list(self.vector_store.index_to_docstore_id.values())
-                if doc_ids:
-                    self.vector_store.delete(doc_ids)
-                print("✅ 创建新的空向量存储")
-            except Exception as e:
-                print(f"⚠️ 清空向量存储时出错: {e}")
-                # 如果清空失败，重新创建一个新的空存储
-                self.vector_store = FAISS.from_documents([], self.embeddings)
-                print("✅ 重新创建空向量存储")
+                collection = self.get_collection(name, create=False)
+            except ValueError as e:
+                print(f"⚠️ {e}")
+                continue
+            if collection is None:
+                print(f"⚠️ 集合不存在，跳过: {name}")
+                continue
+            resolved.append(collection)
+        return resolved
     
-    def add_documents(self, documents: List[Dict[str, Any]]) -> bool:
-        """添加文档到向量存储"""
-        try:
-            print(f"🔍 开始添加 {len(documents)} 个文档到LangChain存储")
-            
-            # 转换为LangChain Document格式
-            langchain_docs = []
-            for doc in documents:
+    def _locate(self, chunk_id: str) -> Optional[VectorCollection]:
+        """查找块所在的集合"""
+        for collection in list(self.collections.values()):
+            if collection.get_document(chunk_id) is not None:
+                return collection
+        return None
+    
+    @property
+    def vector_store(self):
+        """默认集合的向量存储（兼容原有调用）"""
+        return self.get_collection(settings.default_collection).vector_store
+    
+    def _embed_chunks(self, texts: List[str], embeddings=None) -> np.ndarray:
+        """计算文档块向量：按内容哈希查块向量缓存，只对未命中的块调用模型，返回 (块数, 维度) 的float32矩阵
+        
+        embeddings 默认为当前模型；写入集合时使用该集合的模型（模型迁移中的影子索引用新模型）。
+        """
+        embeddings = embeddings or self.embeddings
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if not settings.chunk_embedding_cache_enabled:
+            return np.ascontiguousarray(embeddings.embed_documents(texts), dtype=np.float32)
+        
+        store = get_chunk_embedding_store(embeddings.cache_namespace)
+        cached = store.get_many(texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        print(f"♻️ 块向量缓存命中 {len(texts) - len(missing)}/{len(texts)}")
+        
+        new_vectors = None
+        if missing:
+            new_vectors = np.ascontiguousarray(embeddings.embed_documents([texts[i] for i in missing]), dtype=np.float32)
+            store.put_many([texts[i] for i in missing], new_vectors)
+        dim = new_vectors.shape[1] if new_vectors is not None else len(cached[0])
+        vectors = np.empty((len(texts), dim), dtype=np.float32)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                vectors[i] = vector
+        if new_vectors is not None:
+            vectors[missing] = new_vectors
+        return vectors
+    
+    def check_collection_name(self, name: Optional[str]) -> str:
+        """校验集合名称，返回实际使用的名称；无效时抛出ValueError"""
+        name = name or settings.default_collection
+        if not self._COLLECTION_NAME.match(name):
+            raise ValueError(f"无效的集合名称: {name}（只允许字母、数字、下划线和短横线，最长64个字符）")
+        return name
+    
+    def _split_documents(self, documents: List[Dict[str, Any]], collection_name: str,
+                         verbose: bool = True) -> List[Document]:
+        """在当前线程内分块（单个文档上传使用），与预处理进程池共用 split_document"""
+        split_docs = []
+        for doc in documents:
+            if verbose:
                 print(f"  处理文档: {doc.get('title', 'Unknown')} (ID: {doc['id']})")
-                langchain_doc = Document(
-                    page_content=doc["content"],
-                    metadata={
-                        "document_id": doc["id"],
-                        "title": doc["title"],
-                        "created_at": doc.get("created_at", ""),
-                        "file_type": doc.get("file_type", "")
-                    }
-                )
-                langchain_docs.append(langchain_doc)
-            
-            print(f"✅ 转换为LangChain格式完成，共 {len(langchain_docs)} 个文档")
-            
-            # 分块
-            print("📝 开始文档分块...")
-            split_docs = self.text_splitter.split_documents(langchain_docs)
-            print(f"✅ 分块完成，共生成 {len(split_docs)} 个文档块")
-            
+            split_docs.extend(split_document(doc, collection_name, settings.ingest_clean_text))
+        
+        if verbose:
             # 打印分块详情
             for i, doc in enumerate(split_docs):
                 print(f"  块 {i+1}: 长度={len(doc.page_content)}, 元数据={doc.metadata}")
-            
-            # 添加到向量存储
-            print("💾 开始添加到向量存储...")
-            if self.vector_store is None:
-                print("⚠️ 向量存储为空，创建新的向量存储")
-                self.vector_store = FAISS.from_documents(split_docs, self.embeddings)
-            else:
-                print(f"📊 当前向量存储状态: {len(self.vector_store.index_to_docstore_id)} 个文档")
-                self.vector_store.add_documents(split_docs)
-                print(f"📊 添加后向量存储状态: {len(self.vector_store.index_to_docstore_id)} 个文档")
-            
-            # 保存向量存储
-            print("💾 保存向量存储到本地...")
-            vector_store_path = f"{settings.data_dir}/faiss/langchain_vectorstore"
-            self.vector_store.save_local(vector_store_path)
-            print(f"✅ 向量存储已保存到: {vector_store_path}")
-            
-            print(f"✅ 成功添加 {len(split_docs)} 个文档块到向量存储")
+        return split_docs
+    
+    def _write_chunks(self, split_docs: List[Document], target: VectorCollection,
+                      report: Callable[..., None] = None, persist: bool = True) -> int:
+        """向量化文档块并一次性写入集合，返回写入的块数
+        
+        块ID由 (文档ID, 块序号) 确定性生成；persist=False 时由调用方统一保存。
+        """
+        if not split_docs:
+            return 0
+        report = report or (lambda stage, **info: None)
+        
+        # 向量化（先查块向量缓存）
+        report("embedding", chunks_count=len(split_docs))
+        texts = [doc.page_content for doc in split_docs]
+        metadatas = [doc.metadata for doc in split_docs]
+        ids = [chunk_id_for(doc.metadata["document_id"], doc.metadata["chunk_index"]) for doc in split_docs]
+        text_embeddings = list(zip(texts, self._embed_chunks(texts, target.embeddings)))
+        
+        # 添加到向量存储（同步更新BM25索引）
+        report("indexing")
+        target.add_embeddings(text_embeddings, metadatas, ids, persist=persist)
+        self._bump_index_version(target)
+        return len(split_docs)
+    
+    def ingest_documents(self, documents: List[Dict[str, Any]], collection: Optional[str] = None,
+                         progress: Optional[Callable[..., None]] = None) -> int:
+        """分块、向量化并写入指定集合，返回写入的块数；失败时抛出异常
+        
+        progress(stage, **info) 用于上报进度（入库任务队列使用）。
+        """
+        report = progress or (lambda stage, **info: None)
+        target = self.get_collection(collection)
+        print(f"🔍 开始添加 {len(documents)} 个文档到LangChain存储 (集合: {target.name})")
+        
+        # 分块
+        report("splitting")
+        print("📝 开始文档分块...")
+        split_docs = self._split_documents(documents, target.name)
+        print(f"✅ 分块完成，共生成 {len(split_docs)} 个文档块")
+        
+        print("💾 开始添加到向量存储...")
+        replaced = self._existing_documents(documents, target)
+        count = self._write_chunks(split_docs, target, report, persist=False)
+        counts = {doc["id"]: 0 for doc in documents}
+        for doc in split_docs:
+            counts[doc.metadata["document_id"]] += 1
+        self._drop_stale_chunks(target, replaced, counts)
+        target.save()
+        print(f"✅ 成功添加 {count} 个文档块到向量存储: {target.path}")
+        return count
+    
+    @staticmethod
+    def _existing_documents(documents: List[Dict[str, Any]], target: VectorCollection) -> List[str]:
+        """已经入库过的文档ID（按第一个块的确定性块ID判断），写入前调用"""
+        return [doc["id"] for doc in documents if target.get_document(chunk_id_for(doc["id"], 0)) is not None]
+    
+    def _drop_stale_chunks(self, target: VectorCollection, replaced: List[str], counts: Dict[str, int]):
+        """重新入库的文档：新块已按块ID覆盖，删除旧版本多出来的块（不保存，由调用方保存）"""
+        if not replaced:
+            return
+        keep = {chunk_id_for(doc_id, i) for doc_id in replaced for i in range(counts.get(doc_id, 0))}
+        removed = target.delete_documents(replaced, keep_chunk_ids=keep, persist=False)
+        if removed:
+            self._bump_index_version(target)
+            print(f"🧹 删除重新入库文档的旧块: {removed} 个")
+    
+    def ingest_batch(self, documents: List[Dict[str, Any]], collection: Optional[str] = None,
+                     target: Optional[VectorCollection] = None) -> Dict[str, int]:
+        """批量入库（批量导入接口、重建索引脚本使用）
+        
+        文档在预处理进程池中并行分块，按原顺序取回；每攒够 ingest_embed_batch_chunks 个块
+        向量化并写入一次（此时进程池继续处理后面的文档），整批结束后只保存一次索引。
+        target 指定时直接写入该集合对象（例如重建中的临时索引），忽略 collection。
+        
+        Returns:
+            文档ID -> 块数；失败时抛出异常，本批已写入的块会被删除
+        """
+        target = target or self.get_collection(collection)
+        counts = {}
+        pending: List[Document] = []
+        total = 0
+        replaced = self._existing_documents(documents, target)
+        
+        try:
+            for doc, pieces in zip(documents, get_preprocess_pool().split_documents(documents, target.name)):
+                counts[doc["id"]] = len(pieces)
+                pending.extend(pieces)
+                if len(pending) >= settings.ingest_embed_batch_chunks:
+                    total += self._write_chunks(pending, target, persist=False)
+                    pending = []
+            total += self._write_chunks(pending, target, persist=False)
+            self._drop_stale_chunks(target, replaced, counts)
+        except Exception:
+            if total:
+                target.delete_documents(list(counts))
+                self._bump_index_version(target)
+            raise
+        
+        target.save()
+        print(f"✅ 批量写入 {len(documents)} 个文档, {total} 个文档块 (集合: {target.name})")
+        return counts
+    
+    def ingest_stream(self, blocks: Iterable[str], document: Dict[str, Any], collection: Optional[str] = None) -> int:
+        """流式入库一个大文档：文本块流 -> 增量分块 -> 分批向量化 -> 写入索引，最后保存一次
+        
+        document 提供 id、title、created_at、file_type（不含 content）。
+        内存占用只与分块窗口和向量化批大小有关，与文件大小无关。失败时抛出异常，已写入的块会被删除。
+        """
+        target = self.get_collection(collection)
+        print(f"🔍 开始流式入库: {document.get('title', 'Unknown')} (ID: {document['id']}, 集合: {target.name})")
+        base_metadata = {
+            "document_id": document["id"],
+            "title": document["title"],
+            "created_at": document.get("created_at", ""),
+            "file_type": document.get("file_type", ""),
+            "collection": target.name
+        }
+        
+        chunks = split_text_stream(blocks, self.text_splitter, settings.stream_split_window_chars)
+        batch: List[Document] = []
+        count = 0
+        replaced = self._existing_documents([document], target)
+        
+        try:
+            for text, start in chunks:
+                doc = Document(page_content=text, metadata=dict(base_metadata, start_index=start))
+                annotate_chunk(doc, count)
+                batch.append(doc)
+                count += 1
+                if len(batch) >= settings.ingest_embed_batch_chunks:
+                    self._write_chunks(batch, target, persist=False)
+                    batch = []
+            self._write_chunks(batch, target, persist=False)
+            self._drop_stale_chunks(target, replaced, {document["id"]: count})
+        except Exception:
+            # 回滚已写入的块，避免留下半个文档
+            if count:
+                target.delete_document(document["id"])
+            self._bump_index_version(target)
+            raise
+        
+        target.save()
+        print(f"✅ 流式入库完成: {count} 个文档块 (集合: {target.name})")
+        return count
+    
+    def add_documents(self, documents: List[Dict[str, Any]], collection: Optional[str] = None) -> bool:
+        """添加文档到指定集合的向量存储，集合名称无效时抛出ValueError"""
+        self.check_collection_name(collection)
+        try:
+            self.ingest_documents(documents, collection)
             return True
             
         except Exception as e:
@@ -225,29 +514,17 @@ class LangChainRAGService:
             }               
             
     
-    async def search_documents(self, query: str, top_k: int = 10, threshold: float = 0.1) -> List[Dict[str, Any]]:
+    async def search_documents(self, query: str, top_k: int = 10, threshold: float = 0.1,
+                               collections: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """搜索文档（返回文档级别的结果）"""
         try:
-            print(f"🔍 LangChain搜索文档: '{query}', top_k={top_k}, threshold={threshold}")
-            
-            if self.vector_store is None:
-                print("❌ 向量存储为空")
-                return []
+            print(f"🔍 LangChain搜索文档: '{query}', top_k={top_k}, threshold={threshold}, 集合={collections or [settings.default_collection]}")
             
-            print(f"📊 向量存储状态: {len(self.vector_store.index_to_docstore_id)} 个文档")
-            
-            # 创建检索器，不使用score_threshold，让所有结果都返回
-            retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={
-                    "k": top_k * 2,  # 获取更多块以便去重
-                    # 暂时不使用score_threshold，让所有结果都返回
-                }
-            )
-            
-            # 执行搜索
-            print("🔍 执行向量搜索...")
-            docs_and_scores = await retriever.aget_relevant_documents(query)
+            # 执行搜索（获取更多块以便去重）
+            print("🔍 执行检索...")
+            query_vector = await self.aembed_query(query)
+            retrieved = await asyncio.to_thread(self.retrieve, query_vector, top_k * 2, query_text=query, collections=collections)
+            docs_and_scores = [item["document"] for item in retrieved]
             print(f"📄 搜索到 {len(docs_and_scores)} 个文档块")
             
             # 打印每个块的详细信息
@@ -304,41 +581,31 @@ class LangChainRAGService:
             traceback.print_exc()
             return []
     
-    def delete_document(self, document_id: str) -> bool:
-        """从向量存储中删除指定文档的所有向量"""
+    def delete_document(self, document_id: str, collection: Optional[str] = None) -> bool:
+        """从向量存储中删除指定文档的所有向量，未指定集合时在所有集合中查找"""
         try:
             print(f"🗑️ 从LangChain存储删除文档: {document_id}")
             
-            if self.vector_store is None:
-                print("❌ 向量存储为空")
-                return False
-            
-            print(f"📊 删除前向量存储状态: {len(self.vector_store.index_to_docstore_id)} 个文档")
-            
-            # 找到要删除的文档块ID
-            doc_ids_to_delete = []
-            for idx, doc_id in self.vector_store.index_to_docstore_id.items():
-                # 获取文档的元数据
-                doc = self.vector_store.docstore._dict.get(doc_id)
-                if doc and doc.metadata.get('document_id') == document_id:
-                    doc_ids_to_delete.append(doc_id)
-            
-            if not doc_ids_to_delete:
+            if collection:
+                targets = [self.get_collection(collection, create=False)]
+            else:
+                targets = [self.get_collection(name, create=False) for name in self.list_collections()]
+            
+            deleted = 0
+            for target in targets:
+                if target is None:
+                    continue
+                count = target.delete_document(document_id)
+                if count:
+                    print(f"🔍 集合 {target.name} 中删除 {count} 个相关文档块")
+                    deleted += count
+            
+            if not deleted:
                 print(f"⚠️ 未找到文档 {document_id} 的向量数据")
                 return True  # 认为删除成功，因为本来就没有
             
-            print(f"🔍 找到 {len(doc_ids_to_delete)} 个相关文档块")
-            
-            # 删除文档块
-            self.vector_store.delete(doc_ids_to_delete)
-            
-            # 保存更新后的向量存储
-            vector_store_path = f"{settings.data_dir}/faiss/langchain_vectorstore"
-            self.vector_store.save_local(vector_store_path)
-            
-            print(f"📊 删除后向量存储状态: {len(self.vector_store.index_to_docstore_id)} 个文档")
+            self._bump_index_version()
             print(f"✅ 成功删除文档 {document_id} 的向量数据")
-            
             return True
             
         except Exception as e:
@@ -369,24 +636,24 @@ class LangChainRAGService:
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         try:
-            if self.vector_store is None:
-                return {
-                    "total_chunks": 0,
-                    "vector_store_ok": False,
-                    "llm_ok": False
-                }
-            
-            # 获取向量存储统计
-            total_chunks = len(self.vector_store.index_to_docstore_id) if self.vector_store else 0
+            # 获取各集合统计
+            collections = {name: self.get_collection(name).get_stats() for name in self.list_collections()}
+            total_chunks = sum(stats["total_chunks"] for stats in collections.values())
             
             # 测试向量存储
-            vector_store_ok = self.vector_store is not None
+            vector_store_ok = settings.default_collection in self.collections
             
             # 测试LLM（简化测试）
             llm_ok = self.llm is not None
             
             return {
                 "total_chunks": total_chunks,
+                "index_version": self.index_version,
+                "collections": collections,
+                "retrieval_cache": self.retrieval_cache.get_stats(),
+                "query_embedding_cache": get_embedding_cache(self.embeddings.cache_namespace).get_stats(),
+                "chunk_embedding_cache": get_chunk_embedding_store(self.embeddings.cache_namespace).get_stats(),
+                "loaded_embedding_models": list_models(),
                 "vector_store_ok": vector_store_ok,
                 "llm_ok": llm_ok
             }
@@ -399,49 +666,258 @@ class LangChainRAGService:
                 "llm_ok": False,
                 "error": str(e)
             }
-    async def query(self, query: str, top_k: int = 5, threshold: float = 0.3) -> Dict[str, Any]:
-        """查询问答"""
-        import numpy as np
-        try:
-            if self.vector_store is None:
-                print(f"❌ 向量存储为空")
-                return {
-                    "answer": "向量存储未初始化",
-                    "sources": [],
-                    "confidence": 0.0
-                }
-            print(f"🔍 LangChain查询: '{query}', top_k={top_k}, threshold={threshold}")
-            retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": top_k}
+    def embed_query(self, query: str) -> np.ndarray:
+        """计算查询向量"""
+        return self.embeddings.embed_query(query)
+    
+    async def aembed_query(self, query: str) -> np.ndarray:
+        """异步计算查询向量"""
+        return await self.embeddings.aembed_query(query)
+    
+    def search_ids(self, query_vector: List[float], top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                   query_text: Optional[str] = None, hybrid: Optional[bool] = None,
+                   collections: Optional[List[str]] = None, embeddings=None) -> List[tuple]:
+        """按查询检索，只返回 (块ID, 分数)，结果按所涉及集合的版本缓存
+        
+        纯向量检索时分数为L2距离；混合检索（需提供query_text）时，
+        向量和BM25各召回 top_k * hybrid_candidate_multiplier 个候选，按RRF分数融合排序。
+        指定多个集合时分别检索，合并后取全局top_k。
+        embeddings 为计算 query_vector 时的模型对象，传入时校验其仍是当前模型。
+        """
+        targets = [c for c in self._resolve_collections(collections) if c.total_chunks > 0]
+        # 在取到集合之后校验：若已切换，取到的可能是新模型的集合
+        self.check_serving(embeddings)
+        if not targets:
+            return []
+        
+        use_hybrid = hybrid if hybrid is not None else settings.hybrid_search_enabled
+        use_hybrid = bool(use_hybrid and query_text)
+        
+        cache_key = None
+        version = tuple((c.name, c.embedding_model, c.version) for c in targets)
+        if settings.retrieval_cache_enabled:
+            cache_key = ResponseCache.make_key(
+                "retrieve", ResponseCache.vector_digest(query_vector), top_k, filters or {},
+                "hybrid" if use_hybrid else "dense", query_text if use_hybrid else None,
+                [c.name for c in targets]
+            )
+            cached = self.retrieval_cache.get(cache_key, version)
+            if cached is not None:
+                return list(cached)
+        
+        def dense(k: int) -> List[tuple]:
+            # 同一向量模型，各集合的L2距离可直接比较
+            hits = [hit for c in targets for hit in c.dense_search(query_vector, k, filters)]
+            return sorted(hits, key=lambda x: x[1])[:k]
+        
+        if use_hybrid:
+            candidates = top_k * max(1, settings.hybrid_candidate_multiplier)
+            dense_hits = dense(candidates)
+            keyword_hits = sorted(
+                (hit for c in targets for hit in c.keyword_search(query_text, candidates, filters)),
+                key=lambda x: x[1], reverse=True
+            )[:candidates]
+            fused = reciprocal_rank_fusion(
+                [[chunk_id for chunk_id, _ in dense_hits], [chunk_id for chunk_id, _ in keyword_hits]],
+                k=settings.rrf_k
             )
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=retriever,
-                return_source_documents=True,
-                chain_type_kwargs={"prompt": self._get_qa_prompt()}
+            hits = fused[:top_k]
+            print(f"🔀 混合检索: 向量 {len(dense_hits)} + BM25 {len(keyword_hits)} 个候选，RRF融合后 {len(hits)} 个")
+        else:
+            hits = dense(top_k)
+        
+        if cache_key is not None:
+            self.retrieval_cache.put(cache_key, version, hits)
+        return hits
+    
+    def get_vectors(self, chunk_ids: List[str]):
+        """从FAISS索引中取回已存储的块向量（不重新计算），返回 (n, dim) 的float32矩阵"""
+        return np.asarray([self._locate(chunk_id).get_vector(chunk_id) for chunk_id in chunk_ids], dtype=np.float32)
+    
+    def diversify(self, query_vector: List[float], hits: List[tuple], k: int,
+                  lambda_mult: float = None, duplicate_threshold: float = None, embeddings=None) -> List[tuple]:
+        """MMR多样化：从候选中选出至多k个互不重复的块，重叠的相邻块会被剔除"""
+        self.check_serving(embeddings)
+        if len(hits) <= 1:
+            return hits[:k]
+        lambda_mult = lambda_mult if lambda_mult is not None else settings.mmr_lambda
+        duplicate_threshold = duplicate_threshold if duplicate_threshold is not None else settings.mmr_duplicate_threshold
+        
+        vectors = self.get_vectors([chunk_id for chunk_id, _ in hits])
+        # 取向量期间可能发生切换
+        self.check_serving(embeddings)
+        selected = maximal_marginal_relevance(query_vector, vectors, k, lambda_mult, duplicate_threshold)
+        print(f"🧩 MMR多样化: {len(hits)} 个候选 -> {len(selected)} 个块 (λ={lambda_mult})")
+        return [hits[i] for i in selected]
+    
+    def expand_neighbors(self, retrieved: List[Dict[str, Any]], token_allowance: int, top_n: int = None) -> List[Dict[str, Any]]:
+        """为排名靠前的块补充相邻块（优先后一块），只在剩余token预算放得下时补充
+        
+        补充的块追加在末尾，随后由 coalesce_chunks 合并到原块的位置。
+        """
+        top_n = top_n if top_n is not None else settings.neighbor_expansion_top_n
+        present = {item["chunk_id"] for item in retrieved}
+        expanded = list(retrieved)
+        
+        for item in retrieved[:top_n]:
+            metadata = item["document"].metadata
+            collection = self._locate(item["chunk_id"])
+            if metadata.get("chunk_index") is None or collection is None:
+                continue
+            positions = collection.chunk_position_map()
+            for offset in (1, -1):
+                neighbor_id = positions.get((metadata.get("document_id"), metadata["chunk_index"] + offset))
+                if neighbor_id is None or neighbor_id in present:
+                    continue
+                doc = collection.get_document(neighbor_id)
+                if doc is None:
+                    continue
+                tokens = doc.metadata.get("token_count") or self.context_packer.count_tokens(doc.page_content)
+                if tokens > token_allowance:
+                    continue
+                token_allowance -= tokens
+                present.add(neighbor_id)
+                expanded.append({"chunk_id": neighbor_id, "score": item["score"], "document": doc})
+        
+        if len(expanded) > len(retrieved):
+            print(f"↔️ 补充 {len(expanded) - len(retrieved)} 个相邻块")
+        return expanded
+    
+    def materialize(self, hits: List[tuple]) -> List[Dict[str, Any]]:
+        """根据块ID从docstore取出文档"""
+        results = []
+        for chunk_id, score in hits:
+            collection = self._locate(chunk_id)
+            doc = collection.get_document(chunk_id) if collection is not None else None
+            if doc is None:
+                continue
+            results.append({
+                "chunk_id": chunk_id,
+                "score": score,
+                "document": doc
+            })
+        return results
+    
+    def retrieve(self, query_vector: List[float], top_k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                 query_text: Optional[str] = None, hybrid: Optional[bool] = None,
+                 collections: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """检索文档块，返回块ID、分数和文档"""
+        return self.materialize(self.search_ids(
+            query_vector, top_k, filters, query_text=query_text, hybrid=hybrid, collections=collections
+        ))
+    
+    async def generate(self, query: str, retrieved: List[Dict[str, Any]], query_vector: Optional[List[float]] = None,
+                       history: Optional[List[Dict[str, Any]]] = None, compress: Optional[bool] = None,
+                       expand_neighbors: Optional[bool] = None, embeddings=None) -> Dict[str, Any]:
+        """基于检索结果调用LLM生成答案，上下文和历史按token预算打包
+        
+        embeddings 为计算 query_vector 时的模型对象；压缩和置信度计算使用同一模型。
+        """
+        try:
+            embeddings = embeddings or self.embeddings
+            compressor = self.context_compressor if embeddings is self.embeddings else ContextCompressor(embeddings.embed_documents)
+            if query_vector is None:
+                query_vector = await embeddings.aembed_query(query)
+            
+            prompt_template = self._get_qa_prompt()
+            template_tokens = self.context_packer.count_tokens(prompt_template.format(context="", question=""))
+            
+            # 可选：在预算有余量时补充相邻块
+            if expand_neighbors if expand_neighbors is not None else settings.neighbor_expansion_enabled:
+                used_tokens = template_tokens + self.context_packer.count_tokens(query)
+                if history:
+                    used_tokens += self.context_packer.history_token_budget
+                used_tokens += sum(
+                    item["document"].metadata.get("token_count") or self.context_packer.count_tokens(item["document"].page_content)
+                    for item in retrieved
+                )
+                retrieved = await asyncio.to_thread(self.expand_neighbors, retrieved, self.context_packer.token_budget - used_tokens)
+            
+            # 同一文档中相邻/重叠的块合并为一段，重叠文本只发送一次
+            if settings.chunk_merge_enabled:
+                merged = coalesce_chunks(retrieved)
+                if len(merged) < len(retrieved):
+                    print(f"🔗 合并相邻块: {len(retrieved)} -> {len(merged)}")
+                retrieved = merged
+            
+            chunks = [{
+                "content": item["document"].page_content,
+                "token_count": item["document"].metadata.get("token_count")
+            } for item in retrieved]
+            
+            # 可选：抽取式压缩，只保留与问题相关的句子
+            compression = None
+            if compress if compress is not None else settings.context_compression_enabled:
+                # 句子向量化在推理线程池中执行，这里只等待结果
+                compression = await asyncio.to_thread(compressor.compress, query_vector, [chunk["content"] for chunk in chunks])
+                chunks = [{"content": text} for text in compression["chunks"]]
+                print(f"🗜️ 上下文压缩: {compression['original_chars']} -> {compression['compressed_chars']} 字符, "
+                      f"保留 {compression['sentences_kept']}/{compression['sentences_total']} 句")
+            
+            # 压缩后为空的块不再参与打包
+            candidates = [i for i, chunk in enumerate(chunks) if chunk["content"]]
+            packed = self.context_packer.pack(
+                query,
+                [chunks[i] for i in candidates],
+                history,
+                template_tokens=template_tokens
             )
+            packed["chunk_indices"] = [candidates[i] for i in packed["chunk_indices"]]
+            source_docs = [retrieved[i]["document"] for i in packed["chunk_indices"]]
+            if packed["chunks_dropped"]:
+                print(f"✂️ 超出token预算，丢弃 {packed['chunks_dropped']} 个文档块")
+            
+            question = query
+            if packed["history_text"]:
+                question = f"历史对话:\n{packed['history_text']}\n\n当前问题: {query}"
+            prompt = prompt_template.format(context=packed["context"], question=question)
+            prompt_tokens = self.context_packer.count_tokens(prompt)
+            print(f"📏 prompt token数: {prompt_tokens} (预算: {self.context_packer.token_budget})")
+            
             print("Push to llm.... Query is :", query)
-            result = await qa_chain.ainvoke({"query": query})
-            answer = result.get("result", "")
-            source_docs = result.get("source_documents", [])
+            answer = await self.llm.ainvoke(prompt)
+            
             sources = [{
                 "content_preview": doc.page_content[:100] + "..." if len(doc.page_content) > 100 else doc.page_content,
                 "metadata": doc.metadata
             } for doc in source_docs]
-            # 计算真实的相似度
-            total_similarity = 0.0
-            for doc in source_docs:
-                query_embedding = self.embeddings.embed_query(query)
-                doc_embedding = self.embeddings.embed_query(doc.page_content)
-                similarity = np.dot(query_embedding, doc_embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding))
-                total_similarity += similarity
+            
+            # 计算真实的相似度（文档向量一次批量计算）
+            confidence = 0.0
+            if source_docs:
+                query_embedding = np.asarray(query_vector, dtype=np.float32)
+                doc_embeddings = np.asarray(
+                    await embeddings.aembed_documents([doc.page_content for doc in source_docs]),
+                    dtype=np.float32
+                )
+                confidence = float(cosine_similarity_matrix(query_embedding, doc_embeddings).mean())
+            
             return {
                 "answer": answer,
                 "sources": sources,
-                "confidence": total_similarity / len(source_docs) if source_docs else 0.0
+                "confidence": confidence,
+                "prompt_tokens": prompt_tokens,
+                "compression": compression
+            }
+        except Exception as e:
+            print(f"❌ LangChain生成答案失败: {e}")
+            import traceback
+            traceback.print_exc()
+            return {
+                "answer": "抱歉，查询过程中出现错误。",
+                "sources": [],
+                "confidence": 0.0,
+                "error": str(e)
             }
+    
+    async def query(self, query: str, top_k: int = 5, threshold: float = 0.3,
+                    collections: Optional[List[str]] = None) -> Dict[str, Any]:
+        """查询问答"""
+        try:
+            print(f"🔍 LangChain查询: '{query}', top_k={top_k}, threshold={threshold}")
+            query_vector = await self.aembed_query(query)
+            retrieved = await asyncio.to_thread(self.retrieve, query_vector, top_k, query_text=query, collections=collections)
+            return await self.generate(query, retrieved, query_vector)
         except Exception as e:
             print(f"❌ LangChain查询失败: {e}")
             import traceback
@@ -451,9 +927,3 @@ class LangChainRAGService:
                 "sources": [],
                 "confidence": 0.0
             }
-
-
-
-
-
-
@@ -0,0 +1,277 @@
+"""
+向量模型迁移：后台用新模型构建影子索引，对比召回率后原子切换
+"""
+
+import time
+import random
+import shutil
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional
+from app.config import settings
+from app.services.langchain_service import LangChainRAGService, create_embeddings
+from app.services.vector_collection import VectorCollection, publish_index
+
+
+class ModelMigration:
+    """向量模型迁移（零停机）
+
+    1. 后台线程按限速用新模型为每个集合构建影子索引（<集合目录>.shadow），查询仍由旧索引服务；
+    2. 构建完成后定期与线上集合对账（补入新增文档、删除已删文档），状态变为 ready；
+    3. ready 后按比例抽样线上查询，分别用新旧模型检索，记录影子索引相对旧索引的召回率；
+    4. 切换时持有所有集合的写入锁做最后一次对账（只阻塞写入，检索照常），
+       然后一次性替换模型和全部集合，旧目录保留为备份。
+    """
+
+    def __init__(self):
+        self.service = LangChainRAGService()
+        self.status = "idle"  # idle, loading, building, ready, switching, completed, failed, cancelled
+        self.target_model: Optional[str] = None
+        self.source_model: Optional[str] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.progress: Dict[str, Dict[str, int]] = {}
+
+        self._embeddings = None
+        self._shadows: Dict[str, VectorCollection] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        self.recall_samples = deque(maxlen=1000)
+
+    # ---------- 控制 ----------
+
+    def start(self, target_model: Optional[str] = None) -> Dict[str, Any]:
+        """开始迁移到目标模型（默认为配置中的 embedding_model）"""
+        target_model = target_model or settings.embedding_model
+        with self._lock:
+            if self.status in ("loading", "building", "ready", "switching"):
+                raise ValueError(f"已有迁移在进行中: {self.target_model}（{self.status}）")
+            if target_model == self.service.embedding_model_name:
+                raise ValueError(f"当前已在使用模型 {target_model}")
+            self.status = "loading"
+            self.target_model = target_model
+            self.source_model = self.service.embedding_model_name
+            self.error = None
+            self.started_at = time.time()
+            self.finished_at = None
+            self.progress = {}
+            self.recall_samples.clear()
+            self._shadows = {}
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-migration", daemon=True)
+            self._thread.start()
+        print(f"🚚 开始向量模型迁移: {self.source_model} -> {target_model}")
+        return self.get_status()
+
+    def cancel(self) -> Dict[str, Any]:
+        """取消迁移并删除影子索引"""
+        with self._lock:
+            if self.status not in ("loading", "building", "ready"):
+                raise ValueError(f"当前没有可取消的迁移（{self.status}）")
+            self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=60)
+        for shadow in self._shadows.values():
+            shutil.rmtree(shadow.path, ignore_errors=True)
+        self._shadows = {}
+        self.status = "cancelled"
+        self.finished_at = time.time()
+        print("🛑 向量模型迁移已取消")
+        return self.get_status()
+
+    def switch(self, force: bool = False) -> Dict[str, Any]:
+        """切换到影子索引；未 force 时要求抽样数和平均召回率达到阈值"""
+        with self._lock:
+            if self.status != "ready":
+                raise ValueError(f"影子索引尚未就绪（{self.status}）")
+            recall = self.mean_recall()
+            if not force:
+                if len(self.recall_samples) < settings.migration_min_samples:
+                    raise ValueError(f"召回率抽样不足: {len(self.recall_samples)}/{settings.migration_min_samples}")
+                if recall < settings.migration_min_recall:
+                    raise ValueError(f"影子索引召回率 {recall:.3f} 低于阈值 {settings.migration_min_recall}")
+            self.status = "switching"
+            self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=300)
+
+        # 先补上后台线程最近一次对账之后新建的集合
+        self._sync_all(throttle=False)
+        lives = {name: self.service.get_collection(name) for name in self._shadows}
+        ordered = [lives[name] for name in sorted(lives)]
+        for live in ordered:
+            live.write_lock.acquire()
+        try:
+            # 持有所有线上集合的写入锁：最后一次对账期间不会有新的写入，检索不受影响
+            for name in sorted(lives):
+                self._sync(lives[name], self._shadows[name], throttle=False)
+            for name in sorted(lives):
+                live, shadow = lives[name], self._shadows[name]
+                shadow.save()
+                backup_path = publish_index(live.path, shadow.path)
+                shadow.path, live.path = live.path, backup_path
+                if backup_path:
+                    print(f"📦 集合 {name} 的旧索引备份在: {backup_path}")
+            self.service.switch_serving(self._embeddings, self._shadows)
+        except Exception as e:
+            self.status = "failed"
+            self.error = f"切换失败: {e}"
+            print(f"❌ 向量模型切换失败: {e}")
+            raise
+        finally:
+            for live in reversed(ordered):
+                live.write_lock.release()
+
+        self.status = "completed"
+        self.finished_at = time.time()
+        print(f"✅ 向量模型迁移完成: {self.source_model} -> {self.target_model}")
+        return self.get_status()
+
+    # ---------- 后台构建 ----------
+
+    def _run(self):
+        try:
+            self._embeddings = create_embeddings(self.target_model)
+            self.status = "building"
+            self._sync_all()
+            if self._stop.is_set():
+                return
+
+            self.status = "ready"
+            print("✅ 全部影子索引已就绪，开始抽样对比召回率")
+            # 就绪后定期对账，追上迁移期间的新增、删除和新建的集合
+            while not self._stop.wait(settings.migration_sync_interval):
+                self._sync_all()
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            self.finished_at = time.time()
+            print(f"❌ 向量模型迁移失败: {e}")
+
+    def _sync_all(self, throttle: bool = True):
+        """为每个集合创建（首次）并对账影子索引"""
+        for name in self.service.list_collections():
+            if throttle and self._stop.is_set():
+                return
+            live = self.service.get_collection(name)
+            shadow = self._shadows.get(name)
+            if shadow is None:
+                shadow_path = f"{live.path}.shadow"
+                shutil.rmtree(shadow_path, ignore_errors=True)
+                shadow = VectorCollection(name, shadow_path, self._embeddings)
+                self._shadows[name] = shadow
+                self._sync(live, shadow, throttle)
+                print(f"✅ 影子索引构建完成: {name}, {shadow.total_chunks} 个块")
+            else:
+                self._sync(live, shadow, throttle)
+
+    def _sync(self, live: VectorCollection, shadow: VectorCollection, throttle: bool = True):
+        """对账：影子索引补入线上新增的文档、删除线上已删的文档"""
+        live_ids = live.document_ids()
+        shadow_ids = shadow.document_ids()
+        removed = shadow_ids - live_ids
+        if removed:
+            shadow.delete_documents(list(removed))
+
+        missing = live_ids - shadow_ids
+        if not missing:
+            return
+        progress = self.progress.setdefault(live.name, {"documents_total": 0, "documents_done": 0, "chunks": 0})
+        progress["documents_total"] = len(live_ids)
+        batch: List[Dict[str, Any]] = []
+        for document in live.iter_documents(missing):
+            if throttle and self._stop.is_set():
+                break
+            batch.append(document)
+            if len(batch) >= settings.migration_batch_documents:
+                self._ingest(batch, shadow, progress, throttle)
+                batch = []
+        if batch and not (throttle and self._stop.is_set()):
+            self._ingest(batch, shadow, progress, throttle)
+
+    def _ingest(self, batch: List[Dict[str, Any]], shadow: VectorCollection, progress: Dict[str, int], throttle: bool):
+        """写入一批文档，并按 migration_max_chunks_per_second 限速"""
+        batch_start = time.time()
+        counts = self.service.ingest_batch(batch, target=shadow)
+        chunks = sum(counts.values())
+        progress["documents_done"] = len(shadow.document_ids())
+        progress["chunks"] = shadow.total_chunks
+        if throttle and settings.migration_max_chunks_per_second > 0:
+            wait = chunks / settings.migration_max_chunks_per_second - (time.time() - batch_start)
+            if wait > 0:
+                self._stop.wait(wait)
+
+    # ---------- 召回率抽样 ----------
+
+    def should_sample(self) -> bool:
+        return self.status == "ready" and random.random() < settings.migration_sample_rate
+
+    def sample_recall(self, query: str, collections: Optional[List[str]] = None):
+        """用新旧模型分别做向量检索，记录影子索引对旧索引top-k的召回率（在后台线程中调用）
+
+        块按 (文档ID, 块序号) 对齐，旧数据的块ID与影子索引不同也能比较。
+        """
+        try:
+            k = settings.migration_recall_k
+            old_keys = set()
+            new_keys = set()
+            old_vector = self.service.embed_query(query)
+            new_vector = self._embeddings.embed_query(query)
+            for name in collections or [settings.default_collection]:
+                shadow = self._shadows.get(name)
+                live = self.service.get_collection(name, create=False)
+                if shadow is None or live is None:
+                    continue
+                old_keys.update(self._position_keys(live, live.dense_search(old_vector, k)))
+                new_keys.update(self._position_keys(shadow, shadow.dense_search(new_vector, k)))
+            if old_keys:
+                recall = len(old_keys & new_keys) / len(old_keys)
+                self.recall_samples.append(recall)
+        except Exception as e:
+            print(f"⚠️ 召回率抽样失败: {e}")
+
+    @staticmethod
+    def _position_keys(collection: VectorCollection, hits: List[tuple]) -> List[tuple]:
+        keys = []
+        for chunk_id, _ in hits:
+            doc = collection.get_document(chunk_id)
+            if doc is not None:
+                keys.append((doc.metadata.get("document_id"), doc.metadata.get("chunk_index")))
+        return keys
+
+    def mean_recall(self) -> float:
+        samples = list(self.recall_samples)
+        return sum(samples) / len(samples) if samples else 0.0
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取迁移状态"""
+        return {
+            "status": self.status,
+            "source_model": self.source_model,
+            "target_model": self.target_model,
+            "serving_model": self.service.embedding_model_name,
+            "progress": self.progress,
+            "recall_samples": len(self.recall_samples),
+            "mean_recall": self.mean_recall(),
+            "min_recall": settings.migration_min_recall,
+            "min_samples": settings.migration_min_samples,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+_model_migration: Optional[ModelMigration] = None
+_model_migration_lock = threading.Lock()
+
+
+def get_model_migration() -> ModelMigration:
+    """获取共享的模型迁移管理器（进程内单例）"""
+    global _model_migration
+    with _model_migration_lock:
+        if _model_migration is None:
+            _model_migration = ModelMigration()
+        return _model_migration
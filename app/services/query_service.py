@@ -1,11 +1,19 @@
 import time
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Optional
 from app.models.document import QueryRequest, QueryResponse, DocumentChunk
 from app.utils.embedding_service import EmbeddingService
 from app.utils.llm_service import LLMService
 from app.services.storage_factory import StorageFactory
-from app.services.langchain_service import LangChainRAGService
+from app.services.langchain_service import LangChainRAGService, EmbeddingModelChangedError
+from app.services.model_migration import get_model_migration
 from app.services.memory_context import MemoryContext
+from app.services.answer_cache import SemanticAnswerCache
+from app.services.response_cache import ResponseCache
+from app.services.reranker import get_reranker
+from app.utils.latency_tracker import LatencyTracker
+from app.utils.inference_executor import run_inference_async
+from app.utils.context_packer import ContextPacker
 from app.config import settings
 
 class QueryService:
@@ -16,12 +24,56 @@ class QueryService:
         self.storage = StorageFactory.create_storage()
         self.embedding_service = EmbeddingService()
         self.llm_service = LLMService()
+        self.context_packer = ContextPacker()
         
         # 新增LangChain RAG服务
         self.langchain_service = LangChainRAGService()
         
         # 新增MemoryContext历史记忆服务
         self.memory_context = MemoryContext()
+        
+        # 语义答案缓存
+        self.answer_cache = SemanticAnswerCache()
+        
+        # 精确匹配响应缓存
+        self.response_cache = ResponseCache()
+        
+        # 切换向量模型时由LangChain服务清空两级缓存
+        self.langchain_service.register_model_cache(self.answer_cache)
+        self.langchain_service.register_model_cache(self.response_cache)
+        
+        # 交叉编码器重排序（进程内共享）
+        self.reranker = get_reranker()
+        
+        # 分阶段延迟统计
+        self.latency = LatencyTracker()
+        
+        # 向量模型迁移（影子索引召回率抽样）
+        self.migration = get_model_migration()
+    
+    def _store_version(self) -> tuple:
+        """当前向量存储版本（LangChain存储 + 原有存储），增删文档后变化"""
+        return (self.langchain_service.index_version, getattr(self.storage, "version", 0))
+    
+    def _save_conversation(self, session_id: str, query: str, answer: str):
+        """存储本轮对话到记忆"""
+        print("💾 存储对话记忆...")
+        try:
+            # 存储用户问题
+            self.memory_context.add_memory(
+                session_id=session_id,
+                role="user",
+                content=query
+            )
+            # 存储助手回答
+            self.memory_context.add_memory(
+                session_id=session_id,
+                role="assistant",
+                content=answer
+            )
+            print("✅ 对话记忆存储成功")
+        except Exception as e:
+            print(f"⚠️ 存储对话记忆失败: {e}")
     
     async def query(self, request: QueryRequest) -> QueryResponse:
         """处理查询请求 - 使用LangChain RAG + MemoryContext历史记忆"""
@@ -49,6 +101,38 @@ class QueryService:
             else:
                 print("📚 无历史记录，开始新会话")
             
+            # 会话历史会写入prompt，两级答案缓存都按历史摘要区分
+            history_digest = ResponseCache.digest(history_text)
+            
+            # 精确匹配响应缓存：相同问题、参数和会话历史直接返回
+            response_key = None
+            store_version = self._store_version()
+            if settings.response_cache_enabled:
+                response_key = ResponseCache.make_key(
+                    "query",
+                    ResponseCache.normalize_query(request.query),
+                    top_k,
+                    threshold,
+                    request.include_metadata,
+                    request.compress_context,
+                    request.hybrid_search,
+                    request.rerank,
+                    request.use_mmr,
+                    request.mmr_lambda,
+                    request.expand_neighbors,
+                    sorted(request.collections or []),
+                    history_digest
+                )
+                cached_response = self.response_cache.get(response_key, store_version)
+                if cached_response is not None:
+                    print("⚡ 响应缓存命中，跳过检索和LLM调用")
+                    self._save_conversation(request.session_id, request.query, cached_response.answer)
+                    return cached_response.model_copy(update={
+                        "processing_time": time.time() - start_time,
+                        "cache_hit": True,
+                        "prompt_tokens": 0
+                    })
+            
             # 2. 构建带历史上下文的查询
             enhanced_query = request.query
             if history_text:
@@ -56,13 +140,85 @@ class QueryService:
                 enhanced_query = f"历史对话:\n{history_text}\n\n当前问题: {request.query}"
                 print(f"🔗 已添加历史上下文，增强查询长度: {len(enhanced_query)} 字符")
             
-            # 3. 使用LangChain RAG服务
+            # 3. 使用LangChain RAG服务：先检索，再查语义缓存，未命中才调用LLM
             print("🤖 使用LangChain RAG服务...")
-            result = await self.langchain_service.query(
-                query=enhanced_query,
-                top_k=top_k,
-                threshold=threshold
-            )
+            # 启用重排序时先宽召回，再由交叉编码器重排前N个，最后只取少量块
+            use_rerank = request.rerank if request.rerank is not None else settings.rerank_enabled
+            use_rerank = use_rerank and self.reranker.available
+            use_mmr = request.use_mmr if request.use_mmr is not None else settings.mmr_enabled
+            final_k = min(top_k, settings.rerank_final_k) if use_rerank else top_k
+            if use_rerank:
+                fetch_k = max(top_k, settings.rerank_candidates)
+            elif use_mmr:
+                fetch_k = top_k * max(1, settings.mmr_fetch_multiplier)
+            else:
+                fetch_k = top_k
+            
+            # 查询向量和检索必须来自同一模型：检索期间发生模型切换时用新模型重算一次
+            for attempt in range(2):
+                embeddings = self.langchain_service.embeddings
+                try:
+                    stage_start = time.perf_counter()
+                    query_vector = await embeddings.aembed_query(enhanced_query)
+                    self.latency.record("embed", (time.perf_counter() - stage_start) * 1000)
+                    
+                    stage_start = time.perf_counter()
+                    # 关键词检索使用原始问题，避免历史对话中的词干扰；
+                    # 检索可能等待写入线程持有的索引锁，放到线程池执行，不阻塞事件循环
+                    hits = await asyncio.to_thread(
+                        self.langchain_service.search_ids,
+                        query_vector, fetch_k,
+                        query_text=request.query,
+                        hybrid=request.hybrid_search,
+                        collections=request.collections,
+                        embeddings=embeddings
+                    )
+                    self.latency.record("retrieve", (time.perf_counter() - stage_start) * 1000)
+                    print(f"📄 检索到 {len(hits)} 个文档块")
+                    
+                    if use_rerank and hits:
+                        hits = await self._rerank_hits(request.query, hits, final_k)
+                    
+                    # MMR多样化：剔除重叠的相邻块，返回的块数可能少于final_k
+                    if use_mmr and hits:
+                        stage_start = time.perf_counter()
+                        # 候选块向量可能需要现算，放到线程中执行，避免阻塞事件循环
+                        hits = await asyncio.to_thread(self.langchain_service.diversify, query_vector, hits, final_k,
+                                                       lambda_mult=request.mmr_lambda, embeddings=embeddings)
+                        self.latency.record("mmr", (time.perf_counter() - stage_start) * 1000)
+                    else:
+                        hits = hits[:final_k]
+                    break
+                except EmbeddingModelChangedError as e:
+                    if attempt:
+                        raise
+                    print(f"🔄 {e}，重新计算查询向量")
+            
+            cache_hit = False
+            result = None
+            chunk_ids = [chunk_id for chunk_id, _ in hits]
+            index_version = self.langchain_service.index_version
+            if settings.answer_cache_enabled:
+                # 缓存按用户原始问题的向量匹配
+                cache_vector = query_vector if enhanced_query == request.query else await embeddings.aembed_query(request.query)
+                result = self.answer_cache.lookup(cache_vector, chunk_ids, index_version, history_digest)
+                cache_hit = result is not None
+                if cache_hit:
+                    print(f"⚡ 语义缓存命中，相似度: {result.get('cache_similarity', 0.0):.4f}，跳过LLM调用")
+            
+            if result is None:
+                retrieved = self.langchain_service.materialize(hits)
+                stage_start = time.perf_counter()
+                result = await self.langchain_service.generate(
+                    request.query, retrieved, query_vector,
+                    history=history,
+                    compress=request.compress_context,
+                    expand_neighbors=request.expand_neighbors,
+                    embeddings=embeddings
+                )
+                self.latency.record("generate", (time.perf_counter() - stage_start) * 1000)
+                if settings.answer_cache_enabled and "error" not in result:
+                    self.answer_cache.store(cache_vector, chunk_ids, index_version, result, history_digest)
             print(f"result is :{result}")
             
             # 4. 处理结果
@@ -74,23 +230,7 @@ class QueryService:
             print(f"confidence is :{confidence}")
             
             # 5. 存储本轮对话到记忆
-            print("💾 存储对话记忆...")
-            try:
-                # 存储用户问题
-                self.memory_context.add_memory(
-                    session_id=request.session_id,
-                    role="user",
-                    content=request.query
-                )
-                # 存储助手回答
-                self.memory_context.add_memory(
-                    session_id=request.session_id,
-                    role="assistant",
-                    content=answer
-                )
-                print("✅ 对话记忆存储成功")
-            except Exception as e:
-                print(f"⚠️ 存储对话记忆失败: {e}")
+            self._save_conversation(request.session_id, request.query, answer)
             
             # 6. 转换来源格式以保持API兼容性
             formatted_sources = []
@@ -102,22 +242,64 @@ class QueryService:
                 }
                 formatted_sources.append(formatted_source)
             
+            # 模型迁移中：抽样对比影子索引的召回率（后台执行，不影响本次响应）
+            if self.migration.should_sample():
+                asyncio.get_running_loop().run_in_executor(
+                    None, self.migration.sample_recall, request.query, request.collections
+                )
+            
             processing_time = time.time() - start_time
+            self.latency.record("total", processing_time * 1000)
             print(f"✅ LangChain RAG + Memory处理完成，耗时: {processing_time:.4f}秒")
             
-            return QueryResponse(
+            response = QueryResponse(
                 query=request.query,
                 answer=answer,
                 sources=formatted_sources if request.include_metadata else [],
                 confidence=confidence,
                 processing_time=processing_time,
-                total_chunks_retrieved=len(sources)
+                total_chunks_retrieved=len(sources),
+                cache_hit=cache_hit,
+                prompt_tokens=0 if cache_hit else result.get("prompt_tokens", 0)
             )
+            if response_key is not None and "error" not in result:
+                self.response_cache.put(response_key, store_version, response)
+            return response
             
         except Exception as e:
             print(f"❌ LangChain RAG查询失败，回退到原有服务: {e}")
             return await self._fallback_query(request, start_time)
     
+    async def _rerank_hits(self, query: str, hits: List[tuple], final_k: int) -> List[tuple]:
+        """用交叉编码器重排前 rerank_top_n 个候选，返回重排后的候选；超时或失败时保持原有顺序"""
+        candidates = hits[:max(settings.rerank_top_n, final_k)]
+        retrieved = self.langchain_service.materialize(candidates)
+        texts = [item["document"].page_content for item in retrieved]
+        
+        # 交叉编码器是CPU密集计算，放到推理线程中避免阻塞事件循环；
+        # 预算覆盖整个阶段，在推理队列中排队的时间也计入
+        budget_ms = settings.rerank_budget_ms
+        stage_start = time.perf_counter()
+        
+        def rerank_within_budget():
+            remaining_ms = budget_ms - (time.perf_counter() - stage_start) * 1000
+            return self.reranker.rerank(query, texts, remaining_ms)
+        
+        try:
+            outcome = await asyncio.wait_for(run_inference_async(rerank_within_budget), budget_ms / 1000)
+        except asyncio.TimeoutError:
+            elapsed_ms = (time.perf_counter() - stage_start) * 1000
+            self.latency.record("rerank", elapsed_ms)
+            print(f"⏱️ 重排序在 {elapsed_ms:.1f}ms 内未完成（推理线程繁忙），保持原有顺序")
+            return [(item["chunk_id"], item["score"]) for item in retrieved]
+        self.latency.record("rerank", (time.perf_counter() - stage_start) * 1000)
+        
+        if outcome["timed_out"]:
+            print(f"⏱️ 重排序超出预算，已打分 {outcome['scored']}/{len(texts)} 个，其余保持原有顺序")
+        print(f"🎯 重排序: {len(hits)} 个候选 -> 打分 {outcome['scored']} 个 -> 保留 {final_k} 个, "
+              f"耗时 {outcome['elapsed_ms']:.1f}ms")
+        return [(retrieved[i]["chunk_id"], retrieved[i]["score"]) for i in outcome["order"]]
+    
     async def _fallback_query(self, request: QueryRequest, start_time: float) -> QueryResponse:
         """回退到原有的查询服务（也包含记忆功能）"""
         try:
@@ -138,7 +320,7 @@ class QueryService:
             
             # 2. 将查询转换为向量
             print("🔄 正在将查询转换为向量...")
-            query_vector = self.embedding_service.encode_single_text(request.query)
+            query_vector = await self.embedding_service.aencode_single_text(request.query)
             print(f"✅ 查询向量生成完成，维度: {len(query_vector)}")
             
             # 3. 向量检索相似文档块
@@ -177,18 +359,23 @@ class QueryService:
                 
                 sources.append(source_info)
             
-            # 5. 生成答案（包含历史上下文）
+            # 5. 生成答案（检索块和历史按token预算打包）
+            prompt_tokens = 0
             if context_texts:
                 print("🤖 正在生成答案...")
                 
-                # 构建包含历史的上下文
-                full_context = context_texts
-                if history_text:
-                    full_context.insert(0, f"历史对话:\n{history_text}")
+                packed = self.context_packer.pack(
+                    request.query,
+                    [{"content": text} for text in context_texts],
+                    history
+                )
+                prompt_tokens = packed["prompt_tokens"]
+                print(f"📏 prompt token数(估算): {prompt_tokens}")
                 
                 answer = await self.llm_service.generate_answer(
                     query=request.query,
-                    context=full_context
+                    context=[context_texts[i] for i in packed["chunk_indices"]],
+                    history_text=packed["history_text"]
                 )
                 print(f"✅ 答案生成完成: '{answer[:100]}...'")
             else:
@@ -228,7 +415,8 @@ class QueryService:
                 sources=sources if request.include_metadata else [],
                 confidence=confidence,
                 processing_time=processing_time,
-                total_chunks_retrieved=len(similar_chunks)
+                total_chunks_retrieved=len(similar_chunks),
+                prompt_tokens=prompt_tokens
             )
             
         except Exception as e:
@@ -243,20 +431,36 @@ class QueryService:
                 total_chunks_retrieved=0
             )
     
-    async def search_documents(self, query: str, top_k: int = 10, threshold: float = 0.5) -> List[Dict[str, Any]]:
+    async def search_documents(self, query: str, top_k: int = 10, threshold: float = 0.5,
+                               collections: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """搜索文档（返回文档级别的结果）"""
         try:
             print(f"🔍 搜索文档: '{query}', top_k={top_k}, threshold={threshold}")
             
+            # 精确匹配响应缓存
+            search_key = None
+            store_version = self._store_version()
+            if settings.response_cache_enabled:
+                search_key = ResponseCache.make_key(
+                    "search", ResponseCache.normalize_query(query), top_k, threshold, sorted(collections or [])
+                )
+                cached_results = self.response_cache.get(search_key, store_version)
+                if cached_results is not None:
+                    print("⚡ 响应缓存命中")
+                    return cached_results
+            
             # 优先使用LangChain存储系统
             try:
                 print("🤖 使用LangChain存储系统搜索...")
                 results = await self.langchain_service.search_documents(
                     query=query,
                     top_k=top_k,
-                    threshold=threshold
+                    threshold=threshold,
+                    collections=collections
                 )
                 print(f"✅ LangChain搜索完成，找到 {len(results)} 个结果")
+                if search_key is not None and results:
+                    self.response_cache.put(search_key, store_version, results)
                 return results
                 
             except Exception as e:
@@ -266,7 +470,7 @@ class QueryService:
                 print("🔄 使用原有存储系统搜索...")
                 
                 # 将查询转换为向量
-                query_vector = self.embedding_service.encode_single_text(query)
+                query_vector = await self.embedding_service.aencode_single_text(query)
                 
                 # 检索相似文档块
                 similar_chunks = await self.storage.search_similar_chunks(
@@ -351,6 +555,26 @@ class QueryService:
             print(f"❌ 获取查询建议失败: {e}")
             return []
     
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        return {
+            "enabled": settings.answer_cache_enabled,
+            "answer_cache": self.answer_cache.get_stats(),
+            "response_cache_enabled": settings.response_cache_enabled,
+            "response_cache": self.response_cache.get_stats(),
+            "retrieval_cache": self.langchain_service.retrieval_cache.get_stats(),
+            "storage_retrieval_cache": self.storage.retrieval_cache.get_stats() if hasattr(self.storage, "retrieval_cache") else {},
+            "index_version": self.langchain_service.index_version,
+            "store_version": list(self._store_version())
+        }
+    
+    def get_latency_stats(self) -> Dict[str, Any]:
+        """获取分阶段延迟统计"""
+        return {
+            "stages": self.latency.get_stats(),
+            "reranker": self.reranker.get_stats()
+        }
+    
     async def health_check(self) -> dict:
         """健康检查"""
         try:
@@ -416,6 +640,12 @@ class QueryService:
                     "error": str(e)
                 }
             
+            # 缓存统计
+            health_info["services"]["cache"] = {
+                "status": "healthy",
+                **self.get_cache_stats()
+            }
+            
             # 整体状态判断
             all_healthy = all(
                 service.get("status") == "healthy" 
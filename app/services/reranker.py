@@ -0,0 +1,175 @@
+"""
+交叉编码器重排序
+"""
+
+import time
+import threading
+from typing import List, Dict, Any, Optional
+from app.config import settings
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+
+class CrossEncoderReranker:
+    """带时间预算的CPU交叉编码器重排序
+
+    候选按批打分，每批之前估算剩余预算；预算耗尽时，已打分的前缀按分数排序，
+    其余候选保持原有（ANN/RRF）顺序。模型不可用或出错时整体回退到原有顺序。
+    模型在服务启动时由 warmup() 加载；请求到达时模型仍未就绪则在后台加载，
+    本次请求直接回退，不会把模型下载和加载计入请求的时间预算。
+    """
+
+    def __init__(self, model_name: str = None, device: str = None, batch_size: int = None):
+        self.model_name = model_name or settings.rerank_model
+        self.device = device or settings.embedding_device
+        self.batch_size = batch_size or settings.rerank_batch_size
+        self.model = None
+        self.load_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._loader: Optional[threading.Thread] = None
+
+        self.requests = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+
+    def _load_model(self) -> bool:
+        """按需加载模型，加载失败后不再重试"""
+        if self.model is not None:
+            return True
+        if self.load_error is not None:
+            return False
+        with self._lock:
+            if self.model is not None:
+                return True
+            if CrossEncoder is None:
+                self.load_error = "sentence_transformers未安装"
+                print(f"⚠️ 重排序模型不可用: {self.load_error}")
+                return False
+            try:
+                print(f"🔄 正在加载重排序模型: {self.model_name}")
+                self.model = CrossEncoder(self.model_name, device=self.device)
+                print("✅ 重排序模型加载成功")
+                return True
+            except Exception as e:
+                self.load_error = str(e)
+                print(f"⚠️ 重排序模型加载失败，使用原有排序: {e}")
+                return False
+
+    def _load_in_background(self):
+        """在后台线程中加载模型（只启动一次）"""
+        with self._lock:
+            if self._loader is not None:
+                return
+            self._loader = threading.Thread(target=self._load_model, name="reranker-loader", daemon=True)
+            self._loader.start()
+
+    def warmup(self) -> bool:
+        """加载模型并做一次打分（首次推理较慢），服务启动时调用"""
+        if not self._load_model():
+            return False
+        try:
+            start = time.perf_counter()
+            self.model.predict([("预热", "预热")], show_progress_bar=False)
+            print(f"✅ 重排序模型预热完成，耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+        except Exception as e:
+            print(f"⚠️ 重排序模型预热失败: {e}")
+        return True
+
+    @property
+    def available(self) -> bool:
+        """模型是否可用（未加载时视为可用）"""
+        return self.load_error is None
+
+    def rerank(self, query: str, texts: List[str], budget_ms: float = None) -> Dict[str, Any]:
+        """对候选文本重排序
+
+        Returns:
+            order: 重排后的候选下标
+            scores: 与order对应的分数（未打分的为None）
+            scored: 实际打分的候选数
+            timed_out: 是否因预算耗尽而提前停止
+            elapsed_ms: 耗时（毫秒）
+        """
+        start = time.perf_counter()
+        budget_ms = budget_ms if budget_ms is not None else settings.rerank_budget_ms
+        self.requests += 1
+
+        outcome = {
+            "order": list(range(len(texts))),
+            "scores": [None] * len(texts),
+            "scored": 0,
+            "timed_out": False,
+            "elapsed_ms": 0.0
+        }
+        if self.model is None and texts and self.load_error is None:
+            print("⏳ 重排序模型尚未加载完成，本次使用原有排序")
+            self._load_in_background()
+        if not texts or self.model is None:
+            self.fallbacks += 1
+            outcome["elapsed_ms"] = (time.perf_counter() - start) * 1000
+            return outcome
+        if budget_ms <= 0:
+            # 调用方在推理队列中等待时已用完预算，不再打分
+            self.timeouts += 1
+            outcome["timed_out"] = True
+            outcome["elapsed_ms"] = (time.perf_counter() - start) * 1000
+            return outcome
+
+        scores: List[float] = []
+        last_batch_ms = 0.0
+        try:
+            for begin in range(0, len(texts), self.batch_size):
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                # 预计下一批会超出预算时停止
+                if scores and elapsed_ms + last_batch_ms > budget_ms:
+                    outcome["timed_out"] = True
+                    break
+                batch_start = time.perf_counter()
+                pairs = [(query, text) for text in texts[begin:begin + self.batch_size]]
+                batch_scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+                scores.extend(float(score) for score in batch_scores)
+                last_batch_ms = (time.perf_counter() - batch_start) * 1000
+        except Exception as e:
+            print(f"⚠️ 重排序失败，使用原有排序: {e}")
+            scores = []
+
+        if not scores:
+            self.fallbacks += 1
+        else:
+            if outcome["timed_out"]:
+                self.timeouts += 1
+            scored = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+            outcome["order"] = scored + list(range(len(scores), len(texts)))
+            outcome["scores"] = [scores[i] for i in scored] + [None] * (len(texts) - len(scores))
+            outcome["scored"] = len(scores)
+
+        outcome["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        return outcome
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取重排序统计"""
+        return {
+            "model_name": self.model_name,
+            "loaded": self.model is not None,
+            "load_error": self.load_error,
+            "batch_size": self.batch_size,
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "fallbacks": self.fallbacks
+        }
+
+
+_reranker: Optional[CrossEncoderReranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """获取共享的重排序器（进程内单例）"""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = CrossEncoderReranker()
+        return _reranker
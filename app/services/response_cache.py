@@ -0,0 +1,114 @@
+"""
+精确匹配响应缓存
+"""
+
+import re
+import json
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+from app.config import settings
+
+
+class ResponseCache:
+    """按内存大小限制的LRU缓存
+
+    每个条目记录写入时的向量存储版本号，读取时版本不一致即视为失效，
+    因此增删文档后无需显式清理缓存。
+    """
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = max_bytes if max_bytes is not None else settings.response_cache_max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, Any, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """规范化查询文本：合并空白并忽略大小写"""
+        return re.sub(r'\s+', ' ', query).strip().casefold()
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """由多个组成部分生成缓存键"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def digest(text: str) -> str:
+        """计算文本摘要（用于会话历史等长文本）"""
+        return hashlib.sha1(text.encode('utf-8')).hexdigest() if text else ""
+
+    @staticmethod
+    def vector_digest(vector) -> str:
+        """计算向量摘要（按float32字节）"""
+        data = np.ascontiguousarray(vector, dtype=np.float32).tobytes()
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def _pop(self, key: str):
+        """删除条目并更新占用字节数"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+
+    def get(self, key: str, version: Any) -> Optional[Any]:
+        """读取缓存，版本不一致时返回None并删除条目"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, entry_version, _ = entry
+            if entry_version != version:
+                self._pop(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, version: Any, value: Any):
+        """写入缓存，超出内存上限时按LRU淘汰"""
+        try:
+            size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)) + len(key)
+        except Exception:
+            return
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, version, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
@@ -0,0 +1,353 @@
+"""
+向量集合：每个集合独立的FAISS索引、docstore和BM25索引
+"""
+
+import os
+import json
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+from app.config import settings
+from app.services.bm25_index import BM25Index
+from app.utils.chunk_merger import rebuild_document_text
+
+
+def read_embedding_model(path: str) -> Optional[str]:
+    """读取集合目录中记录的向量模型名称，没有记录时返回None"""
+    try:
+        with open(f"{path}/embedding_model.json", "r", encoding="utf-8") as f:
+            return json.load(f).get("embedding_model")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ 读取向量模型记录失败: {e}")
+        return None
+
+
+def publish_index(live_path: str, build_path: str) -> Optional[str]:
+    """把构建好的索引目录发布为线上索引，返回被替换下来的旧索引目录（没有时为None）
+
+    线上路径是指向版本目录（<线上路径>.v<时间戳>）的符号链接：新目录先改名为版本目录，
+    再建一个临时链接用 os.replace 原子地覆盖线上链接，任何时刻线上路径都指向一个完整的索引。
+    旧数据的线上路径是真实目录时，先把它改名为版本目录再替换链接（只发生一次），
+    中途崩溃由 recover_index_link 补完。
+    """
+    version_path = f"{live_path}.v{int(time.time())}"
+    suffix = 1
+    while os.path.lexists(version_path):
+        version_path = f"{live_path}.v{int(time.time())}-{suffix}"
+        suffix += 1
+    os.rename(build_path, version_path)
+
+    link_path = f"{live_path}.link-tmp"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(version_path), link_path)
+
+    previous = None
+    if os.path.islink(live_path):
+        previous = os.path.realpath(live_path)
+    elif os.path.exists(live_path):
+        previous = f"{live_path}.v0"
+        os.rename(live_path, previous)
+    os.replace(link_path, live_path)
+    return previous
+
+
+def recover_index_link(live_path: str):
+    """publish_index 在旧目录改名后、链接替换前中断时，把临时链接补到线上路径"""
+    link_path = f"{live_path}.link-tmp"
+    if not os.path.lexists(live_path) and os.path.islink(link_path):
+        os.replace(link_path, live_path)
+        print(f"♻️ 已恢复中断的索引发布: {live_path} -> {os.readlink(live_path)}")
+
+
+class VectorCollection:
+    """一个命名集合的向量存储
+
+    目录下保存 index.faiss / index.pkl（LangChain FAISS）、bm25_index.pkl
+    和 embedding_model.json（生成这些向量的模型）。
+    version 在每次增删后递增，用于该集合相关缓存的失效。
+    """
+
+    def __init__(self, name: str, path: str, embeddings):
+        self.name = name
+        self.path = path
+        self.embeddings = embeddings
+        self.vector_store = None
+        self.bm25_index = None
+        self.version = 0
+        # 生成已存向量的模型；旧数据没有记录时视为当前模型
+        self.embedding_model = read_embedding_model(path) or getattr(embeddings, "model_name", None)
+        # 模型迁移切换后旧集合对象停止写入，防止写到已下线的索引
+        self.retired = False
+        # 写入方互斥（增删、保存、模型切换）；保存到磁盘只持有该锁，检索不受影响
+        self.write_lock = threading.RLock()
+        # 保护内存中的FAISS索引和docstore：只在修改内存结构和检索时短暂持有
+        self.lock = threading.RLock()
+
+        # 块ID -> FAISS行号的反向映射，按版本重建
+        self._docstore_rows = None
+        self._docstore_rows_version = -1
+        # (文档ID, 块序号) -> 块ID，用于取相邻块
+        self._chunk_positions = None
+        self._chunk_positions_version = -1
+
+        self._initialize_vector_store()
+        self._initialize_bm25_index()
+
+    def _initialize_vector_store(self):
+        """初始化向量存储"""
+        os.makedirs(self.path, exist_ok=True)
+
+        # 尝试加载现有的向量存储
+        if os.path.exists(f"{self.path}/index.faiss"):
+            try:
+                self.vector_store = FAISS.load_local(
+                    self.path,
+                    self.embeddings,
+                    allow_dangerous_deserialization=True  # 允许加载本地文件
+                )
+                print(f"✅ 成功加载集合 {self.name} 的向量存储")
+            except Exception as e:
+                print(f"⚠️ 加载集合 {self.name} 的向量存储失败: {e}")
+                self.vector_store = None
+
+        # 如果没有现有存储，创建新的空向量存储
+        if self.vector_store is None:
+            # 使用一个临时文档创建存储，然后立即清空
+            temp_doc = Document(page_content="temp", metadata={})
+            self.vector_store = FAISS.from_documents([temp_doc], self.embeddings)
+            try:
+                doc_ids = list(self.vector_store.index_to_docstore_id.values())
+                if doc_ids:
+                    self.vector_store.delete(doc_ids)
+                print(f"✅ 创建集合 {self.name} 的空向量存储")
+            except Exception as e:
+                print(f"⚠️ 清空向量存储时出错: {e}")
+                self.vector_store = FAISS.from_documents([], self.embeddings)
+
+    def _initialize_bm25_index(self):
+        """初始化BM25索引：优先加载持久化文件，缺失或与docstore不一致时从docstore重建"""
+        bm25_path = f"{self.path}/bm25_index.pkl"
+        chunk_ids = list(self.vector_store.index_to_docstore_id.values())
+
+        if os.path.exists(bm25_path):
+            try:
+                self.bm25_index = BM25Index.load(bm25_path)
+                if len(self.bm25_index) == len(chunk_ids):
+                    print(f"✅ 成功加载BM25索引: {len(self.bm25_index)} 个文档块 ({self.name})")
+                    return
+                print("⚠️ BM25索引与向量存储不一致，重新构建")
+            except Exception as e:
+                print(f"⚠️ 加载BM25索引失败，重新构建: {e}")
+
+        self.bm25_index = BM25Index()
+        items = []
+        for chunk_id in chunk_ids:
+            doc = self.vector_store.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                items.append((chunk_id, doc.page_content))
+        self.bm25_index.add_many(items)
+        if items:
+            try:
+                self.bm25_index.save(bm25_path)
+            except Exception as e:
+                print(f"⚠️ 保存BM25索引失败: {e}")
+        print(f"✅ 从docstore构建BM25索引: {len(items)} 个文档块 ({self.name})")
+
+    @property
+    def total_chunks(self) -> int:
+        return len(self.vector_store.index_to_docstore_id)
+
+    def save(self):
+        """保存向量存储和BM25索引
+
+        只持有写入锁：所有修改都需要写入锁，保存期间内存索引不会变化，检索照常进行。
+        """
+        with self.write_lock:
+            self.vector_store.save_local(self.path)
+            try:
+                self.bm25_index.save(f"{self.path}/bm25_index.pkl")
+            except Exception as e:
+                print(f"⚠️ 保存BM25索引失败: {e}")
+            if self.embedding_model:
+                with open(f"{self.path}/embedding_model.json", "w", encoding="utf-8") as f:
+                    json.dump({"embedding_model": self.embedding_model, "dimension": self.dimension}, f)
+
+    @property
+    def dimension(self) -> int:
+        return self.vector_store.index.d
+
+    def add_embeddings(self, text_embeddings: List[Tuple[str, List[float]]], metadatas: List[Dict[str, Any]], ids: List[str],
+                       persist: bool = True):
+        """添加已向量化的文档块；persist=False 时不保存，由调用方写完后统一调用 save()
+
+        按块ID覆盖写入：已存在的块ID先删除再添加。重复入库同一文档时块ID相同，
+        直接添加会在FAISS中留下没有docstore映射的行（LangChain先写索引再检查ID冲突）。
+        """
+        if persist:
+            print(f"📊 当前集合 {self.name} 状态: {self.total_chunks} 个文档块")
+        for _, vector in text_embeddings:
+            if len(vector) != self.dimension:
+                raise ValueError(f"向量维度不匹配: 集合 {self.name} 为 {self.dimension} 维，实际 {len(vector)} 维")
+        with self.write_lock:
+            if self.retired:
+                raise ValueError(f"集合 {self.name} 已切换到新的向量模型，请重试")
+            if len(set(ids)) != len(ids):
+                raise ValueError(f"块ID重复: 集合 {self.name}")
+            with self.lock:
+                existing = [chunk_id for chunk_id in ids if chunk_id in self.vector_store.docstore._dict]
+                if existing:
+                    self.vector_store.delete(existing)
+                self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+                self.bm25_index.add_many((chunk_id, text) for chunk_id, (text, _) in zip(ids, text_embeddings))
+                self.version += 1
+            if persist:
+                self.save()
+        if persist:
+            print(f"📊 添加后集合 {self.name} 状态: {self.total_chunks} 个文档块")
+
+    def delete_document(self, document_id: str) -> int:
+        """删除指定文档的所有块，返回删除的块数"""
+        return self.delete_documents([document_id])
+
+    def delete_documents(self, document_ids: List[str], keep_chunk_ids: Optional[Iterable[str]] = None,
+                         persist: bool = True) -> int:
+        """删除多个文档的所有块（只保存一次），返回删除的块数
+
+        keep_chunk_ids 中的块保留，重新入库后用于删除旧版本多出来的块；persist=False 时由调用方保存。
+        """
+        document_ids = set(document_ids)
+        keep_chunk_ids = set(keep_chunk_ids or ())
+        with self.write_lock:
+            if self.retired:
+                raise ValueError(f"集合 {self.name} 已切换到新的向量模型，请重试")
+            chunk_ids = []
+            for chunk_id in self.vector_store.index_to_docstore_id.values():
+                doc = self.vector_store.docstore._dict.get(chunk_id)
+                if doc and doc.metadata.get('document_id') in document_ids and chunk_id not in keep_chunk_ids:
+                    chunk_ids.append(chunk_id)
+            if not chunk_ids:
+                return 0
+            with self.lock:
+                self.vector_store.delete(chunk_ids)
+                self.bm25_index.remove(chunk_ids)
+                self.version += 1
+            if persist:
+                self.save()
+            return len(chunk_ids)
+
+    def document_ids(self) -> set:
+        """集合中所有文档ID"""
+        with self.lock:
+            ids = {doc.metadata.get("document_id") for doc in self.vector_store.docstore._dict.values()}
+        ids.discard(None)
+        return ids
+
+    def iter_documents(self, document_ids: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+        """按块位置把文档还原为入库格式（id、title、content、created_at、file_type），按文档ID排序
+
+        用于重建索引和模型迁移；document_ids 指定时只还原这些文档。
+        """
+        wanted = set(document_ids) if document_ids is not None else None
+        groups: Dict[str, List[str]] = {}
+        with self.lock:
+            for chunk_id, doc in self.vector_store.docstore._dict.items():
+                document_id = doc.metadata.get("document_id")
+                if document_id and (wanted is None or document_id in wanted):
+                    groups.setdefault(document_id, []).append(chunk_id)
+
+        for document_id in sorted(groups):
+            chunks = [doc for doc in (self.get_document(chunk_id) for chunk_id in groups[document_id]) if doc is not None]
+            if not chunks:
+                continue
+            chunks.sort(key=lambda doc: doc.metadata.get("chunk_index", 0))
+            metadata = chunks[0].metadata
+            yield {
+                "id": document_id,
+                "title": metadata.get("title", ""),
+                "content": rebuild_document_text(chunks, settings.chunk_overlap),
+                "created_at": metadata.get("created_at", ""),
+                "file_type": metadata.get("file_type", "")
+            }
+
+    def get_document(self, chunk_id: str) -> Optional[Document]:
+        """按块ID取文档，不存在返回None"""
+        return self.vector_store.docstore._dict.get(chunk_id)
+
+    def matches_filters(self, chunk_id: str, filters: Optional[Dict[str, Any]]) -> bool:
+        """检查文档块元数据是否满足过滤条件"""
+        if not filters:
+            return True
+        doc = self.get_document(chunk_id)
+        return doc is not None and all(doc.metadata.get(key) == value for key, value in filters.items())
+
+    def dense_search(self, query_vector: List[float], top_k: int, filters: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        """向量检索，返回 (块ID, L2距离)"""
+        if self.vector_store.index.ntotal == 0:
+            return []
+        vector = np.asarray([query_vector], dtype=np.float32)
+        if getattr(self.vector_store, "_normalize_L2", False):
+            faiss.normalize_L2(vector)
+
+        # 有过滤条件时多取一些候选再过滤
+        fetch_k = top_k * 4 if filters else top_k
+        with self.lock:
+            k = min(fetch_k, self.vector_store.index.ntotal)
+            scores, indices = self.vector_store.index.search(vector, k)
+
+            hits = []
+            for score, idx in zip(scores[0], indices[0]):
+                if idx == -1:
+                    continue
+                chunk_id = self.vector_store.index_to_docstore_id.get(int(idx))
+                if chunk_id is None or not self.matches_filters(chunk_id, filters):
+                    continue
+                hits.append((chunk_id, float(score)))
+                if len(hits) >= top_k:
+                    break
+        return hits
+
+    def keyword_search(self, query_text: str, top_k: int, filters: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        """BM25关键词检索，返回 (块ID, BM25分数)"""
+        fetch_k = top_k * 4 if filters else top_k
+        hits = [(chunk_id, score) for chunk_id, score in self.bm25_index.search(query_text, fetch_k)
+                if self.matches_filters(chunk_id, filters)]
+        return hits[:top_k]
+
+    def get_vector(self, chunk_id: str) -> np.ndarray:
+        """从FAISS索引中取回已存储的块向量"""
+        with self.lock:
+            if self._docstore_rows is None or self._docstore_rows_version != self.version:
+                self._docstore_rows = {cid: idx for idx, cid in self.vector_store.index_to_docstore_id.items()}
+                self._docstore_rows_version = self.version
+            return self.vector_store.index.reconstruct(int(self._docstore_rows[chunk_id]))
+
+    def chunk_position_map(self) -> Dict[tuple, str]:
+        """(文档ID, 块序号) -> 块ID，按版本重建"""
+        with self.lock:
+            if self._chunk_positions is None or self._chunk_positions_version != self.version:
+                positions = {}
+                for chunk_id, doc in self.vector_store.docstore._dict.items():
+                    chunk_index = doc.metadata.get("chunk_index")
+                    if chunk_index is not None:
+                        positions[(doc.metadata.get("document_id"), chunk_index)] = chunk_id
+                self._chunk_positions = positions
+                self._chunk_positions_version = self.version
+            return self._chunk_positions
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取集合统计"""
+        return {
+            "name": self.name,
+            "total_chunks": self.total_chunks,
+            "total_documents": len(self.document_ids()),
+            "embedding_model": self.embedding_model,
+            "version": self.version,
+            "bm25_index": self.bm25_index.get_stats()
+        }
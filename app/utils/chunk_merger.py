@@ -0,0 +1,105 @@
+"""
+检索结果合并：同一文档中相邻或重叠的块合并为一段
+"""
+
+from typing import List, Dict, Any, Optional
+from langchain.schema import Document
+
+
+def chunk_span(doc: Document) -> Optional[tuple]:
+    """返回块在原文中的位置 (document_id, start_index, end_index)，缺少位置信息时返回None"""
+    metadata = doc.metadata
+    doc_id = metadata.get("document_id")
+    start = metadata.get("start_index")
+    end = metadata.get("end_index")
+    if doc_id is None or start is None or end is None or start < 0:
+        return None
+    return doc_id, start, end
+
+
+def _merge_text(left: Document, right: Document) -> Optional[str]:
+    """拼接两个相邻/重叠块的文本，重叠部分只保留一次；偏移与文本对不上时返回None"""
+    _, left_start, left_end = chunk_span(left)
+    _, right_start, right_end = chunk_span(right)
+    overlap = left_end - right_start
+    if overlap < 0:
+        return None
+    if right_end <= left_end:
+        return left.page_content
+    if overlap and left.page_content[-overlap:] != right.page_content[:overlap]:
+        return None
+    return left.page_content + right.page_content[overlap:]
+
+
+def coalesce_chunks(retrieved: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把同一文档中相邻或重叠的检索块合并为一段连续文本
+
+    retrieved 按相关度排列，每项包含 chunk_id、score、document。
+    合并后的块位于其中排名最高的块的位置，元数据记录合并范围和包含的块ID。
+    没有位置信息的块原样保留。
+    """
+    groups: Dict[Any, List[int]] = {}
+    for i, item in enumerate(retrieved):
+        span = chunk_span(item["document"])
+        if span is not None:
+            groups.setdefault(span[0], []).append(i)
+
+    replaced: Dict[int, Dict[str, Any]] = {}
+    absorbed = set()
+    for indices in groups.values():
+        if len(indices) < 2:
+            continue
+        indices = sorted(indices, key=lambda i: chunk_span(retrieved[i]["document"])[1])
+
+        run = [indices[0]]
+        merged_doc = retrieved[indices[0]]["document"]
+        for i in indices[1:] + [None]:
+            text = _merge_text(merged_doc, retrieved[i]["document"]) if i is not None else None
+            if text is not None:
+                next_doc = retrieved[i]["document"]
+                metadata = dict(merged_doc.metadata)
+                metadata["end_index"] = max(metadata["end_index"], next_doc.metadata["end_index"])
+                metadata["token_count"] = None
+                merged_doc = Document(page_content=text, metadata=metadata)
+                run.append(i)
+                continue
+
+            if len(run) > 1:
+                # 合并结果放在排名最高的块的位置
+                best = min(run)
+                merged_doc.metadata["merged_chunk_ids"] = [retrieved[j]["chunk_id"] for j in run]
+                merged_doc.metadata["chunk_index_end"] = retrieved[run[-1]]["document"].metadata.get("chunk_index")
+                replaced[best] = {
+                    "chunk_id": retrieved[best]["chunk_id"],
+                    "score": retrieved[best]["score"],
+                    "document": merged_doc
+                }
+                absorbed.update(j for j in run if j != best)
+            if i is not None:
+                run = [i]
+                merged_doc = retrieved[i]["document"]
+
+    return [replaced.get(i, item) for i, item in enumerate(retrieved) if i not in absorbed]
+
+
+def rebuild_document_text(chunks: List[Document], overlap: int = 0) -> str:
+    """按块位置把一个文档的块拼回原文（块按 chunk_index 排序）
+
+    有字符偏移时按偏移放置（块之间被分块器去掉的空白用换行补齐）；
+    没有偏移的旧数据按块顺序拼接，并去掉与前一块重叠（最多 overlap 个字符）的前缀。
+    """
+    text = ""
+    for doc in chunks:
+        content = doc.page_content
+        start = doc.metadata.get("start_index")
+        if start is not None and start >= 0:
+            if start > len(text):
+                text += "\n" * (start - len(text))
+            if start + len(content) > len(text):
+                text = text[:start] + content
+            continue
+        size = min(len(text), len(content), overlap)
+        while size > 0 and not text.endswith(content[:size]):
+            size -= 1
+        text += content[size:] if size else ("\n" if text else "") + content
+    return text
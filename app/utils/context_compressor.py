@@ -0,0 +1,88 @@
+"""
+抽取式上下文压缩：按与问题的相似度保留句子
+"""
+
+import re
+from typing import List, Dict, Any, Callable
+import numpy as np
+from app.config import settings
+from app.utils.similarity import cosine_similarity_matrix
+
+class ContextCompressor:
+    """抽取式上下文压缩：只保留与查询最相关的句子"""
+    
+    _SENTENCE_BOUNDARY = re.compile(r'(?<=[。！？!?；;\n])|(?<=\.)\s+')
+    
+    def __init__(self, embed_documents: Callable[[List[str]], List[List[float]]], max_chars: int = None,
+                 min_sentence_chars: int = None):
+        self.embed_documents = embed_documents
+        self.max_chars = max_chars if max_chars is not None else settings.context_compression_max_chars
+        self.min_sentence_chars = min_sentence_chars if min_sentence_chars is not None else settings.context_compression_min_sentence_chars
+    
+    def split_sentences(self, text: str) -> List[str]:
+        """按中英文句末标点和换行切分句子"""
+        sentences = [s.strip() for s in self._SENTENCE_BOUNDARY.split(text)]
+        return [s for s in sentences if len(s) >= self.min_sentence_chars]
+    
+    @staticmethod
+    def _join(sentences: List[str]) -> str:
+        """拼接句子，英文句子之间补空格"""
+        text = ""
+        for sentence in sentences:
+            if text and text[-1].isascii():
+                text += " "
+            text += sentence
+        return text
+    
+    def compress(self, query_vector, chunks: List[str]) -> Dict[str, Any]:
+        """压缩检索块
+        
+        所有句子一次批量向量化，与查询向量做一次矩阵乘法打分，按分数从高到低在字符预算内保留，
+        再按原文顺序拼回各块。重叠块中重复的句子只保留一次。
+        """
+        original_chars = sum(len(chunk) for chunk in chunks)
+        
+        # (块序号, 句子) 列表，重复句子只计一次
+        positions = []
+        seen = set()
+        for chunk_index, chunk in enumerate(chunks):
+            for sentence in self.split_sentences(chunk):
+                if sentence in seen:
+                    continue
+                seen.add(sentence)
+                positions.append((chunk_index, sentence))
+        
+        if not positions or original_chars <= self.max_chars:
+            return {
+                "chunks": list(chunks),
+                "original_chars": original_chars,
+                "compressed_chars": original_chars,
+                "sentences_total": len(positions),
+                "sentences_kept": len(positions)
+            }
+        
+        sentence_vectors = np.asarray(self.embed_documents([sentence for _, sentence in positions]), dtype=np.float32)
+        scores = cosine_similarity_matrix(np.asarray(query_vector, dtype=np.float32).reshape(-1), sentence_vectors)
+        
+        kept = set()
+        used_chars = 0
+        for pos in np.argsort(-scores):
+            length = len(positions[pos][1])
+            if used_chars + length > self.max_chars:
+                continue
+            kept.add(int(pos))
+            used_chars += length
+        
+        compressed = [[] for _ in chunks]
+        for pos, (chunk_index, sentence) in enumerate(positions):
+            if pos in kept:
+                compressed[chunk_index].append(sentence)
+        compressed_chunks = [self._join(sentences) for sentences in compressed]
+        
+        return {
+            "chunks": compressed_chunks,
+            "original_chars": original_chars,
+            "compressed_chars": sum(len(chunk) for chunk in compressed_chunks),
+            "sentences_total": len(positions),
+            "sentences_kept": len(kept)
+        }
@@ -0,0 +1,66 @@
+"""
+RAG上下文打包：按token预算选择和截断检索到的块
+"""
+
+from typing import List, Dict, Any, Optional
+from app.utils.text_processor import TextProcessor
+from app.config import settings
+
+class ContextPacker:
+    """按token预算打包RAG上下文（检索块 + 最近的会话历史）"""
+    
+    def __init__(self, token_budget: int = None, history_token_budget: int = None, text_processor: TextProcessor = None):
+        self.token_budget = token_budget if token_budget is not None else settings.context_token_budget
+        self.history_token_budget = history_token_budget if history_token_budget is not None else settings.history_token_budget
+        self.text_processor = text_processor or TextProcessor()
+        self.separator_tokens = self.text_processor.count_tokens("\n\n")
+    
+    def count_tokens(self, text: str) -> int:
+        """计算文本的token数量"""
+        return self.text_processor.count_tokens(text)
+    
+    def pack(self, query: str, chunks: List[Dict[str, Any]], history: Optional[List[Dict[str, Any]]] = None,
+             template_tokens: int = 0) -> Dict[str, Any]:
+        """在预算内选择检索块和历史
+        
+        chunks 按相关度从高到低排列，每项包含 content，可选 token_count（入库时预先计算）。
+        历史从最近一条向前取，不超过历史预算；剩余预算依次装入检索块，放不下的块跳过。
+        """
+        used = template_tokens + self.count_tokens(query)
+        remaining = max(self.token_budget - used, 0)
+        
+        # 1. 最近的会话历史
+        history_lines = []
+        history_tokens = 0
+        history_limit = min(self.history_token_budget, remaining)
+        for mem in reversed(history or []):
+            line = f"{mem['role']}: {mem['content']}\n"
+            line_tokens = self.count_tokens(line)
+            if history_tokens + line_tokens > history_limit:
+                break
+            history_lines.append(line)
+            history_tokens += line_tokens
+        history_lines.reverse()
+        remaining -= history_tokens
+        
+        # 2. 按相关度装入检索块
+        selected = []
+        chunk_tokens = 0
+        for index, chunk in enumerate(chunks):
+            tokens = chunk.get("token_count")
+            if tokens is None:
+                tokens = self.count_tokens(chunk["content"])
+            cost = tokens + (self.separator_tokens if selected else 0)
+            if chunk_tokens + cost > remaining:
+                continue
+            selected.append(index)
+            chunk_tokens += cost
+        
+        return {
+            "chunk_indices": selected,
+            "context": "\n\n".join(chunks[i]["content"] for i in selected),
+            "history_text": "".join(history_lines),
+            "history_turns": len(history_lines),
+            "chunks_dropped": len(chunks) - len(selected),
+            "prompt_tokens": used + history_tokens + chunk_tokens
+        }
@@ -0,0 +1,420 @@
+"""
+向量缓存：查询向量缓存与入库块向量缓存
+"""
+
+import os
+import re
+import json
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List
+import numpy as np
+from app.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def content_hash(model_name: str, text: str) -> str:
+    """计算 (模型名, 文本) 的内容哈希，作为向量缓存键
+
+    model_name 为缓存命名空间（见 model_registry.cache_namespace），ONNX/量化后端带有后缀。
+    """
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """两级查询向量缓存：进程内LRU + 可选的磁盘持久层（SQLite）
+
+    键为内容哈希，值为float32向量。磁盘层在重启后仍然有效，部署后的预热只需读盘。
+    磁盘写入由后台线程批量提交（一次事务写入积压的全部向量），put() 只更新内存，
+    不会在事件循环上执行SQLite写入和提交。
+    """
+
+    def __init__(self, model_name: str, max_entries: int = None, persist_path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_entries = max_entries if max_entries is not None else settings.embedding_cache_max_entries
+        self.persist_path = persist_path
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 等待写盘的向量：键 -> (维度, 向量字节)
+        self._pending: Dict[str, tuple] = {}
+        self._pending_event = threading.Event()
+        self._write_lock = threading.Lock()
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        if persist_path:
+            self._open_disk(persist_path)
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_writes = 0
+
+    def _open_disk(self, path: str):
+        """打开磁盘缓存（读连接供查询使用，写连接只由后台写入线程和 flush() 使用）"""
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, "
+                "vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._write_conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._write_conn.execute("PRAGMA synchronous=NORMAL")
+            atexit.register(self.flush)
+        except Exception as e:
+            print(f"⚠️ 打开向量磁盘缓存失败，仅使用内存缓存: {e}")
+            self._conn = None
+            self._write_conn = None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """写入内存LRU"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """读取缓存向量，未命中返回None"""
+        key = content_hash(self.model_name, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+            pending = self._pending.get(key)
+            if pending is not None:
+                # 已从内存淘汰但尚未写盘
+                vector = np.frombuffer(pending[1], dtype=np.float32)
+                self._remember(key, vector)
+                self.memory_hits += 1
+                return vector
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                except Exception as e:
+                    print(f"⚠️ 读取向量磁盘缓存失败: {e}")
+                    row = None
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector):
+        """写入缓存向量：立即写入内存，磁盘写入交给后台线程批量提交"""
+        key = content_hash(self.model_name, text)
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            self._remember(key, vector)
+            if self._write_conn is None:
+                return
+            self._pending[key] = (int(vector.shape[0]), vector.tobytes())
+        self._ensure_writer()
+        self._pending_event.set()
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="embedding-cache-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            self._pending_event.wait()
+            self._pending_event.clear()
+            self.flush()
+
+    def flush(self):
+        """把积压的向量在一个事务中写入磁盘（后台线程调用；测试和退出时也可直接调用）"""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending or self._write_conn is None:
+                return
+            now = time.time()
+            try:
+                self._write_conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [(key, self.model_name, dim, data, now) for key, (dim, data) in pending.items()]
+                )
+                self._write_conn.commit()
+                self.disk_writes += len(pending)
+            except Exception as e:
+                print(f"⚠️ 写入向量磁盘缓存失败（{len(pending)} 条）: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        disk_entries = 0
+        if self._conn is not None:
+            try:
+                with self._lock:
+                    disk_entries = self._conn.execute(
+                        "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)
+                    ).fetchone()[0]
+            except Exception:
+                pass
+        return {
+            "model_name": self.model_name,
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk_enabled": self._conn is not None,
+            "disk_entries": disk_entries,
+            "disk_pending": len(self._pending),
+            "disk_writes": self.disk_writes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0
+        }
+
+
+class ChunkEmbeddingStore:
+    """持久化的块向量缓存：float32向量文件（内存映射读取）+ 内容哈希索引
+
+    目录 data/embedding_cache/chunks/<模型>/ 下：
+      vectors.f32  追加写入的float32向量
+      index.txt    每行一个内容哈希，行号即向量所在行
+      meta.json    模型名与向量维度
+      .lock        写入锁（fcntl.flock）
+    入库时先按内容哈希查找，只有未命中的块才调用模型。
+
+    多个进程（多个uvicorn worker、重建索引脚本）可以同时写同一个目录：写入持有文件锁，
+    起始行号按持锁时的向量文件大小计算；其他进程追加的索引行在查找和写入前增量读入。
+    """
+
+    def __init__(self, model_name: str, root_dir: str = None):
+        self.model_name = model_name
+        root_dir = root_dir or os.path.join(settings.data_dir, "embedding_cache", "chunks")
+        self.store_dir = os.path.join(root_dir, re.sub(r'[^A-Za-z0-9._-]+', '_', model_name))
+        self.vectors_file = os.path.join(self.store_dir, "vectors.f32")
+        self.index_file = os.path.join(self.store_dir, "index.txt")
+        self.meta_file = os.path.join(self.store_dir, "meta.json")
+        self.lock_file = os.path.join(self.store_dir, ".lock")
+
+        self.dim: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        # 已读入的索引行数和字节偏移（只读取以换行结尾的完整行）
+        self._row_count = 0
+        self._index_offset = 0
+        self._mmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._load()
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程写入锁；不支持fcntl的平台只有进程内互斥"""
+        with open(self.lock_file, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        if self.dim is None and os.path.exists(self.meta_file):
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f).get("dim")
+
+    def _repair(self):
+        """修复中断写入造成的不一致（需持有文件锁）：去掉不完整的索引行，向量文件截断到索引行数"""
+        if not self.dim:
+            return
+        data = b""
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as f:
+                data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        index_rows = complete.count(b"\n")
+        vector_rows = os.path.getsize(self.vectors_file) // (self.dim * 4) if os.path.exists(self.vectors_file) else 0
+        rows = min(index_rows, vector_rows)
+        if rows != index_rows or len(complete) != len(data):
+            keep = b"".join(complete.splitlines(keepends=True)[:rows])
+            with open(self.index_file, 'wb') as f:
+                f.write(keep)
+            print(f"⚠️ 块向量缓存索引不完整，已修复为 {rows} 行 ({self.model_name})")
+        if os.path.exists(self.vectors_file) and os.path.getsize(self.vectors_file) != rows * self.dim * 4:
+            os.truncate(self.vectors_file, rows * self.dim * 4)
+
+    def _refresh(self):
+        """增量读入其他进程追加的索引行（需持有 self._lock）"""
+        if not self.dim or not os.path.exists(self.index_file):
+            return
+        if os.path.getsize(self.index_file) <= self._index_offset:
+            return
+        with open(self.index_file, 'rb') as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # 向量先于索引写入：完整的索引行对应的向量一定已在文件中
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            key = line.decode('ascii').strip()
+            if key:
+                self._rows.setdefault(key, self._row_count)
+            self._row_count += 1
+        self._index_offset += len(complete)
+
+    def _load(self):
+        """加载哈希索引，并修复中断写入造成的不一致"""
+        try:
+            with self._file_lock():
+                self._read_meta()
+                if not self.dim:
+                    return
+                self._repair()
+            with self._lock:
+                self._refresh()
+            print(f"✅ 加载块向量缓存: {self._row_count} 条 ({self.model_name})")
+        except Exception as e:
+            print(f"⚠️ 加载块向量缓存失败，将重新建立: {e}")
+            self._rows = {}
+            self._row_count = 0
+            self._index_offset = 0
+
+    def _get_mmap(self) -> Optional[np.memmap]:
+        """获取向量文件的内存映射（行数变化后重建）"""
+        rows = self._row_count
+        if rows == 0:
+            return None
+        if self._mmap is None or self._mmap.shape[0] != rows:
+            self._mmap = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self._mmap
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查找块向量，未命中位置为None"""
+        keys = [content_hash(self.model_name, text) for text in texts]
+        with self._lock:
+            if self.dim is None:
+                self._read_meta()
+            self._refresh()
+            rows = [self._rows.get(key) for key in keys]
+            found = [i for i, row in enumerate(rows) if row is not None]
+            results: List[Optional[np.ndarray]] = [None] * len(texts)
+            if found:
+                vectors = self._get_mmap()[[rows[i] for i in found]]
+                for i, vector in zip(found, vectors):
+                    results[i] = vector
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+            return results
+
+    def put_many(self, texts: List[str], vectors):
+        """批量写入块向量（已存在的跳过）"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        with self._lock, self._file_lock():
+            self._read_meta()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_file, 'w', encoding='utf-8') as f:
+                    json.dump({"model_name": self.model_name, "dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                print(f"⚠️ 块向量维度不匹配: 期望 {self.dim}, 实际 {vectors.shape[1]}，跳过缓存")
+                return
+
+            # 持锁后先读入其他进程已写入的行，避免重复写入；有中断写入的残留时先修复
+            self._refresh()
+            if os.path.exists(self.index_file) and os.path.getsize(self.index_file) != self._index_offset or \
+                    os.path.exists(self.vectors_file) and os.path.getsize(self.vectors_file) != self._row_count * self.dim * 4:
+                self._repair()
+            new_keys = []
+            new_rows = []
+            seen = set()
+            for i, text in enumerate(texts):
+                key = content_hash(self.model_name, text)
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(i)
+            if not new_keys:
+                return
+
+            try:
+                # 先写向量再写索引，中断时下一次持锁写入或加载会截断到一致的行数
+                with open(self.vectors_file, 'ab') as f:
+                    f.write(vectors[new_rows].tobytes())
+                with open(self.index_file, 'a', encoding='utf-8') as f:
+                    f.writelines(f"{key}\n" for key in new_keys)
+            except Exception as e:
+                print(f"⚠️ 写入块向量缓存失败: {e}")
+                self._repair()
+                return
+
+            # 行号由持锁期间的文件内容决定
+            self._refresh()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        total = self.hits + self.misses
+        size = os.path.getsize(self.vectors_file) if os.path.exists(self.vectors_file) else 0
+        return {
+            "model_name": self.model_name,
+            "entries": len(self._rows),
+            "dimension": self.dim,
+            "size_mb": round(size / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_chunk_stores: Dict[str, ChunkEmbeddingStore] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    """获取指定模型共享的查询向量缓存（进程内单例）；model_name 为缓存命名空间，见 model_registry.cache_namespace"""
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            persist_path = None
+            if settings.embedding_cache_persist:
+                persist_path = os.path.join(settings.data_dir, "embedding_cache", "query_embeddings.sqlite3")
+            cache = EmbeddingCache(model_name, persist_path=persist_path)
+            _caches[model_name] = cache
+        return cache
+
+
+def get_chunk_embedding_store(model_name: str) -> ChunkEmbeddingStore:
+    """获取指定模型共享的块向量缓存（进程内单例）；model_name 为缓存命名空间，见 model_registry.cache_namespace"""
+    with _caches_lock:
+        store = _chunk_stores.get(model_name)
+        if store is None:
+            store = ChunkEmbeddingStore(model_name)
+            _chunk_stores[model_name] = store
+        return store
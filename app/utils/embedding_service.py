@@ -1,94 +1,223 @@
+import asyncio
 import numpy as np
 from typing import List, Union
-from sentence_transformers import SentenceTransformer
 from app.config import settings
+from app.utils.embedding_cache import get_embedding_cache
+from app.utils.model_registry import get_model, cache_namespace
+from app.utils.micro_batcher import MicroBatchEmbedder, get_micro_batcher
+from app.utils.length_bucketing import plan_length_buckets
+from app.utils.similarity import cosine_similarity_matrix, top_k_similar
+from app.utils.inference_executor import run_inference, run_inference_async, get_inference_stats
 
 class EmbeddingService:
-    """向量化服务"""
+    """向量化服务（模型从进程内共享的注册表借用，多个服务实例不会重复加载）"""
     
-    def __init__(self, model_name: str = None):
+    def __init__(self, model_name: str = None, device: str = None, allow_fallback: bool = True):
         self.model_name = model_name or settings.embedding_model
+        self.device = device or settings.embedding_device
+        self.allow_fallback = allow_fallback
         self.model = None
         self._load_model()
+        # 向量缓存键的模型部分，区分ONNX/量化后端
+        self.cache_namespace = cache_namespace(self.model_name, self.model)
     
     def _load_model(self):
         """加载向量化模型"""
         try:
-            print(f"正在加载向量化模型: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
-            print(f"✅ 成功加载向量化模型: {self.model_name}")
+            self.model = get_model(self.model_name, self.device)
             # 自动打印实际模型名和维度
             print(f"[DEBUG] 实际加载模型: {getattr(self.model, 'name_or_path', 'unknown')}, 维度: {self.model.get_sentence_embedding_dimension()}")
         except Exception as e:
             print(f"❌ 加载模型 {self.model_name} 失败: {e}")
+            if not self.allow_fallback:
+                raise
             # 使用默认模型作为备选
             try:
                 print("🔄 尝试加载备选模型: all-MiniLM-L6-v2")
-                self.model = SentenceTransformer('all-MiniLM-L6-v2')
+                self.model = get_model('all-MiniLM-L6-v2', self.device)
                 self.model_name = 'all-MiniLM-L6-v2'
                 print("✅ 成功加载备选模型")
             except Exception as e2:
                 print(f"❌ 备选模型也加载失败: {e2}")
                 raise RuntimeError(f"无法加载任何向量化模型: {e2}")
     
-    def encode_text(self, text: Union[str, List[str]]) -> Union[List[float], List[List[float]]]:
-        """编码文本为向量"""
+    def _encode(self, text: Union[str, List[str]]) -> np.ndarray:
+        """在推理线程池中执行模型前向计算"""
+        return run_inference(self.model.encode, text, convert_to_numpy=True)
+    
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        """文本的token数（截断到模型最大长度）；取不到分词器时按字符数估计"""
+        max_length = getattr(self.model, 'max_seq_length', None) or 512
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        if tokenizer is not None:
+            try:
+                input_ids = tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+                return [len(ids) for ids in input_ids]
+            except Exception as e:
+                print(f"⚠️ 计算token长度失败，按字符数估计: {e}")
+        return [min(len(text), max_length) for text in texts]
+    
+    def _plan_slices(self, texts: List[str]) -> List[List[int]]:
+        """批量编码的计算批次（原始下标）：按token长度分桶，每批填充后不超过token预算
+        
+        每批单独提交到推理线程，入库的大批量编码之间可以插入查询，查询最多等待一批。
+        """
+        max_tokens = settings.embedding_batch_max_tokens
+        slice_tokens = settings.inference_batch_slice_tokens
+        if slice_tokens > 0:
+            max_tokens = min(max_tokens, slice_tokens) if max_tokens > 0 else slice_tokens
+        if max_tokens <= 0 or len(texts) <= 1:
+            return [list(range(len(texts)))]
+        return plan_length_buckets(self._token_lengths(texts), max_tokens, settings.embedding_batch_max_size)
+    
+    def _encode_slice(self, texts: List[str]) -> np.ndarray:
+        """一批文本一次前向计算（在推理线程中执行）"""
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+    
+    @staticmethod
+    def _assemble(count: int, slices: List[List[int]], results: List[np.ndarray]) -> np.ndarray:
+        """把各批结果按原顺序放回"""
+        embeddings = None
+        for batch, vectors in zip(slices, results):
+            if embeddings is None:
+                embeddings = np.empty((count, vectors.shape[1]), dtype=vectors.dtype)
+            embeddings[batch] = vectors
+        return embeddings
+    
+    def _encode_sliced(self, texts: List[str]) -> np.ndarray:
+        """批量编码：分批提交到推理线程，结果按原顺序返回"""
+        slices = self._plan_slices(texts)
+        if len(slices) == 1:
+            return run_inference(self.model.encode, texts, convert_to_numpy=True)
+        results = [run_inference(self._encode_slice, [texts[i] for i in batch]) for batch in slices]
+        return self._assemble(len(texts), slices, results)
+    
+    def _get_batcher(self) -> MicroBatchEmbedder:
+        """同一模型的所有EmbeddingService实例共享一个微批向量化器"""
+        return get_micro_batcher(self.model_name, self.device, self._encode)
+    
+    def _lookup_query_cache(self, text: str):
+        if not settings.embedding_cache_enabled:
+            return None
+        return get_embedding_cache(self.cache_namespace).get(text)
+    
+    def _store_query_cache(self, text: str, embedding: np.ndarray):
+        if settings.embedding_cache_enabled:
+            get_embedding_cache(self.cache_namespace).put(text, embedding)
+    
+    def _as_vectors(self, embeddings, count: int = None) -> np.ndarray:
+        """统一为连续的float32数组；批量输入为空时返回 (0, 维度)"""
+        if count == 0:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    
+    def _query_vector(self, text: str, embeddings) -> np.ndarray:
+        """写入查询缓存并返回只读向量（缓存与调用方共享同一数组，避免被原地修改）"""
+        embeddings = self._as_vectors(embeddings)
+        self._store_query_cache(text, embeddings)
+        embeddings.setflags(write=False)
+        return embeddings
+    
+    def encode_text(self, text: Union[str, List[str]]) -> np.ndarray:
+        """编码文本为float32向量：单条文本返回 (维度,)，多条返回 (条数, 维度)
+        
+        内部全程使用numpy数组，只在API边界（如响应序列化）转换为列表。
+        """
         if not self.model:
             raise RuntimeError("向量化模型未加载")
         
         try:
-            embeddings = self.model.encode(text, convert_to_numpy=True)
-            
-            # 如果是单个文本，返回一维列表
+            # 单条文本（查询）先查向量缓存，未命中时与其他并发查询合并计算
             if isinstance(text, str):
-                return embeddings.tolist()
-            else:
-                return embeddings.tolist()
+                cached = self._lookup_query_cache(text)
+                if cached is not None:
+                    return cached
+                if settings.embedding_micro_batch_enabled:
+                    embeddings = self._get_batcher().embed(text)
+                else:
+                    embeddings = self._encode(text)
+                return self._query_vector(text, embeddings)
+            
+            if not text:
+                return self._as_vectors(None, 0)
+            return self._as_vectors(self._encode_sliced(text), len(text))
                 
         except Exception as e:
             print(f"向量化失败: {e}")
             raise
     
-    def encode_single_text(self, text: str) -> List[float]:
+    async def aencode_single_text(self, text: str) -> np.ndarray:
+        """异步编码单个文本（查询）：等待期间不阻塞事件循环，并发查询会被合并为一批计算"""
+        if not self.model:
+            raise RuntimeError("向量化模型未加载")
+        
+        cached = self._lookup_query_cache(text)
+        if cached is not None:
+            return cached
+        try:
+            if settings.embedding_micro_batch_enabled:
+                embeddings = await self._get_batcher().aembed(text)
+            else:
+                embeddings = await run_inference_async(self.model.encode, text, convert_to_numpy=True)
+        except Exception as e:
+            print(f"向量化失败: {e}")
+            raise
+        return self._query_vector(text, embeddings)
+    
+    def encode_single_text(self, text: str) -> np.ndarray:
         """编码单个文本"""
         return self.encode_text(text)
     
-    def get_embedding(self, text: str) -> List[float]:
+    def get_embedding(self, text: str) -> np.ndarray:
         """获取文本的向量表示（encode_single_text的别名）"""
         return self.encode_single_text(text)
     
-    def encode_batch_texts(self, texts: List[str]) -> List[List[float]]:
-        """批量编码文本"""
+    def encode_batch_texts(self, texts: List[str]) -> np.ndarray:
+        """批量编码文本，返回 (条数, 维度) 的float32矩阵"""
         return self.encode_text(texts)
     
-    def compute_similarity(self, vec1: List[float], vec2: List[float]) -> float:
+    async def aencode_batch_texts(self, texts: List[str]) -> np.ndarray:
+        """异步批量编码文本：在推理线程池中计算，不阻塞事件循环"""
+        if not self.model:
+            raise RuntimeError("向量化模型未加载")
+        if not texts:
+            return self._as_vectors(None, 0)
+        try:
+            # 分词计算长度也放到线程中，不占用事件循环
+            slices = await asyncio.to_thread(self._plan_slices, texts)
+            if len(slices) == 1:
+                embeddings = await run_inference_async(self.model.encode, texts, convert_to_numpy=True)
+            else:
+                results = [await run_inference_async(self._encode_slice, [texts[i] for i in batch]) for batch in slices]
+                embeddings = self._assemble(len(texts), slices, results)
+            return self._as_vectors(embeddings, len(texts))
+        except Exception as e:
+            print(f"向量化失败: {e}")
+            raise
+    
+    def compute_similarity(self, vec1, vec2) -> float:
         """计算两个向量的余弦相似度"""
-        vec1 = np.array(vec1)
-        vec2 = np.array(vec2)
-        
-        # 计算余弦相似度
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-        
-        similarity = dot_product / (norm1 * norm2)
-        return float(similarity)
+        return float(cosine_similarity_matrix(vec1, np.asarray(vec2, dtype=np.float32).reshape(1, -1))[0])
     
-    def find_most_similar(self, query_vector: List[float], candidate_vectors: List[List[float]], top_k: int = 5) -> List[tuple]:
-        """找到最相似的向量"""
-        similarities = []
-        
-        for i, candidate in enumerate(candidate_vectors):
-            similarity = self.compute_similarity(query_vector, candidate)
-            similarities.append((i, similarity))
-        
-        # 按相似度降序排序
-        similarities.sort(key=lambda x: x[1], reverse=True)
+    def similarity_matrix(self, query_vectors, candidate_vectors, normalized: bool = False) -> np.ndarray:
+        """批量计算余弦相似度：(查询数, 维度) × (候选数, 维度) -> (查询数, 候选数)，单个查询返回 (候选数,)
         
-        return similarities[:top_k]
+        normalized=True 表示输入已归一化，只做一次矩阵乘法。
+        """
+        return cosine_similarity_matrix(query_vectors, candidate_vectors, normalized)
+    
+    def find_most_similar(self, query_vector, candidate_vectors, top_k: int = 5, normalized: bool = False) -> List[tuple]:
+        """找到最相似的向量，返回按相似度降序的 (下标, 相似度)"""
+        indices, scores = top_k_similar(query_vector, candidate_vectors, top_k, normalized)
+        return [(int(i), float(score)) for i, score in zip(indices, scores)]
+    
+    def find_most_similar_batch(self, query_vectors, candidate_vectors, top_k: int = 5,
+                                normalized: bool = False) -> List[List[tuple]]:
+        """多个查询分别找最相似的候选（一次矩阵乘法）"""
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        indices, scores = top_k_similar(query_vectors, candidate_vectors, top_k, normalized)
+        return [[(int(i), float(score)) for i, score in zip(row_indices, row_scores)]
+                for row_indices, row_scores in zip(indices, scores)]
     
     def get_model_info(self) -> dict:
         """获取模型信息"""
@@ -97,7 +226,11 @@ class EmbeddingService:
         
         return {
             "model_name": self.model_name,
+            "backend": getattr(self.model, "backend", "torch"),
             "max_seq_length": getattr(self.model, 'max_seq_length', 'unknown'),
             "embedding_dimension": self.model.get_sentence_embedding_dimension(),
+            "query_cache": get_embedding_cache(self.cache_namespace).get_stats() if settings.embedding_cache_enabled else {},
+            "micro_batch": self._get_batcher().get_stats() if settings.embedding_micro_batch_enabled else {},
+            "inference": get_inference_stats(),
             "status": "loaded"
         } 
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+模型推理专用线程池：同步的torch推理都在这里执行，事件循环只负责等待结果
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional
+from app.config import settings
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def _configure_torch_threads():
+    """设置torch算子内线程数（OpenMP按线程生效，每个推理线程启动时各设置一次）"""
+    if settings.inference_torch_threads <= 0:
+        return
+    try:
+        import torch
+        torch.set_num_threads(settings.inference_torch_threads)
+    except ImportError:
+        pass
+
+
+def _init_worker():
+    _thread_state.is_inference = True
+    _configure_torch_threads()
+
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    """获取共享的推理线程池（进程内单例）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if settings.inference_torch_interop_threads > 0:
+                try:
+                    import torch
+                    torch.set_num_interop_threads(settings.inference_torch_interop_threads)
+                except ImportError:
+                    pass
+                except RuntimeError as e:
+                    # 只能在首次并行计算之前设置
+                    print(f"⚠️ 无法设置torch算子间线程数: {e}")
+            _configure_torch_threads()
+            workers = max(1, settings.inference_workers)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference", initializer=_init_worker)
+            print(f"🧵 推理线程池已启动: {workers} 个线程")
+        return _executor
+
+
+def run_inference(fn: Callable, *args, **kwargs):
+    """在推理线程池中执行并阻塞等待结果（供同步调用方使用）
+
+    已在推理线程中时直接执行，避免线程池等待自身造成死锁。
+    """
+    if getattr(_thread_state, "is_inference", False):
+        return fn(*args, **kwargs)
+    return get_inference_executor().submit(fn, *args, **kwargs).result()
+
+
+async def run_inference_async(fn: Callable, *args, **kwargs):
+    """在推理线程池中执行，等待期间事件循环继续处理其他请求"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def get_inference_stats() -> Dict[str, Any]:
+    """推理线程池配置"""
+    stats = {
+        "workers": max(1, settings.inference_workers),
+        "started": _executor is not None
+    }
+    try:
+        import torch
+        stats["torch_threads"] = torch.get_num_threads()
+        stats["torch_interop_threads"] = torch.get_num_interop_threads()
+    except ImportError:
+        pass
+    return stats
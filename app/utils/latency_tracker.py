@@ -0,0 +1,45 @@
+"""
+分阶段延迟统计：记录各阶段最近的耗时并计算分位数
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Any
+import numpy as np
+
+
+class LatencyTracker:
+    """分阶段延迟统计，每个阶段保留最近 window 次的耗时（毫秒）"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, elapsed_ms: float):
+        """记录一次阶段耗时"""
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(float(elapsed_ms))
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各阶段的次数、平均值、P50/P95和最大值"""
+        with self._lock:
+            snapshot = {stage: np.asarray(samples, dtype=np.float64) for stage, samples in self._samples.items()}
+            counts = dict(self._counts)
+        stats = {}
+        for stage, samples in snapshot.items():
+            if samples.size == 0:
+                continue
+            stats[stage] = {
+                "count": counts.get(stage, 0),
+                "avg_ms": round(float(samples.mean()), 2),
+                "p50_ms": round(float(np.percentile(samples, 50)), 2),
+                "p95_ms": round(float(np.percentile(samples, 95)), 2),
+                "max_ms": round(float(samples.max()), 2)
+            }
+        return stats
@@ -0,0 +1,34 @@
+"""
+批量向量化的长度分桶：按token长度排序，按token预算切分批次
+"""
+
+from typing import List
+
+
+def plan_length_buckets(lengths: List[int], max_tokens: int, max_batch_size: int) -> List[List[int]]:
+    """按长度从长到短排序后切分批次，返回每批的原始下标
+
+    批次按填充后的长度计费：批大小 × 批内最长长度不超过 max_tokens（单条超长的文本独占一批），
+    且不超过 max_batch_size 条。长度相近的文本在同一批，填充浪费最少。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    longest = 0
+    for i in order:
+        # 降序排列：批内最长的就是第一条
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * longest > max_tokens):
+            batches.append(batch)
+            batch = []
+        if not batch:
+            longest = max(lengths[i], 1)
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padding_ratio(lengths: List[int], batches: List[List[int]]) -> float:
+    """填充token占比（用于统计分桶效果）"""
+    padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches if batch)
+    return 1 - sum(lengths) / padded if padded else 0.0
@@ -12,8 +12,8 @@ class LLMService:
         self.api_url = settings.deepseek_api_url
         self.model = settings.deepseek_model
         
-    async def generate_answer(self, query: str, context: List[str], max_tokens: int = 1000) -> str:
-        """生成答案"""
+    async def generate_answer(self, query: str, context: List[str], max_tokens: int = 1000, history_text: str = "") -> str:
+        """生成答案（context 和 history_text 应已按token预算裁剪）"""
         if not self.api_key:
             return self._generate_fallback_answer(query, context)
         
@@ -22,7 +22,7 @@ class LLMService:
             context_text = "\n\n".join(context)
             
             # 构建提示词
-            prompt = self._build_prompt(query, context_text)
+            prompt = self._build_prompt(query, context_text, history_text)
             print("📝 喂给LLM的prompt如下：")
             print(prompt)
             
@@ -34,8 +34,10 @@ class LLMService:
             print(f"调用DeepSeek API失败: {e}")
             return self._generate_fallback_answer(query, context)
     
-    def _build_prompt(self, query: str, context: str) -> str:
+    def _build_prompt(self, query: str, context: str, history_text: str = "") -> str:
         """构建提示词"""
+        if history_text:
+            query = f"历史对话:\n{history_text}\n\n当前问题: {query}"
         prompt = f"""基于以下上下文信息，回答用户的问题。如果上下文中没有相关信息，请说明无法从提供的信息中找到答案。
 
 上下文信息：
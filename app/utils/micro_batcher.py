@@ -0,0 +1,123 @@
+"""
+查询向量微批处理：把并发的单条向量化请求合并为一次批量前向计算
+"""
+
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Tuple, List, Any, Optional
+import numpy as np
+from app.config import settings
+
+
+class MicroBatchEmbedder:
+    """微批向量化器
+
+    调用方提交单条文本并得到一个Future；后台线程取到第一条后最多再等待 max_wait_ms
+    或凑满 max_batch_size 条，然后一次调用 encode_batch 批量计算并分别回填结果。
+    同步调用方用 embed() 阻塞等待，异步调用方用 aembed() 等待而不阻塞事件循环。
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], Any], max_batch_size: int = None,
+                 max_wait_ms: float = None, name: str = "embedding"):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, max_batch_size if max_batch_size is not None else settings.embedding_micro_batch_max_size)
+        self.max_wait = max(0.0, max_wait_ms if max_wait_ms is not None else settings.embedding_micro_batch_max_wait_ms) / 1000
+        self.name = name
+
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+        self.requests = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+
+    def submit(self, text: str) -> Future:
+        """提交一条文本，返回其向量（np.ndarray）的Future"""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name=f"micro-batch-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        """阻塞取第一条，然后在等待窗口内尽量凑批"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # 已在排队的请求直接取走，不再等待
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            # 跳过已被调用方取消的请求；同一批内相同文本只计算一次
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = np.asarray(self.encode_batch(texts), dtype=np.float32)
+                by_text = {text: vectors[i].copy() for i, text in enumerate(texts)}
+                for text, future in batch:
+                    future.set_result(by_text[text])
+            except Exception as e:
+                print(f"❌ 微批向量化失败（{len(batch)} 条）: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            self.requests += len(batch)
+            self.batches += 1
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "max_batch_size_seen": self.max_batch_seen,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000
+        }
+
+
+_batchers: Dict[Tuple[str, str], MicroBatchEmbedder] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_micro_batcher(model_name: str, device: str, encode_batch: Callable[[List[str]], Any]) -> MicroBatchEmbedder:
+    """获取指定模型共享的微批向量化器（进程内单例）"""
+    key = (model_name, device)
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = MicroBatchEmbedder(encode_batch, name=model_name)
+            _batchers[key] = batcher
+        return batcher
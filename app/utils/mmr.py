@@ -0,0 +1,59 @@
+"""
+最大边际相关性（MMR）：在相关性和多样性之间选择检索结果
+"""
+
+from typing import List
+import numpy as np
+from app.utils.similarity import normalize_rows, cosine_similarity_matrix
+
+
+def maximal_marginal_relevance(
+    query_vector,
+    candidate_vectors,
+    k: int,
+    lambda_mult: float = 0.5,
+    duplicate_threshold: float = 1.0
+) -> List[int]:
+    """最大边际相关性（MMR）选择
+
+    一次性计算候选与查询、候选两两之间的余弦相似度矩阵，贪心选择：
+        score = λ * sim(查询, 候选) - (1 - λ) * max sim(候选, 已选)
+    与已选块相似度达到 duplicate_threshold 的候选视为重复直接跳过，
+    因此返回的块数可能少于 k。
+
+    Returns:
+        被选中候选的下标（按选择顺序）
+    """
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    if candidates.ndim != 2 or candidates.shape[0] == 0 or k <= 0:
+        return []
+
+    query = normalize_rows(np.asarray(query_vector, dtype=np.float32).reshape(-1))
+    candidates = normalize_rows(candidates)
+
+    relevance = cosine_similarity_matrix(query, candidates, normalized=True)
+    pairwise = cosine_similarity_matrix(candidates, candidates, normalized=True)
+
+    n = candidates.shape[0]
+    selected: List[int] = []
+    available = np.ones(n, dtype=bool)
+    # 每个候选与已选集合的最大相似度
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+
+    first = int(np.argmax(relevance))
+    selected.append(first)
+    available[first] = False
+    max_sim = np.maximum(max_sim, pairwise[first])
+
+    while len(selected) < k:
+        available &= max_sim < duplicate_threshold
+        if not available.any():
+            break
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_sim
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_sim = np.maximum(max_sim, pairwise[best])
+
+    return selected
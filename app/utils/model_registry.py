@@ -0,0 +1,74 @@
+"""
+进程内共享的向量化模型注册表
+"""
+
+import time
+import threading
+from typing import Dict, Tuple, Any, List, Optional
+from sentence_transformers import SentenceTransformer
+from app.config import settings
+
+# (模型名称, 设备) -> 已加载的模型
+_models: Dict[Tuple[str, str], SentenceTransformer] = {}
+# 每个模型一把加载锁：并发首次访问时只加载一次，不同模型可并行加载
+_loading_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def get_model(model_name: str, device: Optional[str] = None) -> SentenceTransformer:
+    """获取共享的SentenceTransformer模型，同一 (模型, 设备) 在进程内只加载一次"""
+    key = (model_name, device or settings.embedding_device)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        lock = _loading_locks.setdefault(key, threading.Lock())
+    with lock:
+        model = _models.get(key)
+        if model is None:
+            print(f"正在加载向量化模型: {model_name} ({key[1]})")
+            start_time = time.time()
+            model = SentenceTransformer(model_name, device=key[1])
+            print(f"✅ 成功加载向量化模型: {model_name}, 耗时 {time.time() - start_time:.2f}秒")
+            if settings.embedding_backend == "onnx":
+                model = _load_onnx_backend(model_name, key[1], model)
+            _models[key] = model
+    return model
+
+
+def _load_onnx_backend(model_name: str, device: str, model: SentenceTransformer):
+    """切换到ONNX Runtime后端；不可用或一致度校验不通过时继续使用torch模型"""
+    if device != "cpu":
+        print(f"⚠️ ONNX后端只支持CPU，设备 {device} 继续使用torch")
+        return model
+    try:
+        from app.utils.onnx_embedding import load_onnx_model
+        return load_onnx_model(model_name, model)
+    except ImportError as e:
+        print(f"⚠️ ONNX后端依赖未安装（pip install onnx onnxruntime），继续使用torch: {e}")
+    except Exception as e:
+        print(f"⚠️ ONNX后端加载失败，继续使用torch: {e}")
+    return model
+
+
+def cache_namespace(model_name: str, model) -> str:
+    """向量缓存的命名空间：同一模型在不同后端/量化方式下的向量不完全相同，不能共用缓存
+
+    torch后端沿用模型名（兼容已有缓存），ONNX后端附加量化方式，例如 "bge-small-zh#onnx-int8"。
+    """
+    backend = getattr(model, "backend", "torch")
+    if backend == "torch":
+        return model_name
+    quantization = getattr(model, "quantization", None)
+    return f"{model_name}#{backend}-{quantization}" if quantization else f"{model_name}#{backend}"
+
+
+def list_models() -> List[Dict[str, Any]]:
+    """已加载的模型"""
+    return [{
+        "model_name": name,
+        "device": device,
+        "backend": getattr(model, "backend", "torch"),
+        "embedding_dimension": model.get_sentence_embedding_dimension()
+    } for (name, device), model in list(_models.items())]
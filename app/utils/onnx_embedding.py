@@ -0,0 +1,223 @@
+"""
+ONNX Runtime 向量化后端：把SentenceTransformer导出为ONNX并做动态int8量化
+
+只支持 Transformer + Pooling（cls/max/mean/mean_sqrt_len）+ 可选 Normalize 结构的模型，
+池化和归一化在numpy中实现，与SentenceTransformer的计算一致。
+"""
+
+import os
+import re
+import time
+import shutil
+from typing import List, Dict, Any, Union
+import numpy as np
+from app.config import settings
+
+# 导出后用于校验与torch向量一致度的样例文本
+PARITY_TEXTS = [
+    "什么是向量检索？",
+    "检索增强生成（RAG）先从知识库中检索相关文档，再把文档作为上下文交给大模型生成答案。",
+    "苹果是一种常见的水果，富含维生素和膳食纤维。",
+    "FAISS 是一个用于稠密向量相似度搜索和聚类的库。",
+    "How do I reset my password?",
+    "合同约定的付款期限为收到发票后三十个工作日内。",
+    "今天天气不错",
+    "The quick brown fox jumps over the lazy dog.",
+]
+
+_POOLING_MODES = [
+    ("cls", "pooling_mode_cls_token"),
+    ("max", "pooling_mode_max_tokens"),
+    ("mean", "pooling_mode_mean_tokens"),
+    ("mean_sqrt_len", "pooling_mode_mean_sqrt_len_tokens"),
+]
+
+
+def export_dir_for(model_name: str) -> str:
+    """模型的ONNX导出目录"""
+    return os.path.join(settings.data_dir, "onnx_models", re.sub(r"[^\w.-]", "_", model_name))
+
+
+def _model_structure(st_model) -> Dict[str, Any]:
+    """读取SentenceTransformer的池化配置，不支持的结构抛出ValueError"""
+    modules = list(st_model.children())
+    names = [type(module).__name__ for module in modules]
+    if len(modules) < 2 or names[0] != "Transformer" or names[1] != "Pooling" \
+            or any(name != "Normalize" for name in names[2:]):
+        raise ValueError(f"不支持的模型结构: {names}")
+
+    config = modules[1].get_config_dict()
+    supported = {key for _, key in _POOLING_MODES}
+    unsupported = [key for key, value in config.items()
+                   if key.startswith("pooling_mode_") and value and key not in supported]
+    if unsupported:
+        raise ValueError(f"不支持的池化方式: {unsupported}")
+    pooling_modes = [mode for mode, key in _POOLING_MODES if config.get(key)]
+    if not pooling_modes:
+        raise ValueError("模型未配置池化方式")
+    return {
+        "tokenizer": modules[0].tokenizer,
+        "max_seq_length": modules[0].max_seq_length,
+        "pooling_modes": pooling_modes,
+        "normalize": "Normalize" in names[2:],
+        "dimension": st_model.get_sentence_embedding_dimension()
+    }
+
+
+def export_onnx(st_model, export_dir: str):
+    """导出fp32 ONNX模型并生成动态int8量化版本（先写临时目录，完成后改名，多进程同时导出也安全）"""
+    import torch
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    transformer = st_model[0]
+    tokenizer = transformer.tokenizer
+    sample = tokenizer(PARITY_TEXTS[:2], padding=True, truncation=True, return_tensors="pt")
+    input_names = [name for name in tokenizer.model_input_names if name in sample]
+
+    class HiddenStateOutput(torch.nn.Module):
+        """只输出 last_hidden_state，输入按 input_names 顺序传入"""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    tmp_dir = f"{export_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        fp32_path = os.path.join(tmp_dir, "model.onnx")
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+        with torch.no_grad():
+            torch.onnx.export(
+                HiddenStateOutput(transformer.auto_model).eval(),
+                tuple(sample[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+        quantize_dynamic(fp32_path, os.path.join(tmp_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+        try:
+            os.rename(tmp_dir, export_dir)
+        except OSError:
+            # 其他进程已完成导出
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+class OnnxSentenceEncoder:
+    """在ONNX Runtime中运行的句向量模型，encode接口与SentenceTransformer兼容"""
+
+    backend = "onnx"
+
+    def __init__(self, model_path: str, tokenizer, pooling_modes: List[str], normalize: bool,
+                 max_seq_length: int, dimension: int, name_or_path: str):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.onnx_threads > 0:
+            options.intra_op_num_threads = settings.onnx_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [item.name for item in self.session.get_inputs()]
+        self.model_path = model_path
+        self.quantization = "int8" if model_path.endswith(".int8.onnx") else "fp32"
+        self.tokenizer = tokenizer
+        self.pooling_modes = pooling_modes
+        self.normalize = normalize
+        self.max_seq_length = max_seq_length
+        self.dimension = dimension
+        self.name_or_path = name_or_path
+        self.parity: Dict[str, Any] = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        mask = attention_mask[..., None].astype(np.float32)
+        token_counts = np.maximum(mask.sum(axis=1), 1e-9)
+        pooled = []
+        for mode in self.pooling_modes:
+            if mode == "cls":
+                pooled.append(hidden[:, 0])
+            elif mode == "max":
+                pooled.append(np.where(mask > 0, hidden, -1e9).max(axis=1))
+            elif mode == "mean":
+                pooled.append((hidden * mask).sum(axis=1) / token_counts)
+            else:
+                pooled.append((hidden * mask).sum(axis=1) / np.sqrt(token_counts))
+        return np.concatenate(pooled, axis=1)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """编码文本；单条文本返回一维向量"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                     max_length=self.max_seq_length, return_tensors="np")
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            outputs.append(self._pool(hidden, encoded["attention_mask"]))
+        embeddings = np.concatenate(outputs).astype(np.float32)
+        if self.normalize or normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def check_parity(reference_model, candidate_model, texts: List[str] = None) -> Dict[str, Any]:
+    """比较两个模型对同一批文本的向量余弦一致度"""
+    texts = texts or PARITY_TEXTS
+    reference = np.asarray(reference_model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+    candidate = np.asarray(candidate_model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    norms[norms == 0] = 1.0
+    cosines = (reference * candidate).sum(axis=1) / norms
+    return {
+        "samples": len(texts),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min())
+    }
+
+
+def load_onnx_model(model_name: str, st_model) -> OnnxSentenceEncoder:
+    """加载（首次使用时导出）模型的ONNX版本，并校验与torch向量的一致度
+
+    一致度低于 onnx_parity_min_cosine 时抛出ValueError，由调用方回退到torch模型。
+    """
+    structure = _model_structure(st_model)
+    export_dir = export_dir_for(model_name)
+    model_path = os.path.join(export_dir, "model.int8.onnx" if settings.onnx_quantize else "model.onnx")
+    if not os.path.exists(model_path):
+        print(f"🔧 正在导出ONNX模型: {model_name} -> {export_dir}")
+        start_time = time.time()
+        shutil.rmtree(export_dir, ignore_errors=True)
+        export_onnx(st_model, export_dir)
+        print(f"✅ ONNX模型导出完成，耗时 {time.time() - start_time:.2f}秒")
+
+    encoder = OnnxSentenceEncoder(
+        model_path,
+        structure["tokenizer"],
+        structure["pooling_modes"],
+        structure["normalize"],
+        structure["max_seq_length"],
+        structure["dimension"],
+        model_name
+    )
+    encoder.parity = check_parity(st_model, encoder)
+    if encoder.parity["min_cosine"] < settings.onnx_parity_min_cosine:
+        raise ValueError(f"ONNX向量与torch向量一致度不足: 最低余弦 {encoder.parity['min_cosine']:.4f} "
+                         f"< {settings.onnx_parity_min_cosine}")
+    print(f"✅ ONNX向量一致度校验通过: 平均余弦 {encoder.parity['mean_cosine']:.4f}, "
+          f"最低 {encoder.parity['min_cosine']:.4f}")
+    return encoder
@@ -0,0 +1,176 @@
+"""
+文档预处理：清洗、分块、记录块位置和token数
+
+split_document 是纯函数，既在请求线程内直接调用，也在预处理进程池中并行执行，
+两条路径产生完全相同的块和块ID。
+"""
+
+import os
+import uuid
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from app.config import settings
+from app.utils.text_processor import TextProcessor
+
+# 块ID命名空间：块ID = uuid5(命名空间, "文档ID:块序号")，重复入库同一文档得到相同的块ID
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c2a52-3b8e-4d0e-9a57-1f0c4e2b7d11")
+
+# 每个进程各自懒加载一份分块器和tokenizer
+_text_splitter = None
+_text_processor = None
+
+
+def _get_tools():
+    global _text_splitter, _text_processor
+    if _text_splitter is None:
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.chunk_size,
+            chunk_overlap=settings.chunk_overlap,
+            length_function=len,
+            add_start_index=True,  # 记录块在原文中的起始偏移
+        )
+        _text_processor = TextProcessor()
+    return _text_splitter, _text_processor
+
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """当前进程共享的分块器"""
+    return _get_tools()[0]
+
+
+def chunk_id_for(document_id: str, chunk_index: int) -> str:
+    """确定性的块ID"""
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{document_id}:{chunk_index}"))
+
+
+def annotate_chunk(doc: Document, chunk_index: int):
+    """记录块位置（文档内序号、字符偏移）和token数
+
+    位置用于查询时合并相邻块；token数在入库时计算，打包上下文时直接使用。
+    """
+    doc.metadata["chunk_index"] = chunk_index
+    if doc.metadata.get("start_index", -1) >= 0:
+        doc.metadata["end_index"] = doc.metadata["start_index"] + len(doc.page_content)
+    else:
+        doc.metadata.pop("start_index", None)
+    doc.metadata["token_count"] = _get_tools()[1].count_tokens(doc.page_content)
+
+
+def split_document(document: Dict[str, Any], collection_name: str, clean: bool = False) -> List[Document]:
+    """清洗（可选）并分块一个文档
+
+    document 包含 id、title、content，可选 created_at、file_type。
+    """
+    splitter, text_processor = _get_tools()
+    content = document["content"]
+    if clean:
+        content = text_processor.clean_text(content)
+    metadata = {
+        "document_id": document["id"],
+        "title": document["title"],
+        "created_at": document.get("created_at", ""),
+        "file_type": document.get("file_type", ""),
+        "collection": collection_name
+    }
+    chunks = splitter.create_documents([content], metadatas=[metadata])
+    for i, doc in enumerate(chunks):
+        annotate_chunk(doc, i)
+    return chunks
+
+
+class PreprocessPool:
+    """预处理进程池：多个文档并行清洗和分块，按提交顺序返回结果
+
+    同时在途的文档数不超过 max_pending（有界队列），消费方（向量化）处理较慢时
+    不会把整个语料的分块结果堆在内存里。workers<=1 时在当前线程内顺序处理。
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None):
+        workers = workers if workers is not None else settings.preprocess_workers
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.max_pending = max(max_pending if max_pending is not None else settings.preprocess_max_pending, 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn：不继承父进程中已加载的模型和线程状态
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                print(f"✅ 预处理进程池已启动: {self.workers} 个进程")
+            return self._executor
+
+    def _reset(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def split_documents(self, documents: Iterable[Dict[str, Any]], collection_name: str,
+                        clean: bool = None) -> Iterator[List[Document]]:
+        """按输入顺序逐个返回每个文档的块列表"""
+        clean = settings.ingest_clean_text if clean is None else clean
+        if self.workers <= 1:
+            for document in documents:
+                yield split_document(document, collection_name, clean)
+            return
+
+        executor = self._get_executor()
+        pending = deque()
+        documents = iter(documents)
+
+        def take():
+            chunks = pending[0][1].result()
+            pending.popleft()
+            return chunks
+
+        try:
+            for document in documents:
+                try:
+                    future = executor.submit(split_document, document, collection_name, clean)
+                except BrokenProcessPool:
+                    # 文档已经从迭代器中取出，放回队列由下面的降级逻辑处理，避免丢失后结果错位
+                    pending.append((document, None))
+                    raise
+                pending.append((document, future))
+                if len(pending) >= self.max_pending:
+                    yield take()
+            while pending:
+                yield take()
+        except BrokenProcessPool as e:
+            # 工作进程异常退出：重建进程池，剩余文档在当前线程内处理
+            print(f"⚠️ 预处理进程池异常，改为当前线程处理: {e}")
+            self._reset()
+            for document, _ in pending:
+                yield split_document(document, collection_name, clean)
+            for document in documents:
+                yield split_document(document, collection_name, clean)
+        finally:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+
+    def shutdown(self):
+        self._reset()
+
+
+_preprocess_pool: Optional[PreprocessPool] = None
+_preprocess_pool_lock = threading.Lock()
+
+
+def get_preprocess_pool() -> PreprocessPool:
+    """获取共享的预处理进程池（进程内单例）"""
+    global _preprocess_pool
+    with _preprocess_pool_lock:
+        if _preprocess_pool is None:
+            _preprocess_pool = PreprocessPool()
+        return _preprocess_pool
@@ -0,0 +1,66 @@
+"""
+向量相似度计算：矩阵化的余弦相似度和top-k选择
+"""
+
+from typing import Optional, Tuple
+import numpy as np
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """按行L2归一化为float32（一维输入按单个向量处理），零向量保持为零"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def cosine_similarity_matrix(queries, candidates, normalized: bool = False,
+                             candidate_norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """计算查询与候选的余弦相似度
+
+    Args:
+        queries: (维度,) 的单个查询或 (查询数, 维度) 的矩阵
+        candidates: (候选数, 维度) 的矩阵
+        normalized: 输入是否都已归一化（已归一化时只做一次矩阵乘法）
+        candidate_norms: 预先算好的候选行范数，避免每次重算（normalized=False 时使用）
+
+    Returns:
+        单个查询返回 (候选数,)，多个查询返回 (查询数, 候选数)；零向量的相似度为0
+    """
+    candidates = np.asarray(candidates, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    if candidates.ndim != 2 or candidates.shape[0] == 0:
+        return np.zeros(queries.shape[:-1] + (0,), dtype=np.float32)
+    if normalized:
+        return queries @ candidates.T
+
+    queries = normalize_rows(queries)
+    if candidate_norms is None:
+        return queries @ normalize_rows(candidates).T
+    # 不复制候选矩阵：先乘再按范数缩放
+    return (queries @ candidates.T) / np.maximum(candidate_norms, 1e-12)
+
+
+def top_k_indices(scores, k: int) -> np.ndarray:
+    """取分数最高的k个下标（按分数降序）；先用argpartition部分选择，只对选中的k个排序
+
+    一维分数返回 (k,)，二维分数按行选择返回 (行数, k)。
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[-1]
+    k = min(max(k, 0), n)
+    if k == 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def top_k_similar(queries, candidates, k: int, normalized: bool = False,
+                  candidate_norms: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """每个查询与候选中最相似的k个，返回 (下标, 相似度)，形状与 top_k_indices 一致"""
+    similarities = cosine_similarity_matrix(queries, candidates, normalized, candidate_norms)
+    indices = top_k_indices(similarities, k)
+    return indices, np.take_along_axis(similarities, indices, axis=-1)
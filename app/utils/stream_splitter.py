@@ -0,0 +1,192 @@
+"""
+文件流式分块：增量解码字节流，按窗口增量分块，结果与整篇分块一致
+"""
+
+import re
+import codecs
+from collections import deque
+from typing import BinaryIO, Deque, Iterable, Iterator, List, Tuple
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters.character import _split_text_with_regex
+
+
+def iter_text_blocks(stream: BinaryIO, block_size: int = 1 << 20, encoding: str = "utf-8") -> Iterator[str]:
+    """按固定大小读取二进制流并增量解码为文本块
+
+    使用增量解码器，跨块截断的多字节字符会留到下一块再解码；非法字节替换为U+FFFD。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _supports_cut(splitter: RecursiveCharacterTextSplitter) -> bool:
+    """只有分隔符按原文匹配、保留在段首时各段拼起来才是原文，才能按偏移找切点"""
+    return not splitter._is_separator_regex and splitter._keep_separator in (True, "start")
+
+
+def _split_at(text: str, splitter: RecursiveCharacterTextSplitter, level: int) -> List[str]:
+    """从第 level 级分隔符开始分块，level 为 0 时等同于 split_text"""
+    return splitter._split_text(text, splitter._separators[level:])
+
+
+def _safe_cut(text: str, splitter: RecursiveCharacterTextSplitter, separator: str) -> Tuple[int, int]:
+    """在缓冲区中找切点，使分段分块与整篇分块的结果完全相同，返回 (输出到, 续接自)；没有时返回 (0, 0)
+
+    只在给定的分隔符处切（调用方保证整篇分块在这段文本上用的也是它），
+    逐段模拟 TextSplitter._merge_splits 的合并状态：
+    - 某一段超长时整篇分块会先输出、再单独递归切分，之后从空状态重新累积，可以在它前后直接切开；
+    - 下一段放不下时整篇分块会输出当前块，只保留末尾不超过 chunk_overlap 的几段作为重叠。
+      切点之前的文本单独分块，最后一个块正好就是这时输出的块；之后从保留的第一段续接，
+      这几段总长不超过 chunk_size，重新累积时不会提前输出，合并状态与整篇分块相同。
+    最后一段可能被后续文本延长，只在它已经超长时参与判断。
+    """
+    if not separator or separator not in text:
+        return 0, 0
+    # 保留分隔符在段首时各段拼起来就是原文，可以直接累加得到偏移
+    splits = _split_text_with_regex(text, re.escape(separator), keep_separator=splitter._keep_separator)
+    length = splitter._length_function
+    chunk_size, chunk_overlap = splitter._chunk_size, splitter._chunk_overlap
+
+    cut = (0, 0)
+    offset = 0
+    current: Deque[Tuple[int, int]] = deque()  # 当前块中各段的 (长度, 偏移)
+    total = 0
+    for i, split in enumerate(splits):
+        size = length(split)
+        if size >= chunk_size:
+            current.clear()
+            total = 0
+            if i < len(splits) - 1:
+                cut = (offset + len(split), offset + len(split))
+            elif offset > 0:
+                cut = (offset, offset)
+        elif i == len(splits) - 1:
+            break
+        else:
+            if current and total + size > chunk_size:
+                while total > chunk_overlap or (total + size > chunk_size and total > 0):
+                    total -= current.popleft()[0]
+                resume = current[0][1] if current else offset
+                if resume > 0:
+                    cut = (offset, resume)
+            current.append((size, offset))
+            total += size
+        offset += len(split)
+    return cut
+
+
+def split_text_stream(blocks: Iterable[str], splitter: RecursiveCharacterTextSplitter,
+                      window_chars: int) -> Iterator[Tuple[str, int]]:
+    """对文本块流做增量分块，返回 (块文本, 在全文中的字符偏移)，结果与对整篇文本 create_documents 相同
+
+    未分块的文本每累积 window_chars 个字符尝试一次安全切点（见 _safe_cut），切点之前的文本单独分块输出。
+    起始偏移按 create_documents 的规则跨窗口连续计算，为此在切点前保留
+    chunk_size + chunk_overlap 个字符用于查找。create_documents 在大量重复的短文本中可能匹配到
+    更早的相同文本而给出靠前的偏移，这种情况只在回看范围内保持一致。
+
+    没有第一级分隔符（默认为空行）的超长段落，整篇分块会单独用下一级分隔符递归切分。
+    未分块文本超过 4 个窗口且只剩这样一段时，改在段内下一级分隔符处找切点，直到段落结束。
+    段内分隔符按进入时已读到的文本选定，之后才出现更高一级分隔符时结果会与整篇分块略有不同；
+    仍然切不开时强制输出除最后两块以外的块，从倒数第二块续接。内存和耗时都只与窗口大小有关。
+    """
+    chunk_size, overlap = splitter._chunk_size, splitter._chunk_overlap
+    separators = splitter._separators
+    supported = _supports_cut(splitter) and bool(separators[0])
+    # 很短的块会让下一次查找从更靠前的位置开始，回看部分多留一些
+    lookback = chunk_size + overlap
+    max_pending = max(4 * window_chars, 4 * chunk_size)
+    buffer = ""  # 已拼接的文本：回看部分 + 未分块文本
+    parts: List[str] = []  # 还没拼进 buffer 的文本块，尝试切分时才一次拼接
+    parts_len = 0
+    base = 0  # buffer 第一个字符在全文中的偏移
+    pending = 0  # buffer 中未分块文本的起点（之前是用于查找偏移的回看部分）
+    level = 0  # 未分块文本开头所在段落使用的分隔符级别，大于 0 表示正处在超长段落内部
+    next_attempt = window_chars  # 未分块文本达到这个长度时尝试切分
+    index = 0
+    previous_len = 0
+
+    def emit(chunks: List[str]):
+        nonlocal index, previous_len
+        for chunk in chunks:
+            offset = index + previous_len - overlap
+            found = buffer.find(chunk, max(0, offset - base))
+            index = base + found if found >= 0 else -1
+            previous_len = len(chunk)
+            yield chunk, index
+
+    def advance(resume: int):
+        """丢弃续接点和回看范围之前的文本"""
+        nonlocal buffer, base, pending
+        keep_from = max(0, min(index + previous_len - overlap, base + resume - lookback) - base)
+        keep_from = min(keep_from, resume)
+        buffer = buffer[keep_from:]
+        base += keep_from
+        pending = resume - keep_from
+
+    def paragraph_end(text: str) -> int:
+        """超长段落在未分块文本中的结束位置；段首本身的分隔符不算"""
+        separator = separators[0]
+        return text.find(separator, len(separator) if text.startswith(separator) else 0)
+
+    for block in blocks:
+        parts.append(block)
+        parts_len += len(block)
+        if len(buffer) - pending + parts_len < next_attempt:
+            continue
+        buffer += "".join(parts)
+        parts, parts_len = [], 0
+
+        while supported:
+            text = buffer[pending:]
+            if level:
+                end = paragraph_end(text)
+                if end >= 0:
+                    # 超长段落结束，段内剩余部分按进入时的分隔符级别分块
+                    yield from emit(_split_at(text[:end], splitter, level))
+                    advance(pending + end)
+                    level = 0
+                    continue
+            end, resume = _safe_cut(text, splitter, separators[level])
+            if end > 0:
+                yield from emit(_split_at(text[:end], splitter, level))
+                advance(pending + resume)
+                continue
+            if level == 0 and len(text) >= max_pending and \
+                    len(_split_text_with_regex(text, re.escape(separators[0]),
+                                           keep_separator=splitter._keep_separator)) == 1:
+                # 只剩一个超长段落：与整篇分块一样改用段内已出现的下一级分隔符
+                level = next((i for i in range(1, len(separators))
+                              if not separators[i] or separators[i] in text), len(separators) - 1)
+                if separators[level]:
+                    continue
+            break
+
+        pending_len = len(buffer) - pending
+        if pending_len >= max_pending:
+            chunks = _split_at(buffer[pending:], splitter, level)
+            if len(chunks) >= 3:
+                yield from emit(chunks[:-2])
+                last_end = index + previous_len - base
+                found = buffer.find(chunks[-2], max(0, last_end - overlap))
+                advance(found if found > pending else max(last_end, pending + 1))
+                pending_len = len(buffer) - pending
+        next_attempt = pending_len + window_chars
+
+    buffer += "".join(parts)
+    if buffer[pending:]:
+        text = buffer[pending:]
+        end = paragraph_end(text) if level else -1
+        if end >= 0:
+            yield from emit(_split_at(text[:end], splitter, level))
+            advance(pending + end)
+            text, level = buffer[pending:], 0
+        yield from emit(_split_at(text, splitter, level))
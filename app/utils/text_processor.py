@@ -11,6 +11,12 @@ class TextProcessor:
         self.chunk_size = settings.chunk_size
         self.chunk_overlap = settings.chunk_overlap
     
+    def count_tokens(self, text: str) -> int:
+        """计算文本的token数量"""
+        if not text:
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
     def clean_text(self, text: str) -> str:
         """清洗文本"""
         # 移除多余的空白字符
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+向量化后端基准测试：torch 与 ONNX Runtime（int8量化）的一致度、延迟，以及长度分桶的吞吐对比
+
+用法:
+    python scripts/benchmark_embedding.py
+    python scripts/benchmark_embedding.py --model shibing624/text2vec-base-chinese
+    python scripts/benchmark_embedding.py --texts samples.txt   # 每行一条文本（建议用真实文档块）
+    python scripts/benchmark_embedding.py --no-quantize         # 对比fp32 ONNX模型
+"""
+
+import os
+import sys
+import time
+import argparse
+from typing import List, Callable, Dict, Any
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.utils.onnx_embedding import PARITY_TEXTS, check_parity, load_onnx_model
+from app.utils.length_bucketing import plan_length_buckets, padding_ratio
+
+
+def load_texts(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def measure_latency(encode: Callable, texts: List[str], repeat: int) -> Dict[str, float]:
+    """逐条编码（模拟查询），返回毫秒级延迟分位数"""
+    encode(texts[0])  # 预热
+    latencies = []
+    for _ in range(repeat):
+        for text in texts:
+            start = time.perf_counter()
+            encode(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(np.mean(latencies))
+    }
+
+
+def measure_throughput(encode: Callable, texts: List[str], batch_size: int, repeat: int) -> float:
+    """批量编码吞吐（条/秒）"""
+    encode(texts[:batch_size], batch_size=batch_size)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode(texts, batch_size=batch_size)
+    return len(texts) * repeat / (time.perf_counter() - start)
+
+
+def token_lengths(model, texts: List[str]) -> List[int]:
+    max_length = getattr(model, "max_seq_length", None) or 512
+    return [len(ids) for ids in model.tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]]
+
+
+def measure_bucketed_throughput(model, texts: List[str], max_tokens: int, max_batch_size: int, repeat: int) -> float:
+    """按token长度分桶后的批量编码吞吐（条/秒），与 EmbeddingService.encode_batch_texts 的调度一致"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        batches = plan_length_buckets(token_lengths(model, texts), max_tokens, max_batch_size)
+        for batch in batches:
+            model.encode([texts[i] for i in batch], batch_size=len(batch), convert_to_numpy=True)
+    return len(texts) * repeat / (time.perf_counter() - start)
+
+
+def report(name: str, latency: Dict[str, Any], throughput: float):
+    print(f"{name:<8} 单条 p50 {latency['p50_ms']:8.2f}ms  p95 {latency['p95_ms']:8.2f}ms  "
+          f"批量 {throughput:8.1f} 条/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="torch 与 ONNX Runtime 向量化后端基准测试")
+    parser.add_argument("--model", default=settings.embedding_model, help="向量化模型")
+    parser.add_argument("--texts", help="测试文本文件（每行一条），默认使用内置样例")
+    parser.add_argument("--batch-size", type=int, default=32, help="批量编码的批大小")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数")
+    parser.add_argument("--no-quantize", action="store_true", help="使用fp32 ONNX模型而非int8量化模型")
+    args = parser.parse_args()
+
+    if args.no_quantize:
+        settings.onnx_quantize = False
+    # 样例较少时复制到至少一个批次，批量吞吐才有意义
+    texts = load_texts(args.texts) if args.texts else PARITY_TEXTS
+    batch_texts = (texts * (args.batch_size // len(texts) + 1))[:max(len(texts), args.batch_size)]
+
+    from sentence_transformers import SentenceTransformer
+    torch_model = SentenceTransformer(args.model, device="cpu")
+    onnx_model = load_onnx_model(args.model, torch_model)
+    print(f"📦 ONNX模型: {onnx_model.model_path}")
+
+    parity = check_parity(torch_model, onnx_model, texts)
+    print(f"🎯 一致度（{parity['samples']} 条）: 平均余弦 {parity['mean_cosine']:.4f}, 最低 {parity['min_cosine']:.4f}")
+
+    results = {}
+    for name, model in (("torch", torch_model), ("onnx", onnx_model)):
+        latency = measure_latency(lambda text, **kw: model.encode(text, convert_to_numpy=True, **kw), texts, args.repeat)
+        throughput = measure_throughput(
+            lambda batch, **kw: model.encode(batch, convert_to_numpy=True, **kw), batch_texts, args.batch_size, args.repeat
+        )
+        results[name] = (latency, throughput)
+        report(name, latency, throughput)
+
+    torch_latency, torch_throughput = results["torch"]
+    onnx_latency, onnx_throughput = results["onnx"]
+    # 长度分桶：用测试文本（建议传入真实的文档块）对比固定批大小与按token预算分桶
+    lengths = token_lengths(torch_model, batch_texts)
+    fixed_batches = [list(range(i, min(i + args.batch_size, len(lengths)))) for i in range(0, len(lengths), args.batch_size)]
+    bucketed_batches = plan_length_buckets(lengths, settings.embedding_batch_max_tokens, settings.embedding_batch_max_size)
+    print(f"🪣 填充占比: 固定批大小 {padding_ratio(lengths, fixed_batches):.1%}, "
+          f"分桶 {padding_ratio(lengths, bucketed_batches):.1%}（预算 {settings.embedding_batch_max_tokens} token）")
+    for name, model in (("torch", torch_model), ("onnx", onnx_model)):
+        bucketed = measure_bucketed_throughput(model, batch_texts, settings.embedding_batch_max_tokens,
+                                               settings.embedding_batch_max_size, args.repeat)
+        print(f"{name:<8} 分桶批量 {bucketed:8.1f} 条/秒（固定批大小 {results[name][1]:8.1f} 条/秒）")
+
+    print(f"📊 ONNX相对torch: 单条延迟 x{torch_latency['p50_ms'] / onnx_latency['p50_ms']:.2f}, "
+          f"批量吞吐 x{onnx_throughput / torch_throughput:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+全量重建向量索引（可断点续跑）
+
+从现有集合的docstore（按块位置拼回原文）或NDJSON导出文件（每行 title、content，可选 id、
+file_type、created_at）逐个读取文档，分批并行分块、向量化，写入临时目录中的新索引；
+每批写完保存一次并记录检查点，中断后重新运行会从检查点继续。全部完成后把新索引
+发布为版本目录，并原子地切换集合目录（指向版本目录的符号链接）。
+
+用法:
+    python scripts/reindex.py                       # 重建默认集合
+    python scripts/reindex.py --collection books
+    python scripts/reindex.py --source export.jsonl # 从导出文件重建
+    python scripts/reindex.py --restart             # 丢弃检查点从头开始
+
+注意：重建期间不要通过API写入同一集合，替换后需重启服务才会加载新索引。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+from typing import Dict, Any, Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.services.langchain_service import LangChainRAGService
+from app.services.vector_collection import VectorCollection, publish_index
+from app.utils.preprocessing import chunk_id_for
+
+EXPORT_ID_NAMESPACE = uuid.UUID("0b6f3f7e-5a0c-4f4e-8d2a-6c1d9e0a4b27")
+
+
+def iter_export_documents(path: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取NDJSON导出文件；没有id的文档按行号生成确定性ID"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"⚠️ 第 {line_no} 行不是有效的JSON，跳过: {e}")
+                continue
+            if not record.get("content") or not record.get("title"):
+                print(f"⚠️ 第 {line_no} 行缺少 title 或 content，跳过")
+                continue
+            yield {
+                "id": record.get("id") or str(uuid.uuid5(EXPORT_ID_NAMESPACE, f"{line_no}:{record['title']}")),
+                "title": record["title"],
+                "content": record["content"],
+                "created_at": record.get("created_at", ""),
+                "file_type": record.get("file_type", "text")
+            }
+
+
+def load_checkpoint(path: str, source: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except Exception as e:
+        print(f"⚠️ 读取检查点失败，从头开始: {e}")
+        return None
+    if checkpoint.get("source") != source:
+        print(f"⚠️ 检查点来源不一致（{checkpoint.get('source')}），从头开始")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def swap_index(live_path: str, build_path: str, keep_backup: bool):
+    """用新索引目录替换旧索引：线上路径是符号链接，用 os.replace 原子切换（见 publish_index）"""
+    previous = publish_index(live_path, build_path)
+    print(f"✅ 新索引已替换到: {live_path} -> {os.readlink(live_path)}")
+    if previous is None:
+        return
+    if keep_backup:
+        print(f"📦 旧索引备份在: {previous}")
+    else:
+        shutil.rmtree(previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全量重建向量索引（可断点续跑）")
+    parser.add_argument("--collection", default=settings.default_collection, help="要重建的集合")
+    parser.add_argument("--source", default="docstore", help="文档来源：docstore（默认）或NDJSON导出文件路径")
+    parser.add_argument("--batch-documents", type=int, default=settings.bulk_ingest_batch_documents,
+                        help="每批文档数，每批写完保存一次并记录检查点")
+    parser.add_argument("--restart", action="store_true", help="丢弃已有检查点和临时索引，从头开始")
+    parser.add_argument("--keep-backup", action="store_true", help="替换后保留旧索引目录")
+    args = parser.parse_args()
+
+    service = LangChainRAGService()
+    live = service.get_collection(args.collection, create=args.source != "docstore")
+    if live is None:
+        print(f"❌ 集合不存在: {args.collection}")
+        sys.exit(1)
+
+    build_path = f"{live.path}.reindex"
+    checkpoint_path = f"{build_path}.checkpoint.json"
+    source = args.source if args.source == "docstore" else os.path.abspath(args.source)
+
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path, source)
+    if checkpoint is None:
+        if os.path.exists(build_path):
+            shutil.rmtree(build_path)
+        checkpoint = {"source": source, "documents": 0, "chunks": 0}
+    else:
+        print(f"♻️ 从检查点继续: 已完成 {checkpoint['documents']} 个文档, {checkpoint['chunks']} 个块")
+
+    target = VectorCollection(live.name, build_path, service.embeddings)
+    documents = live.iter_documents() if source == "docstore" else iter_export_documents(source)
+
+    print(f"🚀 开始重建集合 {live.name}: 来源 {source}, 每批 {args.batch_documents} 个文档")
+    start_time = time.time()
+    new_chunks = 0
+    skipped = 0
+    batch: List[Dict[str, Any]] = []
+
+    def flush():
+        nonlocal batch, new_chunks
+        if not batch:
+            return
+        counts = service.ingest_batch(batch, target=target)
+        new_chunks += sum(counts.values())
+        checkpoint["documents"] += len(batch)
+        checkpoint["chunks"] += sum(counts.values())
+        save_checkpoint(checkpoint_path, checkpoint)
+        elapsed = time.time() - start_time
+        print(f"📊 已完成 {checkpoint['documents']} 个文档, {checkpoint['chunks']} 个块, "
+              f"{new_chunks / elapsed if elapsed > 0 else 0:.1f} 块/秒")
+        batch = []
+
+    for i, document in enumerate(documents):
+        if i < checkpoint["documents"]:
+            continue
+        # 检查点之后、崩溃之前已保存的文档（块ID是确定性的）
+        if target.get_document(chunk_id_for(document["id"], 0)) is not None:
+            skipped += 1
+            checkpoint["documents"] += 1
+            continue
+        batch.append(document)
+        if len(batch) >= args.batch_documents:
+            flush()
+    flush()
+
+    target.save()
+    elapsed = time.time() - start_time
+    print(f"✅ 重建完成: {checkpoint['documents']} 个文档, {checkpoint['chunks']} 个块"
+          f"（本次 {new_chunks} 个块, 跳过已写入 {skipped} 个文档）, 耗时 {elapsed:.1f}秒, "
+          f"{new_chunks / elapsed if elapsed > 0 else 0:.1f} 块/秒")
+
+    # 先删检查点再替换：替换前中断会从头重建，而不会在替换后误用旧检查点
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    swap_index(live.path, build_path, args.keep_backup)
+    print("ℹ️ 重启服务后生效")
+
+
+if __name__ == "__main__":
+    main()
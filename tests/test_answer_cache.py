@@ -0,0 +1,95 @@
+"""
+语义答案缓存测试
+"""
+
+import numpy as np
+from app.services.answer_cache import SemanticAnswerCache
+
+
+def make_cache(**kwargs) -> SemanticAnswerCache:
+    options = {"similarity_threshold": 0.95, "max_entries": 10, "ttl_seconds": 0}
+    options.update(kwargs)
+    return SemanticAnswerCache(**options)
+
+
+VECTOR = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+NEAR = np.array([0.99, 0.05, 0.0], dtype=np.float32)
+FAR = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+
+
+def test_hit_on_similar_vector_same_chunks():
+    cache = make_cache()
+    cache.store(VECTOR, ["a", "b"], 1, {"answer": "x"})
+
+    result = cache.lookup(NEAR, ["b", "a"], 1)
+    assert result["answer"] == "x"
+    assert result["cache_similarity"] >= 0.95
+
+
+def test_miss_on_dissimilar_vector_or_changed_chunks():
+    cache = make_cache()
+    cache.store(VECTOR, ["a", "b"], 1, {"answer": "x"})
+
+    assert cache.lookup(FAR, ["a", "b"], 1) is None
+    assert cache.lookup(VECTOR, ["a", "c"], 1) is None
+    assert cache.get_stats()["chunk_mismatches"] == 1
+
+
+def test_index_version_change_invalidates_entry():
+    cache = make_cache()
+    cache.store(VECTOR, ["a"], 1, {"answer": "x"})
+
+    assert cache.lookup(VECTOR, ["a"], 2) is None
+    assert cache.get_stats()["entries"] == 0
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_answers_are_isolated_by_history():
+    cache = make_cache()
+    cache.store(VECTOR, ["a"], 1, {"answer": "会话A的答案"}, history_digest="session-a")
+
+    # 另一个会话（不同历史）和无历史的请求都不能复用
+    assert cache.lookup(VECTOR, ["a"], 1, history_digest="session-b") is None
+    assert cache.lookup(VECTOR, ["a"], 1) is None
+    assert cache.get_stats()["history_mismatches"] == 2
+
+    assert cache.lookup(VECTOR, ["a"], 1, history_digest="session-a")["answer"] == "会话A的答案"
+
+
+def test_lru_eviction():
+    cache = make_cache(max_entries=2)
+    vectors = np.eye(3, dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        cache.store(vector, [str(i)], 1, {"answer": i})
+
+    assert cache.get_stats()["entries"] == 2
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.lookup(vectors[0], ["0"], 1) is None
+    assert cache.lookup(vectors[2], ["2"], 1)["answer"] == 2
+
+
+def test_vectors_of_another_dimension_are_skipped():
+    """切换到维度不同的向量模型后，旧条目不参与计算也不报错"""
+    cache = make_cache()
+    cache.store(VECTOR, ["a"], 1, {"answer": "x"})
+
+    assert cache.lookup(np.ones(5, dtype=np.float32), ["a"], 1) is None
+    cache.store(np.ones(5, dtype=np.float32), ["a"], 2, {"answer": "y"})
+    assert cache.get_stats()["entries"] == 1
+    assert cache.lookup(np.ones(5, dtype=np.float32), ["a"], 2)["answer"] == "y"
+
+
+def test_rows_are_reused_in_place():
+    cache = make_cache(max_entries=3)
+    vectors = np.eye(3, dtype=np.float32)
+    for i in range(10):
+        cache.store(vectors[i % 3], [str(i)], 1, {"answer": str(i)})
+    matrix = cache._matrix
+
+    cache.store(vectors[1], ["10"], 1, {"answer": "10"})
+    assert cache._matrix is matrix
+    assert len(matrix) == 3
+    assert cache.lookup(vectors[1], ["10"], 1)["answer"] == "10"
+    assert cache.lookup(vectors[0], ["9"], 1)["answer"] == "9"
+    assert cache.lookup(vectors[2], ["8"], 1)["answer"] == "8"
+    assert cache.get_stats()["evictions"] == 8
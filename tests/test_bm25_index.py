@@ -0,0 +1,86 @@
+"""
+BM25索引与RRF融合测试
+"""
+
+import pytest
+from app.services.bm25_index import BM25Index, reciprocal_rank_fusion
+
+DOCS = {
+    "c1": "向量检索使用FAISS索引",
+    "c2": "BM25是一种关键词检索算法",
+    "c3": "混合检索结合向量检索和关键词检索",
+    "c4": "error code E1234 means timeout",
+    "c5": "苹果是一种水果",
+    "c6": "检索增强生成先检索再生成",
+}
+
+
+def build(items, **kwargs) -> BM25Index:
+    index = BM25Index(**kwargs)
+    index.add_many(items.items())
+    return index
+
+
+def test_tokenize_mixes_cjk_bigrams_and_words():
+    assert BM25Index.tokenize("向量检索 FAISS_v2") == ["向量", "量检", "检索", "faiss_v2"]
+    assert BM25Index.tokenize("猫") == ["猫"]
+
+
+def test_search_ranks_keyword_matches():
+    index = build(DOCS)
+    hits = index.search("关键词检索", top_k=3)
+    assert hits[0][0] in {"c2", "c3"}
+    assert {chunk_id for chunk_id, _ in hits} <= {"c1", "c2", "c3", "c6"}
+    assert index.search("E1234")[0][0] == "c4"
+    assert index.search("不存在的词语") == []
+
+
+def test_scores_after_delete_match_fresh_index():
+    index = build(DOCS, compact_ratio=1.0)
+    index.remove(["c1", "c3"])
+    assert index.get_stats()["tombstones"] == 2
+
+    fresh = build({k: v for k, v in DOCS.items() if k not in {"c1", "c3"}})
+    for query in ("检索", "关键词检索", "水果"):
+        assert index.search(query) == pytest.approx(fresh.search(query))
+
+
+def test_compacts_when_tombstones_exceed_ratio():
+    index = build(DOCS, compact_ratio=0.3)
+    index.remove(["c1"])
+    assert index.get_stats()["tombstones"] == 1
+    index.remove(["c2"])
+    # 2/6 > 0.3，触发压缩
+    assert index.get_stats()["tombstones"] == 0
+    assert len(index) == 4
+    assert index.search("E1234")[0][0] == "c4"
+
+
+def test_add_replaces_existing_chunk():
+    index = build(DOCS)
+    index.add("c5", "香蕉也是一种水果")
+    assert len(index) == len(DOCS)
+    assert index.search("香蕉")[0][0] == "c5"
+    assert index.search("苹果") == []
+
+
+def test_save_load_roundtrip(tmp_path):
+    index = build(DOCS, compact_ratio=1.0)
+    index.remove(["c2"])
+    path = str(tmp_path / "bm25.pkl")
+    index.save(path)
+
+    loaded = BM25Index.load(path)
+    assert len(loaded) == len(DOCS) - 1
+    assert loaded.get_stats()["tombstones"] == 0
+    assert loaded.search("检索") == pytest.approx(index.search("检索"))
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    ids = [item_id for item_id, _ in fused]
+    # b在两路中都靠前，排第一；只出现在一路的按名次排序
+    assert ids[0] == "b"
+    assert ids.index("a") < ids.index("c")
+    assert dict(fused)["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,69 @@
+"""
+批量导入NDJSON流的逐行解析测试（不写入真实索引）
+"""
+
+import asyncio
+import json
+from app.config import settings
+from app.services.document_service import DocumentService
+
+
+class FakeLangChainService:
+    def check_collection_name(self, name):
+        return name or "default"
+
+
+def make_service() -> DocumentService:
+    service = DocumentService.__new__(DocumentService)
+    service.langchain_service = FakeLangChainService()
+    service.ingested = []
+
+    def ingest_window(window):
+        service.ingested.extend(document.title for _, document, _ in window)
+        return [{"line": line_no, "status": "completed", "chunks_count": 1, "error": None}
+                for line_no, _, _ in window]
+
+    service._ingest_bulk_window = ingest_window
+    return service
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def run(service, data: bytes, size: int):
+    return asyncio.run(service.bulk_ingest(chunked(data, size)))
+
+
+def ndjson(titles) -> bytes:
+    return "".join(json.dumps({"title": t, "content": f"内容 {t}"}, ensure_ascii=False) + "\n" for t in titles).encode()
+
+
+def test_lines_split_across_blocks():
+    titles = [f"文档{i}" for i in range(50)]
+    data = ndjson(titles)
+    for size in (1, 7, 64, len(data)):
+        service = make_service()
+        result = run(service, data, size)
+        assert service.ingested == titles
+        assert result["completed"] == 50
+
+
+def test_last_line_without_newline_and_bad_lines():
+    data = ndjson(["a"]) + b"not json\n\n" + ndjson(["b"]).rstrip(b"\n")
+    service = make_service()
+    result = run(service, data, 5)
+    assert service.ingested == ["a", "b"]
+    assert [item["status"] for item in result["results"]] == ["completed", "failed", "completed"]
+    assert [item["line"] for item in result["results"]] == [1, 2, 4]
+
+
+def test_oversized_line_is_skipped(monkeypatch):
+    monkeypatch.setattr(settings, "bulk_ingest_max_line_bytes", 100)
+    data = ndjson(["a"]) + json.dumps({"title": "big", "content": "x" * 500}).encode() + b"\n" + ndjson(["b"])
+    service = make_service()
+    result = run(service, data, 16)
+    assert service.ingested == ["a", "b"]
+    assert [(item["line"], item["status"]) for item in result["results"]] == [(1, "completed"), (2, "failed"), (3, "completed")]
+
@@ -0,0 +1,63 @@
+"""
+相邻块合并与文档还原测试
+"""
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from app.utils.chunk_merger import coalesce_chunks, rebuild_document_text
+
+TEXT = " ".join(f"word{i}" for i in range(80))
+
+
+def split(text: str = TEXT, document_id: str = "doc"):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=50, chunk_overlap=10, length_function=len, add_start_index=True)
+    docs = splitter.create_documents([text], metadatas=[{"document_id": document_id}])
+    for i, doc in enumerate(docs):
+        doc.metadata["chunk_index"] = i
+        doc.metadata["end_index"] = doc.metadata["start_index"] + len(doc.page_content)
+    return docs
+
+
+def hit(docs, i, prefix="c"):
+    return {"chunk_id": f"{prefix}{i}", "score": 1.0 / (i + 1), "document": docs[i]}
+
+
+def test_overlapping_chunks_merge_into_original_text():
+    docs = split()
+    merged = coalesce_chunks([hit(docs, 4), hit(docs, 2), hit(docs, 3), hit(docs, 9)])
+
+    assert [item["chunk_id"] for item in merged] == ["c4", "c9"]
+    doc = merged[0]["document"]
+    start, end = docs[2].metadata["start_index"], docs[4].metadata["end_index"]
+    assert doc.page_content == TEXT[start:end]
+    assert doc.metadata["merged_chunk_ids"] == ["c2", "c3", "c4"]
+    assert doc.metadata["start_index"] == start
+    assert doc.metadata["end_index"] == end
+    assert doc.metadata["chunk_index_end"] == 4
+
+
+def test_non_adjacent_and_other_documents_are_kept():
+    docs = split()
+    other = split(document_id="other")
+    retrieved = [hit(docs, 1), hit(docs, 6), hit(other, 2, prefix="o")]
+    assert coalesce_chunks(retrieved) == retrieved
+
+
+def test_chunks_without_positions_are_kept():
+    retrieved = [
+        {"chunk_id": "a", "score": 1.0, "document": Document(page_content="x", metadata={"document_id": "d"})},
+        {"chunk_id": "b", "score": 0.5, "document": Document(page_content="y", metadata={"document_id": "d"})},
+    ]
+    assert coalesce_chunks(retrieved) == retrieved
+
+
+def test_rebuild_document_text_from_offsets():
+    docs = split()
+    assert rebuild_document_text(docs, overlap=10) == TEXT
+
+
+def test_rebuild_document_text_without_offsets_strips_overlap():
+    docs = split()
+    for doc in docs:
+        doc.metadata.pop("start_index")
+    assert rebuild_document_text(docs, overlap=10) == TEXT
@@ -0,0 +1,141 @@
+"""
+向量缓存测试
+"""
+
+import os
+import multiprocessing
+import numpy as np
+from app.utils.embedding_cache import EmbeddingCache, ChunkEmbeddingStore, content_hash
+from app.utils.model_registry import cache_namespace
+
+
+def test_query_cache_put_does_not_write_disk_until_flush(tmp_path):
+    path = str(tmp_path / "query.sqlite3")
+    cache = EmbeddingCache("model", max_entries=10, persist_path=path)
+    # 阻止后台线程抢先写入，验证 put() 本身不写盘
+    cache._ensure_writer = lambda: None
+
+    cache.put("你好", np.arange(4, dtype=np.float32))
+    assert cache.get_stats()["disk_pending"] == 1
+    assert cache.get_stats()["disk_entries"] == 0
+
+    cache.flush()
+    assert cache.get_stats()["disk_pending"] == 0
+    assert cache.get_stats()["disk_entries"] == 1
+
+
+def test_query_cache_background_writer_persists(tmp_path):
+    path = str(tmp_path / "query.sqlite3")
+    cache = EmbeddingCache("model", max_entries=10, persist_path=path)
+    for i in range(20):
+        cache.put(f"q{i}", np.full(4, i, dtype=np.float32))
+    cache.flush()
+
+    reopened = EmbeddingCache("model", max_entries=10, persist_path=path)
+    assert reopened.get_stats()["disk_entries"] == 20
+    np.testing.assert_array_equal(reopened.get("q7"), np.full(4, 7, dtype=np.float32))
+    assert reopened.get_stats()["disk_hits"] == 1
+
+
+def test_query_cache_serves_pending_entries_evicted_from_memory(tmp_path):
+    cache = EmbeddingCache("model", max_entries=1, persist_path=str(tmp_path / "query.sqlite3"))
+    cache._ensure_writer = lambda: None
+    cache.put("a", np.ones(3, dtype=np.float32))
+    cache.put("b", np.zeros(3, dtype=np.float32))
+
+    np.testing.assert_array_equal(cache.get("a"), np.ones(3, dtype=np.float32))
+    assert cache.get_stats()["misses"] == 0
+
+
+def _vector_for(text: str, dim: int = 8) -> np.ndarray:
+    seed = int(content_hash("model", text)[:8], 16)
+    return np.random.default_rng(seed).random(dim, dtype=np.float32)
+
+
+def _write_chunks(root: str, worker: int, rounds: int):
+    store = ChunkEmbeddingStore("model", root_dir=root)
+    for r in range(rounds):
+        # 每轮包含本进程独有的文本和所有进程共有的文本
+        texts = [f"w{worker}-r{r}-{i}" for i in range(5)] + [f"shared-{r}"]
+        store.put_many(texts, np.stack([_vector_for(text) for text in texts]))
+        # 写入进程自己读到的向量也必须与文本对应
+        for text, vector in zip(texts, store.get_many(texts)):
+            if vector is None or not np.array_equal(vector, _vector_for(text)):
+                os._exit(1)
+
+
+def test_chunk_store_concurrent_writers_keep_rows_aligned(tmp_path):
+    root = str(tmp_path)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_write_chunks, args=(root, w, 20)) for w in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+
+    store = ChunkEmbeddingStore("model", root_dir=root)
+    texts = [f"w{w}-r{r}-{i}" for w in range(4) for r in range(20) for i in range(5)]
+    texts += [f"shared-{r}" for r in range(20)]
+    vectors = store.get_many(texts)
+    assert all(vector is not None for vector in vectors)
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_array_equal(vector, _vector_for(text))
+    # 共有文本只写入一次
+    assert store.get_stats()["entries"] == len(texts)
+    assert os.path.getsize(store.vectors_file) == len(texts) * 8 * 4
+
+
+def test_chunk_store_sees_rows_written_by_another_instance(tmp_path):
+    reader = ChunkEmbeddingStore("model", root_dir=str(tmp_path))
+    writer = ChunkEmbeddingStore("model", root_dir=str(tmp_path))
+    writer.put_many(["a", "b"], np.stack([_vector_for("a"), _vector_for("b")]))
+    reader.put_many(["c"], np.stack([_vector_for("c")]))
+    writer.put_many(["d"], np.stack([_vector_for("d")]))
+
+    for store in (reader, writer):
+        for text, vector in zip("abcd", store.get_many(list("abcd"))):
+            np.testing.assert_array_equal(vector, _vector_for(text))
+
+
+def test_chunk_store_repairs_interrupted_write(tmp_path):
+    store = ChunkEmbeddingStore("model", root_dir=str(tmp_path))
+    store.put_many(["a", "b"], np.stack([_vector_for("a"), _vector_for("b")]))
+    # 模拟中断：多出半行向量和不完整的索引行
+    with open(store.vectors_file, "ab") as f:
+        f.write(b"\0" * 40)
+    with open(store.index_file, "a", encoding="utf-8") as f:
+        f.write("deadbeef")
+
+    reopened = ChunkEmbeddingStore("model", root_dir=str(tmp_path))
+    assert reopened.get_stats()["entries"] == 2
+    reopened.put_many(["c"], np.stack([_vector_for("c")]))
+    for text, vector in zip("abc", reopened.get_many(list("abc"))):
+        np.testing.assert_array_equal(vector, _vector_for(text))
+
+
+class FakeOnnxModel:
+    backend = "onnx"
+
+    def __init__(self, quantization):
+        self.quantization = quantization
+
+
+def test_onnx_backends_use_separate_cache_namespaces(tmp_path):
+    torch_ns = cache_namespace("bge", object())
+    int8_ns = cache_namespace("bge", FakeOnnxModel("int8"))
+    fp32_ns = cache_namespace("bge", FakeOnnxModel("fp32"))
+    assert torch_ns == "bge"
+    assert len({torch_ns, int8_ns, fp32_ns}) == 3
+    assert content_hash(torch_ns, "text") != content_hash(int8_ns, "text")
+
+    # 同一个持久化文件中，不同后端的向量互不覆盖
+    path = str(tmp_path / "query.sqlite3")
+    torch_cache = EmbeddingCache(torch_ns, max_entries=10, persist_path=path)
+    int8_cache = EmbeddingCache(int8_ns, max_entries=10, persist_path=path)
+    torch_cache.put("text", np.ones(4, dtype=np.float32))
+    torch_cache.flush()
+    assert int8_cache.get("text") is None
+
+    store_dirs = {ChunkEmbeddingStore(ns, root_dir=str(tmp_path / "chunks")).store_dir for ns in (torch_ns, int8_ns)}
+    assert len(store_dirs) == 2
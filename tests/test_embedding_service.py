@@ -0,0 +1,82 @@
+"""
+批量向量化测试（使用假模型，不加载真实模型）
+"""
+
+import threading
+import time
+import numpy as np
+from app.config import settings
+from app.utils.embedding_service import EmbeddingService
+from app.utils.inference_executor import run_inference
+
+
+class FakeModel:
+    """向量为 [文本长度, 1]；每次前向计算耗时 encode_seconds"""
+
+    tokenizer = None
+    max_seq_length = 512
+    encode_seconds = 0.0
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        time.sleep(self.encode_seconds)
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        self.calls.append(len(texts))
+        vectors = np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+        return vectors[0] if single else vectors
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+
+def make_service() -> EmbeddingService:
+    service = EmbeddingService.__new__(EmbeddingService)
+    service.model_name = "fake"
+    service.device = "cpu"
+    service.model = FakeModel()
+    return service
+
+
+TEXTS = ["x" * n for n in (100, 20, 300, 50, 100, 250, 10, 80) * 5]
+
+
+def test_batch_encode_is_sliced_and_keeps_order(monkeypatch):
+    monkeypatch.setattr(settings, "inference_batch_slice_tokens", 600)
+    service = make_service()
+    vectors = service.encode_batch_texts(TEXTS)
+
+    assert vectors.shape == (len(TEXTS), 2)
+    assert vectors[:, 0].tolist() == [len(text) for text in TEXTS]
+    assert len(service.model.calls) > 1
+    assert sum(service.model.calls) == len(TEXTS)
+
+
+def test_slicing_disabled_encodes_whole_batch(monkeypatch):
+    monkeypatch.setattr(settings, "inference_batch_slice_tokens", 0)
+    monkeypatch.setattr(settings, "embedding_batch_max_tokens", 0)
+    service = make_service()
+    vectors = service.encode_batch_texts(TEXTS)
+    assert service.model.calls == [len(TEXTS)]
+    assert vectors[:, 0].tolist() == [len(text) for text in TEXTS]
+    assert service.encode_batch_texts([]).shape == (0, 2)
+
+
+def test_query_waits_for_one_slice_not_whole_batch(monkeypatch):
+    monkeypatch.setattr(settings, "inference_batch_slice_tokens", 600)
+    service = make_service()
+    service.model.encode_seconds = 0.05
+
+    ingest = threading.Thread(target=service.encode_batch_texts, args=(TEXTS,))
+    ingest.start()
+    time.sleep(0.02)
+    start = time.perf_counter()
+    run_inference(lambda: None)
+    waited = time.perf_counter() - start
+    ingest.join()
+
+    slices = len(service.model.calls)
+    assert slices >= 5
+    assert waited < 0.05 * 2
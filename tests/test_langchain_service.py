@@ -0,0 +1,81 @@
+"""
+LangChain服务索引版本号和模型切换测试（不加载真实模型和索引）
+"""
+
+import threading
+import weakref
+import numpy as np
+from langchain.schema import Document
+from app.services.answer_cache import SemanticAnswerCache
+from app.services.langchain_service import LangChainRAGService
+from app.services.response_cache import ResponseCache
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+        self.embeddings = None
+        self.retired = False
+        self.added = 0
+
+    def add_embeddings(self, text_embeddings, metadatas, ids, persist=True):
+        self.added += len(ids)
+
+
+class FakeEmbeddings:
+    model_name = "fake-model"
+
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+
+def make_service(collections) -> LangChainRAGService:
+    # 绕开单例，不读取磁盘上的索引
+    service = object.__new__(LangChainRAGService)
+    service.collections = dict(collections)
+    service._collections_lock = threading.Lock()
+    service.index_version = 0
+    service.retrieval_cache = ResponseCache(max_bytes=1 << 20)
+    service._model_caches = weakref.WeakSet()
+    service._embed_chunks = lambda texts, embeddings=None: np.ones((len(texts), 2), dtype=np.float32)
+    return service
+
+
+def chunk(document_id, index):
+    return Document(page_content=f"{document_id} {index}", metadata={"document_id": document_id, "chunk_index": index})
+
+
+def test_only_serving_writes_bump_index_version():
+    live = FakeCollection("default")
+    service = make_service({"default": live})
+
+    service._write_chunks([chunk("doc-1", 0)], live, persist=False)
+    assert service.index_version == 1
+
+    # 同名的影子索引/重建中的临时索引不是线上集合对象
+    shadow = FakeCollection("default")
+    service._write_chunks([chunk("doc-1", 0), chunk("doc-1", 1)], shadow, persist=False)
+    assert shadow.added == 2
+    assert service.index_version == 1
+
+
+def test_switch_clears_registered_caches():
+    service = make_service({"default": FakeCollection("default")})
+    answer_cache = SemanticAnswerCache(similarity_threshold=0.9, max_entries=8, ttl_seconds=60)
+    response_cache = ResponseCache(max_bytes=1 << 20)
+    service.register_model_cache(answer_cache)
+    service.register_model_cache(response_cache)
+    answer_cache.store(np.array([1.0, 0.0]), ["c1"], 0, {"answer": "a"})
+    response_cache.put("key", 0, {"answer": "a"})
+
+    service.switch_serving(FakeEmbeddings(), {"default": FakeCollection("default")})
+
+    assert answer_cache.get_stats()["entries"] == 0
+    assert response_cache.get("key", 0) is None
+    assert service.index_version == 1
+
+
+def test_registered_caches_are_not_kept_alive():
+    service = make_service({})
+    service.register_model_cache(ResponseCache(max_bytes=1 << 20))
+    assert len(service._model_caches) == 0
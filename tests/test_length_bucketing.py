@@ -0,0 +1,48 @@
+"""
+长度分桶测试
+"""
+
+import random
+import pytest
+from app.utils.length_bucketing import plan_length_buckets, padding_ratio
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_buckets_cover_every_index_once_within_budget(seed):
+    rng = random.Random(seed)
+    lengths = [rng.randint(1, 512) for _ in range(rng.randint(1, 300))]
+    max_tokens, max_batch_size = 4096, 32
+    batches = plan_length_buckets(lengths, max_tokens, max_batch_size)
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert 1 <= len(batch) <= max_batch_size
+        longest = max(lengths[i] for i in batch)
+        assert len(batch) * longest <= max_tokens or len(batch) == 1
+        # 批内按长度降序，第一条最长
+        assert lengths[batch[0]] == longest
+
+
+def test_batches_group_similar_lengths():
+    lengths = [10, 500, 12, 480, 11, 490]
+    batches = plan_length_buckets(lengths, max_tokens=1500, max_batch_size=8)
+    assert batches == [[1, 5, 3], [2, 4, 0]]
+
+
+def test_oversized_text_gets_its_own_batch():
+    batches = plan_length_buckets([5000, 10, 10], max_tokens=1000, max_batch_size=8)
+    assert batches == [[0], [1, 2]]
+
+
+def test_zero_lengths_and_empty_input():
+    assert plan_length_buckets([], 100, 4) == []
+    assert plan_length_buckets([0, 0, 0, 0, 0], 100, 4) == [[0, 1, 2, 3], [4]]
+
+
+def test_padding_ratio():
+    lengths = [10, 500, 12, 480, 11, 490]
+    sorted_batches = plan_length_buckets(lengths, max_tokens=1500, max_batch_size=8)
+    naive_batches = [[0, 1, 2], [3, 4, 5]]
+    assert padding_ratio(lengths, sorted_batches) < padding_ratio(lengths, naive_batches)
+    assert padding_ratio([7, 7], [[0, 1]]) == 0.0
+    assert padding_ratio([], []) == 0.0
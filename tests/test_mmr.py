@@ -0,0 +1,64 @@
+"""
+MMR多样化测试
+"""
+
+import numpy as np
+from app.utils.mmr import maximal_marginal_relevance
+
+
+def reference_mmr(query, candidates, k, lambda_mult, duplicate_threshold=1.0):
+    """逐个候选计算的参考实现"""
+    def cos(a, b):
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    selected = [max(range(len(candidates)), key=lambda i: cos(query, candidates[i]))]
+    while len(selected) < k:
+        best, best_score = None, -np.inf
+        for i in range(len(candidates)):
+            if i in selected:
+                continue
+            redundancy = max(cos(candidates[i], candidates[j]) for j in selected)
+            if redundancy >= duplicate_threshold:
+                continue
+            score = lambda_mult * cos(query, candidates[i]) - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        selected.append(best)
+    return selected
+
+
+def test_matches_reference_implementation():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        query = rng.normal(size=16)
+        candidates = rng.normal(size=(30, 16))
+        for lambda_mult in (0.0, 0.5, 1.0):
+            assert maximal_marginal_relevance(query, candidates, 8, lambda_mult) == \
+                reference_mmr(query, candidates, 8, lambda_mult)
+
+
+def test_lambda_one_is_plain_relevance_ranking():
+    rng = np.random.default_rng(1)
+    query = rng.normal(size=8)
+    candidates = rng.normal(size=(10, 8))
+    relevance = candidates @ query / np.linalg.norm(candidates, axis=1)
+    assert maximal_marginal_relevance(query, candidates, 5, lambda_mult=1.0) == \
+        list(np.argsort(-relevance)[:5])
+
+
+def test_near_duplicates_are_dropped():
+    query = np.array([1.0, 0.0, 0.0])
+    candidates = np.array([
+        [1.0, 0.1, 0.0],
+        [1.0, 0.1, 0.001],  # 与第一个几乎相同
+        [0.5, 0.5, 0.5],
+    ])
+    selected = maximal_marginal_relevance(query, candidates, 3, lambda_mult=0.5, duplicate_threshold=0.99)
+    assert selected == [0, 2]
+
+
+def test_empty_inputs():
+    assert maximal_marginal_relevance([1.0, 0.0], np.zeros((0, 2)), 3) == []
+    assert maximal_marginal_relevance([1.0, 0.0], [[1.0, 0.0]], 0) == []
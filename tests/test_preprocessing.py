@@ -0,0 +1,45 @@
+"""
+预处理进程池测试（用假的执行器模拟进程池损坏，不启动子进程）
+"""
+
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from langchain.schema import Document
+from app.utils import preprocessing
+from app.utils.preprocessing import PreprocessPool
+
+
+def fake_split_document(document, collection_name, clean=False):
+    return [Document(page_content=document["content"], metadata={"document_id": document["id"]})]
+
+
+class BreakingExecutor:
+    """前 break_at 次提交正常完成，之后提交时抛出 BrokenProcessPool"""
+
+    def __init__(self, break_at: int):
+        self.break_at = break_at
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        if self.submitted >= self.break_at:
+            raise BrokenProcessPool("worker died")
+        self.submitted += 1
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_pool_broken_during_submit_keeps_every_document(monkeypatch):
+    monkeypatch.setattr(preprocessing, "split_document", fake_split_document)
+    pool = PreprocessPool(workers=2, max_pending=4)
+    executor = BreakingExecutor(break_at=5)
+    monkeypatch.setattr(pool, "_get_executor", lambda: executor)
+    documents = [{"id": f"doc-{i}", "title": "", "content": f"text {i}"} for i in range(12)]
+
+    results = list(pool.split_documents(iter(documents), "test", clean=False))
+
+    assert [chunks[0].metadata["document_id"] for chunks in results] == [d["id"] for d in documents]
+    assert executor.submitted == 5
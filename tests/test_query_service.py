@@ -0,0 +1,69 @@
+"""
+查询服务重排序阶段测试（不加载真实模型和存储）
+"""
+
+import asyncio
+import threading
+import time
+from app.config import settings
+from app.services.query_service import QueryService
+from app.utils.inference_executor import get_inference_executor
+from app.utils.latency_tracker import LatencyTracker
+
+
+class FakeDocument:
+    def __init__(self, text):
+        self.page_content = text
+
+
+class FakeLangChainService:
+    def materialize(self, hits):
+        return [{"chunk_id": chunk_id, "score": score, "document": FakeDocument(chunk_id * 3)}
+                for chunk_id, score in hits]
+
+
+class ReverseReranker:
+    def __init__(self):
+        self.budgets = []
+
+    def rerank(self, query, texts, budget_ms=None):
+        self.budgets.append(budget_ms)
+        order = list(reversed(range(len(texts))))
+        return {"order": order, "scored": len(texts), "timed_out": False, "elapsed_ms": 1.0}
+
+
+def make_service() -> QueryService:
+    service = QueryService.__new__(QueryService)
+    service.langchain_service = FakeLangChainService()
+    service.reranker = ReverseReranker()
+    service.latency = LatencyTracker()
+    return service
+
+
+HITS = [("a", 0.1), ("b", 0.2), ("c", 0.3)]
+
+
+def test_rerank_reorders_within_budget(monkeypatch):
+    monkeypatch.setattr(settings, "rerank_budget_ms", 1000)
+    service = make_service()
+    result = asyncio.run(service._rerank_hits("q", HITS, 3))
+    assert [chunk_id for chunk_id, _ in result] == ["c", "b", "a"]
+
+
+def test_rerank_budget_includes_inference_queue_wait(monkeypatch):
+    """推理线程被入库任务占用时，按预算返回原有顺序，不等待排队"""
+    monkeypatch.setattr(settings, "rerank_budget_ms", 100)
+    service = make_service()
+    release = threading.Event()
+    executor = get_inference_executor()
+    busy = [executor.submit(release.wait, 5) for _ in range(executor._max_workers)]
+
+    start = time.perf_counter()
+    result = asyncio.run(service._rerank_hits("q", HITS, 3))
+    elapsed = time.perf_counter() - start
+    release.set()
+    for future in busy:
+        future.result()
+
+    assert elapsed < 0.5
+    assert [chunk_id for chunk_id, _ in result] == ["a", "b", "c"]
@@ -0,0 +1,89 @@
+"""
+交叉编码器重排序测试（使用假模型，不下载真实模型）
+"""
+
+import time
+import pytest
+from app.services import reranker as reranker_module
+from app.services.reranker import CrossEncoderReranker
+
+
+class FakeCrossEncoder:
+    """按文本长度打分；load_seconds / predict_seconds 模拟加载和推理耗时"""
+
+    load_seconds = 0.0
+    predict_seconds = 0.0
+
+    def __init__(self, model_name, device=None):
+        time.sleep(self.load_seconds)
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        time.sleep(self.predict_seconds)
+        return [float(len(text)) for _, text in pairs]
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    monkeypatch.setattr(FakeCrossEncoder, "load_seconds", 0.0)
+    monkeypatch.setattr(FakeCrossEncoder, "predict_seconds", 0.0)
+    monkeypatch.setattr(reranker_module, "CrossEncoder", FakeCrossEncoder)
+    return FakeCrossEncoder
+
+
+TEXTS = ["a", "aaaa", "aa", "aaa"]
+
+
+def test_warmup_then_rerank_orders_by_score(fake_model):
+    reranker = CrossEncoderReranker("fake", batch_size=2)
+    assert reranker.warmup()
+
+    outcome = reranker.rerank("q", TEXTS, budget_ms=1000)
+    assert outcome["order"] == [1, 3, 2, 0]
+    assert outcome["scored"] == 4
+    assert not outcome["timed_out"]
+
+
+def test_cold_request_falls_back_without_waiting_for_load(fake_model):
+    fake_model.load_seconds = 0.5
+    reranker = CrossEncoderReranker("fake", batch_size=2)
+
+    start = time.perf_counter()
+    outcome = reranker.rerank("q", TEXTS, budget_ms=200)
+    assert (time.perf_counter() - start) < 0.2
+    assert outcome["order"] == [0, 1, 2, 3]
+    assert outcome["scored"] == 0
+    assert reranker.get_stats()["fallbacks"] == 1
+
+    # 后台加载完成后正常重排
+    reranker._loader.join(timeout=5)
+    assert reranker.rerank("q", TEXTS, budget_ms=1000)["order"] == [1, 3, 2, 0]
+
+
+def test_budget_exhaustion_keeps_unscored_tail_in_original_order(fake_model):
+    reranker = CrossEncoderReranker("fake", batch_size=2)
+    reranker.warmup()
+    fake_model.predict_seconds = 0.05
+
+    outcome = reranker.rerank("q", TEXTS, budget_ms=60)
+    assert outcome["timed_out"]
+    assert outcome["scored"] == 2
+    # 前两个已打分按分数排序，后两个保持原顺序
+    assert outcome["order"] == [1, 0, 2, 3]
+
+
+def test_missing_dependency_disables_reranking(monkeypatch):
+    monkeypatch.setattr(reranker_module, "CrossEncoder", None)
+    reranker = CrossEncoderReranker("fake")
+    assert not reranker.warmup()
+    assert not reranker.available
+    assert reranker.rerank("q", TEXTS)["order"] == [0, 1, 2, 3]
+
+
+def test_exhausted_budget_skips_scoring(fake_model):
+    reranker = CrossEncoderReranker("fake", batch_size=2)
+    reranker.warmup()
+
+    outcome = reranker.rerank("q", TEXTS, budget_ms=0)
+    assert outcome["timed_out"]
+    assert outcome["scored"] == 0
+    assert outcome["order"] == [0, 1, 2, 3]
@@ -0,0 +1,65 @@
+"""
+精确匹配响应缓存测试
+"""
+
+import numpy as np
+from app.services.response_cache import ResponseCache
+
+
+def test_key_ignores_whitespace_and_case_after_normalization():
+    a = ResponseCache.make_key("query", ResponseCache.normalize_query("  What  is\tRAG? "), 5)
+    b = ResponseCache.make_key("query", ResponseCache.normalize_query("what is rag?"), 5)
+    assert a == b
+    assert a != ResponseCache.make_key("query", ResponseCache.normalize_query("what is rag?"), 6)
+
+
+def test_version_mismatch_invalidates_entry():
+    cache = ResponseCache(max_bytes=1 << 20)
+    cache.put("k", (1, 0), {"answer": "x"})
+
+    assert cache.get("k", (1, 0)) == {"answer": "x"}
+    assert cache.get("k", (2, 0)) is None
+    # 失效条目已删除，版本恢复后也不会再命中
+    assert cache.get("k", (1, 0)) is None
+    stats = cache.get_stats()
+    assert stats["invalidations"] == 1
+    assert stats["entries"] == 0
+    assert stats["size_bytes"] == 0
+
+
+def test_lru_eviction_by_size():
+    value = "x" * 1000
+    cache = ResponseCache(max_bytes=3500)
+    for key in ("a", "b", "c"):
+        cache.put(key, 0, value)
+    # 访问a，使b成为最久未使用
+    assert cache.get("a", 0) == value
+    cache.put("d", 0, value)
+
+    assert cache.get("b", 0) is None
+    assert cache.get("a", 0) == value
+    assert cache.get("d", 0) == value
+    assert cache.get_stats()["evictions"] == 1
+    assert cache.get_stats()["size_bytes"] <= 3500
+
+
+def test_oversized_value_is_not_cached():
+    cache = ResponseCache(max_bytes=100)
+    cache.put("k", 0, "x" * 1000)
+    assert cache.get("k", 0) is None
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_replacing_key_keeps_size_accounting():
+    cache = ResponseCache(max_bytes=1 << 20)
+    cache.put("k", 0, "x" * 100)
+    cache.put("k", 0, "y" * 10)
+    assert cache.get_stats()["entries"] == 1
+    assert cache.get("k", 0) == "y" * 10
+    assert cache.get_stats()["size_bytes"] < 100
+
+
+def test_vector_digest_is_dtype_stable():
+    vector = [0.1, 0.2, 0.3]
+    assert ResponseCache.vector_digest(vector) == ResponseCache.vector_digest(np.asarray(vector, dtype=np.float64))
+    assert ResponseCache.vector_digest(vector) != ResponseCache.vector_digest([0.1, 0.2, 0.31])
@@ -0,0 +1,80 @@
+"""
+相似度矩阵和top-k选择测试（与逐个计算的循环实现对比）
+"""
+
+import numpy as np
+import pytest
+from app.utils.similarity import normalize_rows, cosine_similarity_matrix, top_k_indices, top_k_similar
+
+
+def loop_cosine(query, candidates):
+    scores = []
+    for candidate in candidates:
+        denominator = np.linalg.norm(query) * np.linalg.norm(candidate)
+        scores.append(float(np.dot(query, candidate) / denominator) if denominator else 0.0)
+    return np.array(scores)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(5, 16)).astype(np.float32), rng.normal(size=(40, 16)).astype(np.float32)
+
+
+def test_similarity_matches_loop(data):
+    queries, candidates = data
+    matrix = cosine_similarity_matrix(queries, candidates)
+    assert matrix.shape == (5, 40)
+    for query, row in zip(queries, matrix):
+        np.testing.assert_allclose(row, loop_cosine(query, candidates), atol=1e-5)
+
+    single = cosine_similarity_matrix(queries[0], candidates)
+    assert single.shape == (40,)
+    np.testing.assert_allclose(single, matrix[0], atol=1e-6)
+
+
+def test_similarity_with_precomputed_norms_and_normalized_inputs(data):
+    queries, candidates = data
+    expected = cosine_similarity_matrix(queries, candidates)
+    norms = np.linalg.norm(candidates, axis=1)
+    np.testing.assert_allclose(cosine_similarity_matrix(queries, candidates, candidate_norms=norms), expected, atol=1e-5)
+    np.testing.assert_allclose(
+        cosine_similarity_matrix(normalize_rows(queries), normalize_rows(candidates), normalized=True), expected, atol=1e-5)
+
+
+def test_zero_vectors_and_empty_candidates(data):
+    queries, candidates = data
+    candidates = candidates.copy()
+    candidates[3] = 0
+    assert cosine_similarity_matrix(queries, candidates)[:, 3].tolist() == [0.0] * 5
+    assert cosine_similarity_matrix(np.zeros(16), candidates).tolist() == [0.0] * 40
+    assert cosine_similarity_matrix(queries, np.zeros((0, 16))).shape == (5, 0)
+    assert cosine_similarity_matrix(queries[0], np.zeros((0, 16))).shape == (0,)
+
+
+@pytest.mark.parametrize("k", [0, 1, 5, 40, 100])
+def test_top_k_indices_matches_full_sort(data, k):
+    queries, candidates = data
+    scores = cosine_similarity_matrix(queries, candidates)
+    indices = top_k_indices(scores, k)
+    expected = np.argsort(-scores, axis=-1, kind="stable")[:, :min(k, 40)]
+    assert indices.shape == expected.shape
+    np.testing.assert_array_equal(np.take_along_axis(scores, indices, axis=-1),
+                                  np.take_along_axis(scores, expected, axis=-1))
+    np.testing.assert_array_equal(top_k_indices(scores[0], k), indices[0])
+
+
+def test_top_k_indices_negative_k_and_ties():
+    assert top_k_indices([0.5, 0.1], -3).shape == (0,)
+    indices = top_k_indices([0.2, 0.9, 0.9, 0.1], 2)
+    assert sorted(indices.tolist()) == [1, 2]
+
+
+def test_top_k_similar(data):
+    queries, candidates = data
+    indices, scores = top_k_similar(queries, candidates, 3)
+    matrix = cosine_similarity_matrix(queries, candidates)
+    assert indices.shape == scores.shape == (5, 3)
+    np.testing.assert_allclose(scores, np.take_along_axis(matrix, indices, axis=-1))
+    np.testing.assert_allclose(scores[:, 0], matrix.max(axis=1))
+    assert np.all(np.diff(scores, axis=1) <= 0)
@@ -0,0 +1,115 @@
+"""
+流式分块测试：多窗口增量分块与整篇分块结果一致
+"""
+
+import io
+import random
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from app.utils.stream_splitter import split_text_stream, iter_text_blocks
+
+WORDS = ["alpha", "beta", "gamma", "delta", "lorem", "ipsum", "x" * 40, "y" * 120]
+
+
+def make_text(seed: int, paragraphs: int = 150) -> str:
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(paragraphs):
+        words = rng.randint(1, rng.choice([5, 40, 200]))
+        parts.append(" ".join(rng.choice(WORDS) for _ in range(words)))
+        parts.append(rng.choice(["\n\n", "\n\n", "\n", " ", "\n\n\n"]))
+    return "".join(parts)
+
+
+def make_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+
+
+def whole_document(text: str, splitter) -> list:
+    return [(doc.page_content, doc.metadata["start_index"]) for doc in splitter.create_documents([text])]
+
+
+def blocks_of(text: str, size: int, consumed: list = None):
+    for i in range(0, len(text), size):
+        if consumed is not None:
+            consumed.append(i)
+        yield text[i:i + size]
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(200, 50), (500, 200), (1000, 0)])
+def test_stream_matches_whole_document(seed, chunk_size, chunk_overlap):
+    text = make_text(seed)
+    splitter = make_splitter(chunk_size, chunk_overlap)
+    streamed = list(split_text_stream(blocks_of(text, 997), splitter, window_chars=2000))
+    assert streamed == whole_document(text, splitter)
+
+
+def test_stream_is_incremental():
+    text = make_text(0)
+    splitter = make_splitter(200, 50)
+    consumed = []
+    chunks = split_text_stream(blocks_of(text, 500, consumed), splitter, window_chars=2000)
+    next(chunks)
+    # 第一个块在读完全文之前就输出了
+    assert len(consumed) < len(text) / 500 / 2
+
+
+def test_tiny_blocks_and_oversized_paragraphs():
+    text = "\n\n".join(("word " * n).strip() for n in (10, 400, 3, 250, 1, 600, 20) * 5)
+    splitter = make_splitter(300, 60)
+    streamed = list(split_text_stream(blocks_of(text, 7), splitter, window_chars=500))
+    assert streamed == whole_document(text, splitter)
+
+
+def test_text_without_paragraph_separator():
+    text = "\n".join(f"line {i} " * 5 for i in range(400))
+    splitter = make_splitter(200, 50)
+    streamed = list(split_text_stream(blocks_of(text, 100), splitter, window_chars=500))
+    assert streamed == whole_document(text, splitter)
+
+
+def test_iter_text_blocks_keeps_multibyte_characters():
+    text = "中文分块测试" * 100
+    blocks = list(iter_text_blocks(io.BytesIO(text.encode("utf-8")), block_size=7))
+    assert "".join(blocks) == text
+    assert "�" not in "".join(blocks)
+
+
+def _max_lag(text: str, splitter, block_size: int, window_chars: int) -> int:
+    """每输出一个块时已读入文本与该块起点的最大距离，即缓冲区需要保留的文本量"""
+    consumed = []
+    lag = 0
+    for chunk, start in split_text_stream(blocks_of(text, block_size, consumed), splitter, window_chars):
+        lag = max(lag, consumed[-1] + block_size - start)
+    return lag
+
+
+@pytest.mark.parametrize("separator", ["\n", " "])
+def test_long_paragraph_keeps_buffer_bounded(separator):
+    """整篇没有空行：缓冲区不随全文增长，结果仍与整篇分块一致"""
+    rng = random.Random(0)
+    text = separator.join(rng.choice(WORDS[:6]) for _ in range(40000))
+    splitter = make_splitter(200, 50)
+    streamed = list(split_text_stream(blocks_of(text, 300), splitter, window_chars=1000))
+    assert streamed == whole_document(text, splitter)
+    assert _max_lag(text, splitter, 300, 1000) < 6000 < len(text) / 20
+
+
+def test_text_without_whitespace():
+    text = "".join(random.Random(1).choice("abcdef") for _ in range(50000))
+    splitter = make_splitter(200, 50)
+    streamed = list(split_text_stream(blocks_of(text, 300), splitter, window_chars=1000))
+    assert streamed == whole_document(text, splitter)
+    assert _max_lag(text, splitter, 300, 1000) < 6000
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(200, 50), (100, 90)])
+def test_short_paragraphs(chunk_size, chunk_overlap):
+    """段落都比重叠还短：切点落在保留重叠的位置，续接后的合并状态与整篇分块相同"""
+    rng = random.Random(2)
+    text = "\n\n".join(" ".join(rng.choice(WORDS[:6]) for _ in range(rng.randint(1, 4))) for _ in range(3000))
+    splitter = make_splitter(chunk_size, chunk_overlap)
+    streamed = list(split_text_stream(blocks_of(text, 50), splitter, window_chars=300))
+    assert streamed == whole_document(text, splitter)
+    assert _max_lag(text, splitter, 50, 300) < 1000
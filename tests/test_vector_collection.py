@@ -0,0 +1,187 @@
+"""
+向量集合测试（使用确定性的假向量模型，不下载真实模型）
+"""
+
+import os
+import threading
+import time
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from app.services import vector_collection as vector_collection_module
+from app.services.vector_collection import VectorCollection, publish_index, recover_index_link
+
+DIM = 16
+
+
+@pytest.fixture
+def embeddings():
+    return DeterministicFakeEmbedding(size=DIM)
+
+
+@pytest.fixture
+def collection(tmp_path, embeddings):
+    return VectorCollection("test", str(tmp_path / "collection"), embeddings)
+
+
+def _add_document(collection, embeddings, document_id, texts, chunk_ids=None, persist=True):
+    vectors = embeddings.embed_documents(texts)
+    metadatas = [{"document_id": document_id, "chunk_index": i} for i in range(len(texts))]
+    ids = chunk_ids or [f"{document_id}-{i}" for i in range(len(texts))]
+    collection.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids, persist=persist)
+    return ids
+
+
+def test_search_not_blocked_by_save(collection, embeddings, monkeypatch):
+    _add_document(collection, embeddings, "doc-1", ["alpha", "beta", "gamma"])
+    query_vector = embeddings.embed_query("alpha")
+
+    saving = threading.Event()
+    original_save_local = collection.vector_store.save_local
+
+    def slow_save_local(path):
+        saving.set()
+        time.sleep(1.0)
+        original_save_local(path)
+
+    monkeypatch.setattr(collection.vector_store, "save_local", slow_save_local)
+    writer = threading.Thread(target=_add_document, args=(collection, embeddings, "doc-2", ["delta"]))
+    writer.start()
+    assert saving.wait(5)
+
+    start = time.perf_counter()
+    hits = collection.dense_search(query_vector, 2)
+    elapsed = time.perf_counter() - start
+    writer.join()
+
+    assert elapsed < 0.5
+    assert hits[0][0] == "doc-1-0"
+    assert collection.total_chunks == 4
+
+
+def test_writers_wait_for_save(collection, embeddings, monkeypatch):
+    """保存期间其他写入方需要等待，保存的是一致的索引"""
+    original_save_local = collection.vector_store.save_local
+    saving = threading.Event()
+    saved_chunks = []
+
+    def slow_save_local(path):
+        saving.set()
+        time.sleep(0.3)
+        saved_chunks.append(collection.total_chunks)
+        original_save_local(path)
+
+    monkeypatch.setattr(collection.vector_store, "save_local", slow_save_local)
+    writer = threading.Thread(target=_add_document, args=(collection, embeddings, "doc-1", ["alpha"]))
+    writer.start()
+    assert saving.wait(5)
+    _add_document(collection, embeddings, "doc-2", ["beta"], persist=False)
+    writer.join()
+
+    assert saved_chunks == [1]
+    assert collection.document_ids() == {"doc-1", "doc-2"}
+
+
+def _assert_consistent(collection):
+    store = collection.vector_store
+    assert store.index.ntotal == len(store.index_to_docstore_id) == len(store.docstore._dict)
+    assert set(store.index_to_docstore_id.values()) == set(store.docstore._dict)
+    assert len(collection.bm25_index) == store.index.ntotal
+
+
+def test_reingest_same_document(collection, embeddings):
+    _add_document(collection, embeddings, "doc-1", ["alpha", "beta", "gamma"])
+    _add_document(collection, embeddings, "doc-1", ["alpha v2", "beta v2", "gamma v2"])
+
+    _assert_consistent(collection)
+    assert collection.total_chunks == 3
+    assert collection.get_document("doc-1-1").page_content == "beta v2"
+    hits = collection.dense_search(embeddings.embed_query("gamma v2"), 3)
+    assert hits[0][0] == "doc-1-2"
+    assert {chunk_id for chunk_id, _ in collection.keyword_search("v2", 5)} == {"doc-1-0", "doc-1-1", "doc-1-2"}
+
+
+def test_reingest_survives_reload(collection, embeddings, tmp_path):
+    _add_document(collection, embeddings, "doc-1", ["alpha", "beta"])
+    _add_document(collection, embeddings, "doc-1", ["alpha v2", "beta v2"])
+    reloaded = VectorCollection("test", collection.path, embeddings)
+    _assert_consistent(reloaded)
+    assert reloaded.get_document("doc-1-0").page_content == "alpha v2"
+
+
+def test_delete_documents_keeps_listed_chunks(collection, embeddings):
+    """重新入库变短的文档：删除旧版本多出来的块"""
+    _add_document(collection, embeddings, "doc-1", ["alpha", "beta", "gamma"])
+    _add_document(collection, embeddings, "doc-2", ["delta"])
+    removed = collection.delete_documents(["doc-1"], keep_chunk_ids={"doc-1-0"})
+    assert removed == 2
+    _assert_consistent(collection)
+    assert collection.document_ids() == {"doc-1", "doc-2"}
+    assert collection.total_chunks == 2
+
+
+def _make_index_dir(path, marker):
+    os.makedirs(path)
+    with open(os.path.join(path, "marker"), "w") as f:
+        f.write(marker)
+
+
+def _read_marker(path):
+    with open(os.path.join(path, "marker")) as f:
+        return f.read()
+
+
+def test_publish_index_replaces_legacy_directory(tmp_path):
+    live = str(tmp_path / "live")
+    _make_index_dir(live, "old")
+    _make_index_dir(live + ".reindex", "new")
+
+    previous = publish_index(live, live + ".reindex")
+
+    assert os.path.islink(live)
+    assert _read_marker(live) == "new"
+    assert _read_marker(previous) == "old"
+    assert not os.path.exists(live + ".reindex")
+
+
+def test_publish_index_switches_link(tmp_path):
+    live = str(tmp_path / "live")
+    _make_index_dir(live + ".build1", "v1")
+    assert publish_index(live, live + ".build1") is None
+    first = os.path.realpath(live)
+
+    _make_index_dir(live + ".build2", "v2")
+    previous = publish_index(live, live + ".build2")
+
+    assert previous == first
+    assert _read_marker(live) == "v2"
+    assert _read_marker(previous) == "v1"
+
+
+def test_recover_interrupted_publish(tmp_path, monkeypatch):
+    """旧目录改名后、链接替换前崩溃：恢复后线上路径指向新索引"""
+    live = str(tmp_path / "live")
+    _make_index_dir(live, "old")
+    _make_index_dir(live + ".reindex", "new")
+
+    def crash(src, dst):
+        raise OSError("crash")
+
+    monkeypatch.setattr(vector_collection_module.os, "replace", crash)
+    with pytest.raises(OSError):
+        publish_index(live, live + ".reindex")
+    monkeypatch.undo()
+    assert not os.path.lexists(live)
+
+    recover_index_link(live)
+    assert _read_marker(live) == "new"
+
+
+def test_collection_loads_through_link(tmp_path, embeddings):
+    live = str(tmp_path / "live")
+    build = VectorCollection("test", live + ".reindex", embeddings)
+    _add_document(build, embeddings, "doc-1", ["alpha", "beta"])
+    publish_index(live, build.path)
+
+    loaded = VectorCollection("test", live, embeddings)
+    assert loaded.document_ids() == {"doc-1"}
+    _assert_consistent(loaded)